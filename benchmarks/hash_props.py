@@ -0,0 +1,50 @@
+"""
+Benchmarks the canonical props hasher against the previous implementation,
+which hashed `str(props)` with SHA-256.
+
+Usage: python benchmarks/hash_props.py
+"""
+
+import hashlib
+import timeit
+
+import numpy as np
+
+from motion.dicts import Properties
+from motion.hashing import canonical_hash, xxhash
+
+
+def str_sha256(obj):
+    return hashlib.sha256(str(obj).encode("utf-8")).hexdigest()
+
+
+PROPS = {
+    "small": Properties({"user_id": 1234, "query": "what is motion?"}),
+    "chat history (50 messages)": Properties(
+        {
+            "user_id": 1234,
+            "messages": [
+                {"role": "user", "content": "lorem ipsum dolor sit amet " * 20}
+                for _ in range(50)
+            ],
+        }
+    ),
+    "document (1 MB)": Properties({"document": "x" * 1_000_000, "top_k": 5}),
+    "embedding (1536 float32)": Properties(
+        {"embedding": np.random.rand(1536).astype(np.float32)}
+    ),
+    "embedding batch (256 x 1536 float32)": Properties(
+        {"embeddings": np.random.rand(256, 1536).astype(np.float32)}
+    ),
+}
+
+
+if __name__ == "__main__":
+    digest = "xxh3_128" if xxhash is not None else "blake2b"
+    print(f"canonical_hash digest: {digest}")
+    print(f"{'props':<40}{'str + sha256':>16}{'canonical':>16}")
+    for name, props in PROPS.items():
+        number = 20
+        old = timeit.timeit(lambda: str_sha256(props), number=number) / number
+        new = timeit.timeit(lambda: canonical_hash(props), number=number) / number
+        print(f"{name:<40}{old * 1e6:>13.1f} us{new * 1e6:>13.1f} us")
@@ -0,0 +1,72 @@
+"""
+Benchmarks the state serializers on a few state shapes, timing a dump and
+a load of each state.
+
+Usage: python benchmarks/serializers.py
+"""
+
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from motion.serializers import (
+    CloudpickleSerializer,
+    MsgpackSerializer,
+    Pickle5Serializer,
+    msgpack,
+)
+
+SERIALIZERS = {
+    "cloudpickle": CloudpickleSerializer(),
+    "pickle5": Pickle5Serializer(),
+    "pickle5 (readonly)": Pickle5Serializer(readonly=True),
+}
+if msgpack is not None:
+    SERIALIZERS["msgpack"] = MsgpackSerializer()
+
+STATES = {
+    "small dict": {"count": 10, "name": "motion", "threshold": 0.5},
+    "JSON-like (1000 records)": {
+        "records": [
+            {"id": i, "text": "lorem ipsum dolor sit amet", "tags": ["a", "b"]}
+            for i in range(1000)
+        ]
+    },
+    "embeddings (10k x 768 float32)": {
+        "embeddings": np.random.rand(10_000, 768).astype(np.float32)
+    },
+    "dataframe (100k rows)": {
+        "df": pd.DataFrame(
+            {
+                "a": np.random.rand(100_000),
+                "b": np.arange(100_000),
+                "c": np.random.rand(100_000).astype(np.float32),
+            }
+        )
+    },
+}
+
+
+def roundtrip(serializer, state):
+    return serializer.loads(serializer.dumps(state))
+
+
+if __name__ == "__main__":
+    print(f"{'state':<36}" + "".join(f"{name:>22}" for name in SERIALIZERS))
+    for state_name, state in STATES.items():
+        row = f"{state_name:<36}"
+        for name, serializer in SERIALIZERS.items():
+            try:
+                serializer.dumps(state)
+            except Exception:
+                # msgpack only handles plain data
+                row += f"{'n/a':>22}"
+                continue
+            number = 10
+            elapsed = (
+                timeit.timeit(lambda: roundtrip(serializer, state), number=number)
+                / number
+            )
+            row += f"{elapsed * 1e3:>19.2f} ms"
+        print(row)
@@ -0,0 +1,461 @@
+"""
+This file contains the content-addressed store that large state values are
+written to, so that the state itself only holds a reference to them.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+
+from motion.redis_scripts import CLAIM_ORPHANS, FORGET_ORPHAN, get_script
+
+# References start with the magic prefix, followed by a JSON header with the
+# hash and location of the blob. References are self-describing, so any
+# reader can resolve them without knowing how the writer's store was set up
+_BLOB_MAGIC = b"MOTION:B"
+
+# Values at least this large (in bytes, after serializing and compressing)
+# are written to the blob store by default
+BLOB_THRESHOLD = 1024 * 1024
+
+# Blobs that are no longer referenced are kept this long (seconds), so
+# readers that loaded an older state version can still fetch them
+BLOB_GRACE_SECONDS = 60 * 60 * 24
+
+# Attempts to record a saved state's blobs before giving up, if other
+# writers keep recording theirs first
+BLOB_COMMIT_ATTEMPTS = 10
+
+DEFAULT_BLOB_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".motion", "blobs")
+DEFAULT_BLOB_CACHE_SIZE = 1024 * 1024 * 1024  # 1 GiB
+
+
+def is_blob_ref(data: Any) -> bool:
+    """Whether a stored value is a reference to a blob."""
+    return isinstance(data, bytes) and data.startswith(_BLOB_MAGIC)
+
+
+def _refs_key(instance_name: str) -> str:
+    # motion.utils imports this module, so import from it here
+    from motion.utils import get_env_prefix
+
+    return f"MOTION_BLOB_REFS:{get_env_prefix()}{instance_name}"
+
+
+def _orphans_key(instance_name: str) -> str:
+    from motion.utils import get_env_prefix
+
+    return f"MOTION_BLOB_ORPHANS:{get_env_prefix()}{instance_name}"
+
+
+class BlobCache:
+    """Local, on-disk cache of blobs by hash. Blobs are content-addressed,
+    so cached blobs never go stale. The least recently used blobs are
+    evicted once the cache grows past `max_bytes`.
+
+    The directory is listed once, when the cache is created, and its size
+    is tracked from then on. Blobs other processes add to the same
+    directory are counted once this process reads them.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # Sizes of the cached blobs, from least to most recently used
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, sha, size in sorted(entries):
+            self._track(sha, size)
+
+    def _track(self, sha: str, size: int) -> None:
+        with self._lock:
+            self._total += size - self._sizes.pop(sha, 0)
+            self._sizes[sha] = size
+
+    def get(self, sha: str) -> Optional[bytes]:
+        path = os.path.join(self.directory, sha)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._sizes.pop(sha, 0)
+            return None
+        # Mark the blob as recently used
+        os.utime(path)
+        self._track(sha, len(data))
+        return data
+
+    def put(self, sha: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        _write_atomic(os.path.join(self.directory, sha), data)
+        self._track(sha, len(data))
+        self._evict()
+
+    def _evict(self) -> None:
+        while True:
+            with self._lock:
+                if self._total <= self.max_bytes or not self._sizes:
+                    return
+                sha, size = self._sizes.popitem(last=False)
+                self._total -= size
+            try:
+                os.remove(os.path.join(self.directory, sha))
+            except FileNotFoundError:
+                pass
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Writes a file so that readers never see it partially written."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class BlobStore:
+    """Stores state values above a size threshold by content hash, outside
+    the state. The state keeps a small reference instead, so saving a state
+    whose large values didn't change doesn't rewrite them, and instances
+    only fetch a large value when its hash changes, from a local cache if
+    they fetched it before.
+
+    Usage:
+    ```python
+    from motion import Component
+    from motion.blobs import BlobStore
+
+    MyComponent = Component(
+        "MyComponent",
+        blob_store=BlobStore(threshold=10 * 1024 * 1024),
+    )
+    ```
+
+    Blobs are scoped to an instance and deduplicated across its versions.
+    Blobs that are no longer referenced are deleted a day after they were
+    replaced, so readers of older versions can still fetch them.
+    """
+
+    def __init__(
+        self,
+        threshold: int = BLOB_THRESHOLD,
+        directory: Optional[str] = None,
+        cache_dir: Optional[str] = DEFAULT_BLOB_CACHE_DIR,
+        cache_size: int = DEFAULT_BLOB_CACHE_SIZE,
+    ) -> None:
+        """Creates a blob store.
+
+        Args:
+            threshold (int, optional): Values at least this many bytes
+                (after serializing and compressing) are stored as blobs.
+                Defaults to 1 MiB.
+            directory (Optional[str], optional): Directory to store blobs
+                in, e.g., on a filesystem shared by all hosts running the
+                component. Defaults to None, which stores blobs in Redis.
+            cache_dir (Optional[str], optional): Directory to cache fetched
+                blobs in. Defaults to `~/.motion/blobs`. Set to None to
+                disable the cache.
+            cache_size (int, optional): Maximum size of the cache in bytes.
+                Defaults to 1 GiB.
+        """
+        self.threshold = threshold
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self._cache: Optional[BlobCache] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_cache"] = None
+        return state
+
+    @property
+    def cache(self) -> Optional[BlobCache]:
+        if self._cache is None and self.cache_dir is not None:
+            self._cache = BlobCache(self.cache_dir, self.cache_size)
+        return self._cache
+
+    def _location(self, instance_name: str, sha: str) -> Dict[str, str]:
+        from motion.utils import get_env_prefix
+
+        if self.directory is not None:
+            return {
+                "path": os.path.join(
+                    self.directory, get_env_prefix().rstrip(":"), instance_name, sha
+                )
+            }
+        return {"key": f"MOTION_BLOB:{get_env_prefix()}{instance_name}/{sha}"}
+
+    def offload(
+        self, redis_con: redis.Redis, instance_name: str, values: Dict[str, bytes]
+    ) -> Tuple[Dict[str, bytes], Dict[str, Optional[str]]]:
+        """Writes the values at or above the threshold to the store,
+        skipping blobs that are already there.
+
+        Args:
+            redis_con (redis.Redis): Redis connection.
+            instance_name (str): Instance the values belong to.
+            values (Dict[str, bytes]): Serialized values by state key.
+
+        Returns:
+            Tuple[Dict[str, bytes], Dict[str, Optional[str]]]: References
+            to the values that were offloaded, by state key, and the hash
+            of each key's blob (None if the value wasn't offloaded), to
+            pass to `commit` once the state is saved.
+        """
+        refs: Dict[str, bytes] = {}
+        shas: Dict[str, Optional[str]] = {}
+        blobs: Dict[str, Tuple[Dict[str, str], bytes]] = {}
+        for key, data in values.items():
+            if len(data) < self.threshold:
+                shas[key] = None
+                continue
+
+            sha = hashlib.sha256(data).hexdigest()
+            location = self._location(instance_name, sha)
+            shas[key] = sha
+            refs[key] = _BLOB_MAGIC + json.dumps(
+                {"sha": sha, "size": len(data), **location}
+            ).encode("utf-8")
+            blobs[sha] = (location, data)
+
+        if not blobs:
+            return refs, shas
+
+        # Only write the blobs that aren't stored yet. Blobs that were
+        # orphaned are taken out of the orphans before the state is saved,
+        # so they aren't swept once it references them, and are written
+        # again, since a sweep may be deleting them
+        orphans_key = _orphans_key(instance_name)
+        pipeline = redis_con.pipeline()
+        for sha, (location, _) in blobs.items():
+            pipeline.zscore(orphans_key, sha)
+            if self.directory is None:
+                pipeline.exists(location["key"])
+        pipeline.zrem(orphans_key, *blobs)
+        results = pipeline.execute()[:-1]
+        if self.directory is not None:
+            orphaned = [score is not None for score in results]
+            exists = [
+                os.path.exists(location["path"]) for location, _ in blobs.values()
+            ]
+        else:
+            orphaned = [score is not None for score in results[::2]]
+            exists = results[1::2]
+
+        pipeline = redis_con.pipeline(transaction=False)
+        for (sha, (location, data)), stored, was_orphaned in zip(
+            blobs.items(), exists, orphaned
+        ):
+            if stored and not was_orphaned:
+                continue
+            if self.directory is not None:
+                os.makedirs(os.path.dirname(location["path"]), exist_ok=True)
+                _write_atomic(location["path"], data)
+            else:
+                pipeline.set(location["key"], data)
+            # The writer is likely to read its own blobs back
+            if self.cache is not None:
+                self.cache.put(sha, data)
+        pipeline.execute()
+
+        return refs, shas
+
+    def commit(
+        self,
+        redis_con: redis.Redis,
+        instance_name: str,
+        version: int,
+        shas: Dict[str, Optional[str]],
+        replace_all: bool,
+    ) -> None:
+        """Records the blobs a saved state references, and schedules the
+        blobs it no longer references for deletion.
+
+        Args:
+            redis_con (redis.Redis): Redis connection.
+            instance_name (str): Instance whose state was saved.
+            version (int): Version the state was saved as.
+            shas (Dict[str, Optional[str]]): Hashes returned by `offload`.
+            replace_all (bool): Whether the saved state replaced every key,
+                rather than only the keys in `shas`.
+        """
+        refs_key = _refs_key(instance_name)
+        orphans_key = _orphans_key(instance_name)
+
+        for _ in range(BLOB_COMMIT_ATTEMPTS):
+            with redis_con.pipeline() as pipeline:
+                try:
+                    pipeline.watch(refs_key)
+                    old_refs = {
+                        k.decode("utf-8"): v.decode("utf-8")
+                        for k, v in pipeline.hgetall(refs_key).items()  # type: ignore
+                    }
+                    if int(old_refs.pop("__version__", 0)) > version:
+                        # A newer state's references were already recorded.
+                        # The blobs only this state references are orphaned
+                        # now, so readers of this version can still fetch
+                        # them for the grace period
+                        live = set(old_refs.values())
+                        orphans = {sha for sha in shas.values() if sha} - live
+                        pipeline.multi()
+                        if orphans:
+                            pipeline.zadd(
+                                orphans_key, {sha: time.time() for sha in orphans}
+                            )
+                        if live:
+                            pipeline.zrem(orphans_key, *live)
+                        pipeline.execute()
+                        return
+
+                    new_refs = {} if replace_all else dict(old_refs)
+                    for key, sha in shas.items():
+                        if sha is None:
+                            new_refs.pop(key, None)
+                        else:
+                            new_refs[key] = sha
+                    live = set(new_refs.values())
+                    orphans = set(old_refs.values()) - live
+
+                    pipeline.multi()
+                    pipeline.delete(refs_key)
+                    pipeline.hset(
+                        refs_key, mapping={"__version__": version, **new_refs}
+                    )
+                    if orphans:
+                        pipeline.zadd(
+                            orphans_key, {sha: time.time() for sha in orphans}
+                        )
+                    if live:
+                        pipeline.zrem(orphans_key, *live)
+                    pipeline.execute()
+                    break
+                except redis.WatchError:
+                    # Another writer recorded its references first
+                    continue
+        else:
+            # The blobs this state references were taken out of the orphans
+            # when they were offloaded, so they are kept until a later save
+            # records them
+            return
+
+        self._sweep(redis_con, instance_name)
+
+    def _sweep(self, redis_con: redis.Redis, instance_name: str) -> None:
+        """Deletes blobs that have been unreferenced for the grace period.
+
+        Writers take blobs out of the orphans before reusing them, so blobs
+        are claimed first and only deleted if no writer took them out of the
+        orphans in the meantime. Blobs in Redis are deleted along with their
+        orphan entries in one step. Files are moved aside first.
+        """
+        orphans_key = _orphans_key(instance_name)
+        cutoff = time.time() - BLOB_GRACE_SECONDS
+        claimed = get_script(redis_con, CLAIM_ORPHANS)(
+            keys=[orphans_key], args=[cutoff]
+        )
+        forget_orphan = get_script(redis_con, FORGET_ORPHAN)
+        if self.directory is None:
+            # The blob keys are passed as keys, so the scripts declare every
+            # key they touch
+            pipeline = redis_con.pipeline(transaction=False)
+            for sha in claimed:
+                sha = sha.decode("utf-8")
+                forget_orphan(
+                    keys=[orphans_key, self._location(instance_name, sha)["key"]],
+                    args=[sha],
+                    client=pipeline,
+                )
+            pipeline.execute()
+            return
+
+        for sha in claimed:
+            sha = sha.decode("utf-8")
+            path = self._location(instance_name, sha)["path"]
+            deleted_path = f"{path}.{uuid.uuid4().hex}.deleted"
+            try:
+                os.rename(path, deleted_path)
+            except FileNotFoundError:
+                deleted_path = ""
+
+            if forget_orphan(keys=[orphans_key], args=[sha]):
+                if deleted_path:
+                    os.remove(deleted_path)
+            elif deleted_path:
+                # A writer reused the blob while it was being deleted
+                os.replace(deleted_path, path)
+
+
+def load_blob(
+    redis_con: redis.Redis, ref: bytes, cache: Optional[BlobCache] = None
+) -> bytes:
+    """Fetches the blob a reference points to, from the cache if it's
+    there.
+
+    Args:
+        redis_con (redis.Redis): Redis connection.
+        ref (bytes): Reference returned by `BlobStore.offload`.
+        cache (Optional[BlobCache], optional): Cache to read the blob from
+            and add it to. Defaults to None.
+
+    Raises:
+        ValueError: If the blob doesn't exist.
+
+    Returns:
+        bytes: The blob.
+    """
+    header = json.loads(ref[len(_BLOB_MAGIC) :])
+    sha = header["sha"]
+    if cache is not None:
+        data = cache.get(sha)
+        if data is not None:
+            return data
+
+    data = None
+    if "path" in header:
+        try:
+            with open(header["path"], "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            pass
+    else:
+        data = redis_con.get(header["key"])
+    if data is None:
+        raise ValueError(f"Blob {sha} referenced by the state doesn't exist.")
+
+    if cache is not None:
+        cache.put(sha, data)
+    return data
+
+
+def clear_blobs(redis_con: redis.Redis, instance_names: List[str]) -> None:
+    """Deletes the blobs of instances stored in Redis, and the records of
+    which blobs their states reference."""
+    pipeline = redis_con.pipeline()
+    for instance_name in instance_names:
+        for prefix in ["", "DEV:"]:
+            for key in redis_con.scan_iter(f"MOTION_BLOB:{prefix}{instance_name}/*"):
+                pipeline.delete(key)
+            pipeline.delete(f"MOTION_BLOB_REFS:{prefix}{instance_name}")
+            pipeline.delete(f"MOTION_BLOB_ORPHANS:{prefix}{instance_name}")
+    pipeline.execute()
@@ -1,8 +1,10 @@
 import importlib
 import json
 import os
+import signal
 import sys
 from datetime import datetime
+from typing import Any, Optional
 
 import click
 import redis
@@ -48,29 +50,15 @@ def init() -> None:
     click.echo(f"{checkmark} Created .motionrc.yml in current directory {os.getcwd()}.")
 
 
-@motioncli.command(
-    "vis",
-    epilog="Example usage:\n motion vis main.py:MyComponent",
-)
-@click.argument(
-    "filename",
-    type=str,
-    required=True,
-)
-@click.option(
-    "--output",
-    type=str,
-    default="graph.json",
-    help="JSON filename to output the component graph to.",
-)
-def visualize(filename: str, output: str) -> None:
-    """Visualize a component."""
+def _import_component(filename: str) -> Optional[Any]:
+    """Imports a component given in the format `filename:component`,
+    printing an error and returning None if it can't be imported."""
     red_x = "\u274C"  # Unicode code point for red "X" emoji
     if ":" not in filename:
         click.echo(
             f"{red_x} Component must be in the format " + "`filename:component`."
         )
-        return
+        return None
 
     # Remove the file extension if present
     module = filename.replace(".py", "")
@@ -80,7 +68,7 @@ def visualize(filename: str, output: str) -> None:
         click.echo(
             f"{red_x} Component must be in the format " + "`filename:component`."
         )
-        return
+        return None
 
     module_dir = os.getcwd()
     sys.path.insert(0, module_dir)
@@ -88,10 +76,33 @@ def visualize(filename: str, output: str) -> None:
 
     # Get the class instance
     try:
-        class_instance = getattr(module, instance)
+        return getattr(module, instance)
     except AttributeError as e:
         click.echo(f"{red_x} {e}")
+        return None
+
+
+@motioncli.command(
+    "vis",
+    epilog="Example usage:\n motion vis main.py:MyComponent",
+)
+@click.argument(
+    "filename",
+    type=str,
+    required=True,
+)
+@click.option(
+    "--output",
+    type=str,
+    default="graph.json",
+    help="JSON filename to output the component graph to.",
+)
+def visualize(filename: str, output: str) -> None:
+    """Visualize a component."""
+    class_instance = _import_component(filename)
+    if class_instance is None:
         return
+    instance = filename.split(":")[-1]
 
     # Get the graph
     graph = class_instance.get_graph()
@@ -195,5 +206,52 @@ def list(component: str) -> None:
     )
 
 
+@motioncli.command(
+    "worker",
+    epilog="Example usage:\n motion worker --component main.py:MyComponent "
+    + "--concurrency 4",
+)
+@click.option(
+    "--component",
+    type=str,
+    required=True,
+    help="Component to run update ops for, in the format `filename:component`.",
+)
+@click.option(
+    "--concurrency",
+    type=int,
+    default=4,
+    help="Number of update ops to run at once.",
+)
+@click.option(
+    "--rescan-interval",
+    type=float,
+    default=5.0,
+    help="How often to look for instances with pending updates (seconds).",
+)
+def worker(component: str, concurrency: int, rescan_interval: float) -> None:
+    """Runs the update ops of all instances of a component. Instances
+    should be created with `update_task_type="external"`."""
+    from motion.server.worker import UpdateWorker
+
+    class_instance = _import_component(component)
+    if class_instance is None:
+        return
+
+    update_worker = UpdateWorker(
+        class_instance, concurrency=concurrency, rescan_interval=rescan_interval
+    )
+
+    # Let in-flight update ops finish on Ctrl-C or SIGTERM
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: update_worker.stop())
+
+    click.echo(
+        f"Running update ops for {class_instance.name} with concurrency "
+        + f"{concurrency}. Press Ctrl-C to stop."
+    )
+    update_worker.run()
+
+
 if __name__ == "__main__":
     motioncli()
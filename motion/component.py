@@ -2,10 +2,15 @@ import inspect
 import os
 from typing import Any, Callable, Dict, List, Literal, Optional, Union
 
-from motion.dicts import Params
+from motion.blobs import BlobStore
+from motion.compression import COMPRESSION_THRESHOLD, get_compressor
+from motion.dicts import Params, Properties
 from motion.discard_policy import DiscardPolicy, validate_policy
+from motion.hashing import PropsHasher
 from motion.instance import ComponentInstance
-from motion.route import Route
+from motion.result_cache import ResultCache
+from motion.route import Route, get_batch_size
+from motion.serializers import Serializer, get_serializer
 from motion.utils import (
     DEFAULT_KEY_TTL,
     clear_dev_instances,
@@ -128,6 +133,20 @@ class Component:
         name: str,
         params: Dict[str, Any] = {},
         cache_ttl: int = DEFAULT_KEY_TTL,
+        props_hasher: Optional[PropsHasher] = None,
+        state_layout: Literal["blob", "hash"] = "blob",
+        lazy_state: bool = False,
+        concurrency: Literal["lock", "optimistic"] = "lock",
+        serializer: Union[str, Serializer, None] = None,
+        compression: Optional[Literal["auto", "zstd", "lz4", "zlib"]] = None,
+        compression_threshold: int = COMPRESSION_THRESHOLD,
+        blob_store: Optional[BlobStore] = None,
+        shared_state: bool = False,
+        result_cache: Optional[ResultCache] = None,
+        singleflight: Optional[Literal["process", "redis"]] = None,
+        singleflight_lease: float = 30.0,
+        stale_while_revalidate: bool = False,
+        max_version_lag: Optional[int] = None,
     ):
         """Creates a new Motion component.
 
@@ -140,16 +159,183 @@ class Component:
                 have created.
             cache_ttl (int, optional):
                 Time to live for cached serve results (seconds).
-                Defaults to 1 day. Set to 0 to disable caching.
+                Defaults to 1 day. Set to 0 to disable caching. Only the
+                serve result and the props the serve op set are cached, not
+                the props passed in. Props the serve op modified in place
+                aren't cached.
+            props_hasher (Optional[Callable[[Any], str]], optional):
+                Function that hashes props to key cached serve results.
+                Equal props must hash the same, and the function should
+                raise a TypeError for props that shouldn't be cached.
+                Defaults to None, which uses a hash of the props' contents
+                that doesn't depend on dict ordering and hashes numpy,
+                pandas, and pyarrow objects from their underlying data.
+            state_layout (str, optional):
+                How instance state is stored in Redis. "blob" stores the
+                whole state as a single value, so every update op rewrites
+                all of it. "hash" stores each top-level key separately, so
+                update ops only write the keys they return and instances
+                only fetch the keys that changed. With "hash", state keys
+                must be strings, in-place changes to keys an update op
+                doesn't return are not saved, `save_state` can't be used,
+                and `load_state` hooks must declare the fields they
+                transform. Defaults to "blob".
+            lazy_state (bool, optional):
+                Whether serve ops fetch state keys the first time they
+                access them, rather than fetching every key that changed
+                whenever the state version moves. Serve latency then
+                depends on the keys a serve op reads, not on the size of
+                the state. Requires `state_layout="hash"`. Defaults to
+                False.
+            concurrency (str, optional):
+                How concurrent writes to an instance's state are kept from
+                overwriting each other. "lock" holds a lock on the instance
+                while update ops run and while state is written. With
+                "optimistic", nothing is locked: a state update only
+                commits if no one else committed since the state was
+                loaded, and the update op is rerun on the latest state
+                otherwise. Optimistic concurrency lets writers make progress
+                in parallel when update ops are fast and rarely overlap.
+                Update ops may then run more than once per item, so they
+                shouldn't have side effects. Defaults to "lock".
+            serializer (Union[str, Serializer, None], optional):
+                How state is serialized in Redis. "cloudpickle" can store
+                almost any object. "pickle5" uses pickle protocol 5 with
+                out-of-band buffers, so large numpy arrays and Arrow
+                buffers aren't copied into the pickle stream. "msgpack" is
+                faster and more compact for plain, JSON-like state and
+                requires the `msgpack` package. You can also pass your own
+                `motion.serializers.Serializer`. State written by the
+                built-in serializers can be read by any of them, so the
+                serializer can be changed for existing instances. Defaults
+                to None, which uses cloudpickle.
+            compression (str, optional):
+                Codec to compress state and cached serve results with
+                before writing them to Redis: "zstd", "lz4", or "zlib".
+                "auto" uses zstd or lz4 if installed, falling back to zlib.
+                Compressed values are tagged, so values written before
+                compression was enabled (or with another codec) still
+                load. Defaults to None, which doesn't compress.
+            compression_threshold (int, optional):
+                Values smaller than this many bytes aren't compressed. With
+                `state_layout="hash"`, this applies to each key separately.
+                Defaults to 1024.
+            blob_store (Optional[BlobStore], optional):
+                Store for large state values, e.g.,
+                `motion.blobs.BlobStore(threshold=10 * 1024 * 1024)`.
+                Values above the store's threshold are written to it by
+                content hash, and the state keeps a reference to them, so
+                saving a state whose large values didn't change doesn't
+                rewrite them, and instances fetch a large value once per
+                change, from a local cache after the first time. Defaults
+                to None, which keeps every value in the state.
+            shared_state (bool, optional):
+                Whether processes on the same host (e.g., the workers of an
+                `Application` under uvicorn or gunicorn) share loaded state
+                through memory-mapped files, instead of each fetching and
+                unpickling its own copy. The first process to load a version
+                shares it, and the others map it without copying array
+                buffers, so numpy, pandas, and Arrow values in the state are
+                read-only for serve ops and must be replaced, not modified
+                in place. Files are kept under `/dev/shm/motion`, or the
+                `MOTION_SHARED_STATE_DIR` environment variable. Requires
+                `state_layout="blob"`. Defaults to False.
+            result_cache (Optional[ResultCache], optional):
+                In-process LRU cache of serve results, checked before the
+                cache in Redis, e.g., `motion.result_cache.ResultCache(
+                max_entries=10_000)`. Hits skip the round trip to Redis and
+                unpickling. Results are kept for `cache_ttl` seconds, and
+                the cache is shared by all instances of the component in
+                the process. Hits return the cached object itself, not a
+                copy, so callers share it and shouldn't modify it.
+                Defaults to None, which only caches results in Redis.
+            singleflight (str, optional):
+                Whether concurrent calls of a serve op on the same props
+                share one execution of it when their result isn't cached.
+                With "process", calls in the same process wait for the
+                first one to run the serve op and get its result. Calls of
+                generator serve ops stream the items as the first call
+                yields them, and if that call stops iterating, the serve op
+                still runs to completion for the others. "redis" also makes
+                calls in other processes wait, by taking a lease on the
+                result in Redis while the serve op runs. They get the
+                result once it's cached. Only calls to `run` and `gen`, or
+                to `arun` and `agen`, wait on each other, and `run_many`
+                and `arun_many` don't wait. Requires caching. Defaults to
+                None, which runs the serve op for every call.
+            singleflight_lease (float, optional):
+                Seconds a lease taken with `singleflight="redis"` lasts.
+                Calls in other processes stop waiting and run the serve op
+                themselves if the result isn't cached by then, so it should
+                be longer than the serve op takes. Defaults to 30.
+            stale_while_revalidate (bool, optional):
+                Whether cached serve results computed against an older
+                state version are still served. Each cached result records
+                the state version it was computed against. When a hit is
+                older than the current version, it is returned right away,
+                and the serve op is rerun against the latest state in the
+                background to refresh the cached result. Update ops aren't
+                rerun. Results in the in-process result cache are checked
+                against the latest version the instance has heard of, so
+                they are only served without a Redis lookup on instances
+                created with `push_state_updates`. Requires caching.
+                Defaults to False, which serves cached results for
+                `cache_ttl` seconds however much the state changes.
+            max_version_lag (Optional[int], optional):
+                Maximum number of state versions a cached serve result can
+                be behind and still be served. Older results count as
+                misses, so the serve op is rerun on the request path.
+                Results cached by older versions of Motion, whose version
+                isn't known, count as older. Set to 0 to only serve results
+                computed against the current version. Requires caching.
+                Defaults to None, which serves results however far behind
+                they are.
         """
         if cache_ttl is None or cache_ttl < 0:
             raise ValueError(
                 "cache_ttl must be 0 (caching disabled) or a positive integer."
             )
+        if state_layout not in ["blob", "hash"]:
+            raise ValueError("state_layout must be either 'blob' or 'hash'")
+        if lazy_state and state_layout != "hash":
+            raise ValueError("lazy_state requires state_layout='hash'")
+        if shared_state and state_layout != "blob":
+            raise ValueError("shared_state requires state_layout='blob'")
+        if concurrency not in ["lock", "optimistic"]:
+            raise ValueError("concurrency must be either 'lock' or 'optimistic'")
+        if singleflight not in [None, "process", "redis"]:
+            raise ValueError("singleflight must be None, 'process', or 'redis'")
+        if singleflight and cache_ttl == 0:
+            raise ValueError("singleflight requires caching (cache_ttl > 0)")
+        if singleflight_lease <= 0:
+            raise ValueError("singleflight_lease must be positive")
+        if (stale_while_revalidate or max_version_lag is not None) and cache_ttl == 0:
+            raise ValueError(
+                "stale_while_revalidate and max_version_lag require caching "
+                + "(cache_ttl > 0)"
+            )
+        if max_version_lag is not None and max_version_lag < 0:
+            raise ValueError("max_version_lag must be None or non-negative")
 
         self._name = name
         self._params = Params(params)
         self._cache_ttl = cache_ttl
+        self._props_hasher = props_hasher
+        self._state_layout = state_layout
+        self._lazy_state = lazy_state
+        self._concurrency = concurrency
+        self._serializer = get_serializer(serializer)
+        # Fail early if the codec isn't installed
+        get_compressor(compression, compression_threshold)
+        self._compression = compression
+        self._compression_threshold = compression_threshold
+        self._blob_store = blob_store
+        self._shared_state = shared_state
+        self._result_cache = result_cache
+        self._singleflight = singleflight
+        self._singleflight_lease = singleflight_lease
+        self._stale_while_revalidate = stale_while_revalidate
+        self._max_version_lag = max_version_lag
 
         # Set up routes
         self._serve_routes: Dict[str, Route] = {}
@@ -279,7 +465,9 @@ class Component:
         self._save_state_func = func
         return func
 
-    def load_state(self, func: Callable) -> Callable:
+    def load_state(
+        self, func: Optional[Callable] = None, *, fields: Optional[List[str]] = None
+    ) -> Callable:
         """Decorator for the load_state function. This function
         loads the state of the component from the unpickled state.
 
@@ -296,18 +484,42 @@ class Component:
             return {"cursor": cursor, "fit_count": state["fit_count"]}
         ```
 
+        Components with `state_layout="hash"` must declare the fields the
+        function transforms. It then only receives (and returns) those
+        fields, and only runs when one of them changes, so the other
+        fields can still be loaded on their own:
+
+        ```python
+        MyComponent = Component("MyComponent", state_layout="hash")
+
+        @MyComponent.load_state(fields=["db_path", "cursor"])
+        def load(state):
+            conn = sqlite3.connect(state["db_path"])
+            return {"db_path": state["db_path"], "cursor": conn.cursor()}
+        ```
+
         Args:
             func (Callable): Function that consumes a cloudpickleable object.
                 Should return a dictionary representing the state of the
                 component instance.
+            fields (Optional[List[str]], optional): State keys the function
+                reads and returns. Defaults to None, which passes it the
+                whole state.
 
         Returns:
             Callable: Decorated load_state function.
         """
-        self._load_state_func = func
-        return func
 
-    def serve(self, keys: Union[str, List[str]]) -> Callable:
+        def decorator(func: Callable) -> Callable:
+            func._fields = list(fields) if fields is not None else None  # type: ignore
+            self._load_state_func = func
+            return func
+
+        if func is None:
+            return decorator
+        return decorator(func)
+
+    def serve(self, keys: Union[str, List[str]], vectorized: bool = False) -> Callable:
         """Decorator for any serve operation for a flow through the
         component. Takes in a string or list of strings that represents the
         flow key. If the decorator is called with a list of strings, each
@@ -351,9 +563,24 @@ class Component:
         c.run("multiply", props={"value": 2}) # Returns 2
         ```
 
+        Vectorized serve ops receive a list of props and return a list with
+        one result per props. `run_many` passes all the props that missed the
+        cache to a vectorized serve op in a single call, while `run` passes
+        a list of one:
+        ```python
+        @MyComponent.serve("score", vectorized=True)
+        def score(state, props):
+            return [state["value"] + p["value"] for p in props]
+
+        c.run_many("score", [{"value": 1}, {"value": 2}]) # Returns [1, 2]
+        ```
+
         Args:
             keys (Union[str, List[str]]): String or list of strings that
                 represent the input keyword(s) for the serve flow.
+            vectorized (bool, optional): Whether the serve op takes a list of
+                props and returns a list of results. Generator serve ops
+                cannot be vectorized. Defaults to False.
 
         Returns:
             Callable: Decorated serve function.
@@ -373,7 +600,16 @@ class Component:
                     + "`state` and `props`"
                 )
 
+            if vectorized and (
+                inspect.isgeneratorfunction(func) or inspect.isasyncgenfunction(func)
+            ):
+                raise ValueError(
+                    f"serve function {func.__name__} is a generator and cannot "
+                    + "be vectorized."
+                )
+
             func._op = "serve"  # type: ignore
+            func._vectorized = vectorized  # type: ignore
 
             for key in keys:
                 self.add_route(key, func._op, func)  # type: ignore
@@ -387,6 +623,11 @@ class Component:
         keys: Union[str, List[str]],
         discard_policy: DiscardPolicy = DiscardPolicy.NONE,
         discard_after: Optional[int] = None,
+        batch_size: int = 1,
+        max_wait_ms: int = 0,
+        writes: Optional[List[str]] = None,
+        reads: Optional[List[str]] = None,
+        merge: Optional[Callable[[List[Properties]], Dict[str, Any]]] = None,
     ) -> Any:
         """Decorator for any update operations for flows through the
         component. Takes in a string or list of strings that represents the
@@ -408,6 +649,47 @@ class Component:
         See `DiscardPolicy` for more info on how to expire update operations if
         you expect there to be backpressure for an update operation.
 
+        To keep every update without running the update op for each one,
+        use `DiscardPolicy.COALESCE` with a `merge` function. All props
+        queued by the time the update op runs are merged into one, and the
+        update op runs once on the merged props:
+        ```python
+        def merge_texts(props_list):
+            return {"texts": [p["text"] for p in props_list]}
+
+        @MyComponent.update(
+            "summarize", discard_policy=DiscardPolicy.COALESCE, merge=merge_texts
+        )
+        def summarize(state, props):
+            return {"summary": summarize_texts(state["summary"], props["texts"])}
+        ```
+
+        If loading and saving the state is expensive, set `batch_size` to run
+        the update op on up to `batch_size` queued props at once. The update
+        op is then passed a list of props, and the state is loaded and saved
+        once per batch:
+        ```python
+        @MyComponent.update("multiply", batch_size=32, max_wait_ms=50)
+        def multiply(state, props):
+            return {"value": state["value"] + sum(p["value"] for p in props)}
+        ```
+
+        With `state_layout="hash"`, update ops can declare the state keys
+        they write (and read). Instead of locking the whole instance, they
+        then lock just the keys they write, and commit as long as no one
+        else changed the keys they write or read. Update ops that touch
+        different keys run in parallel on the update pool
+        (`update_task_type="pool"`) and on `motion worker`:
+        ```python
+        @MyComponent.update("click", writes=["clicks"])
+        def count_click(state, props):
+            return {"clicks": state["clicks"] + 1}
+
+        @MyComponent.update("click", writes=["ctr"], reads=["views"])
+        def update_ctr(state, props):
+            return {"ctr": ...}
+        ```
+
         Example Usage:
         ```python
         from motion import Component
@@ -453,6 +735,24 @@ class Component:
             discard_after (Optional[int], optional): Number of updates
                 or seconds after which to expire the update operation.
                 Defaults to None.
+            batch_size (int, optional): Maximum number of queued props to
+                run the update op on at once. If greater than 1, the update op
+                is passed a list of props. Defaults to 1.
+            max_wait_ms (int, optional): How long to wait for a batch to fill
+                up before running the update op on a partial batch. Flushing
+                updates doesn't wait. Defaults to 0.
+            writes (Optional[List[str]], optional): State keys the update op
+                writes. The update op may only return these keys. Requires
+                `state_layout="hash"`. Defaults to None, which locks the
+                whole instance.
+            reads (Optional[List[str]], optional): State keys the update op
+                reads, besides the keys it writes. Only declared keys are
+                loaded for the update op. Requires `writes`. Defaults to
+                None.
+            merge (Optional[Callable[[List[Properties]], Dict[str, Any]]], optional):
+                Function that merges a list of queued props into the props
+                to run the update op on. Required with, and only used with,
+                `DiscardPolicy.COALESCE`. Defaults to None.
 
         Returns:
             Callable: Decorated update function.
@@ -467,6 +767,27 @@ class Component:
         if isinstance(keys, str):
             keys = [keys]
 
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise ValueError(f"batch_size must be a positive int, got {batch_size}.")
+        if max_wait_ms < 0:
+            raise ValueError(f"max_wait_ms must be nonnegative, got {max_wait_ms}.")
+        if reads is not None and writes is None:
+            raise ValueError("Update ops that declare reads must also declare writes.")
+        if writes is not None and self._state_layout != "hash":
+            raise ValueError(
+                "Declaring the keys an update op writes requires state_layout='hash'."
+            )
+        if discard_policy == DiscardPolicy.COALESCE:
+            if merge is None:
+                raise ValueError("DiscardPolicy.COALESCE requires a merge function.")
+            if batch_size > 1:
+                raise ValueError(
+                    "batch_size must be 1 with DiscardPolicy.COALESCE, which "
+                    + "runs the update op on all queued props at once."
+                )
+        elif merge is not None:
+            raise ValueError("merge is only used with DiscardPolicy.COALESCE.")
+
         def decorator(func: Callable) -> Any:
             if not validate_args(inspect.signature(func).parameters, "update"):
                 raise ValueError(
@@ -480,6 +801,11 @@ class Component:
             func._op = "update"  # type: ignore
             func._discard_policy = discard_policy  # type: ignore
             func._discard_after = discard_after  # type: ignore
+            func._batch_size = batch_size  # type: ignore
+            func._max_wait_ms = max_wait_ms  # type: ignore
+            func._writes = list(writes) if writes is not None else None  # type: ignore
+            func._reads = list(reads or [])  # type: ignore
+            func._merge = merge  # type: ignore
 
             for key in keys:
                 self.add_route(key, func._op, func)  # type: ignore
@@ -493,11 +819,14 @@ class Component:
         instance_id: str = "",
         init_state_params: Dict[str, Any] = {},
         logging_level: str = "WARNING",
-        update_task_type: Literal["thread", "process"] = "thread",
+        update_task_type: Literal["thread", "process", "pool", "external"] = "thread",
         disable_update_task: bool = False,
         redis_socket_timeout: int = 60,
         config_path: str = ".motionrc.yml",
         flush_on_exit: bool = False,
+        push_state_updates: bool = False,
+        max_state_staleness: float = 30.0,
+        queue_backend: Literal["list", "stream"] = "list",
     ) -> ComponentInstance:
         """Creates and returns a new instance of a Motion component.
         See `ComponentInstance` docs for more info.
@@ -547,11 +876,18 @@ class Component:
                 Logging level for the Motion logger. Uses the logging library.
                 Defaults to "WARNING".
             update_task_type (str, optional):
-                Type of update task to use. Can be "thread" or "process".
-                "thread" has lower overhead but is not recommended for
+                Type of update task to use. Can be "thread", "process",
+                "pool", or "external". "thread" has lower overhead but is not recommended for
                 CPU-intensive update operations. "process" is recommended
                 for CPU-intensive operations (e.g., fine-tuning a model)
-                but has higher startup overhead. Defaults to "thread".
+                but has higher startup overhead. "pool" runs the update ops
+                on a thread pool shared by all instances in the process,
+                which keeps the number of threads bounded when there are
+                many instances. The pool size is set by the
+                MOTION_UPDATE_POOL_SIZE env var (default 8). "external"
+                only enqueues updates, leaving them to `motion worker`
+                processes, which can run on other machines. Defaults to
+                "thread".
             disable_update_task (bool, optional):
                 Whether or not to disable the component instance update ops.
                 Useful for printing out state values without running flows.
@@ -567,6 +903,27 @@ class Component:
                 where you want to make sure all updates are finished after the
                 result is returned, before the function exits. Defaults to
                 False.
+            push_state_updates (bool, optional):
+                Whether to listen for new state versions published by update
+                ops instead of looking up the state version in Redis before
+                every serve op. Useful for instances that serve many requests,
+                since serve ops then read the in-process state without any
+                network round trips until a new version is published.
+                Defaults to False.
+            max_state_staleness (float, optional):
+                When `push_state_updates` is True, the maximum number of
+                seconds to trust the in-process state before looking up the
+                version in Redis again, in case a published version was
+                missed. Defaults to 30.
+            queue_backend (str, optional):
+                Redis data structure to queue updates in. Can be "list" or
+                "stream". With "stream", updates are read through a
+                consumer group, so several processes running the same
+                instance share its updates, updates that were being
+                processed when a process crashed are picked up by another
+                one, and the time each update spent queued is logged.
+                Requires update_task_type "thread" or "process". Defaults
+                to "list".
         Returns:
             ComponentInstance: Component instance to run flows with.
         """
@@ -624,8 +981,25 @@ class Component:
                 update_task_type=update_task_type,
                 disable_update_task=disable_update_task,
                 cache_ttl=self._cache_ttl,
+                props_hasher=self._props_hasher,
                 redis_socket_timeout=redis_socket_timeout,
                 flush_on_exit=flush_on_exit,
+                push_state_updates=push_state_updates,
+                max_state_staleness=max_state_staleness,
+                queue_backend=queue_backend,
+                state_layout=self._state_layout,
+                lazy_state=self._lazy_state,
+                concurrency=self._concurrency,
+                serializer=self._serializer,
+                compression=self._compression,
+                compression_threshold=self._compression_threshold,
+                blob_store=self._blob_store,
+                shared_state=self._shared_state,
+                result_cache=self._result_cache,
+                singleflight=self._singleflight,
+                singleflight_lease=self._singleflight_lease,
+                stale_while_revalidate=self._stale_while_revalidate,
+                max_version_lag=self._max_version_lag,
             )
         except RuntimeError:
             raise RuntimeError(
@@ -659,7 +1033,7 @@ class Component:
                     {
                         "name": route.udf.__name__,
                         "udf": inspect.getsource(route.udf),
-                        # "batch_size": route.udf._batch_size,  # type: ignore
+                        "batch_size": get_batch_size(route.udf),
                     }
                 )
 
@@ -745,7 +1119,7 @@ class Component:
                         "data": {
                             "label": update["name"],
                             "udf": update["udf"],
-                            # "batch_size": fit["batch_size"],
+                            "batch_size": update["batch_size"],
                         },
                         "type": "update",
                     }
@@ -758,7 +1132,7 @@ class Component:
                             "source": fit_node["id"],
                             "sourceHandle": "top",
                             "animated": True,  # type: ignore
-                            # "label": f"batch_size: {fit['batch_size']}",
+                            "label": f"batch_size: {update['batch_size']}",
                         }
                     )
 
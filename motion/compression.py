@@ -0,0 +1,183 @@
+"""
+This file contains the compression applied to state and cached serve
+results before they are written to Redis.
+"""
+
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Compressed values start with the magic prefix and a byte naming the codec,
+# so values can be read without knowing how (or whether) they were
+# compressed, and values written before compression was enabled still load
+_COMPRESSED_MAGIC = b"MOTION:Z"
+_CODEC_IDS = {"zlib": b"z", "zstd": b"s", "lz4": b"4"}
+
+# Values smaller than this (in bytes) are stored as is
+COMPRESSION_THRESHOLD = 1024
+
+CODECS = ["auto", "zstd", "lz4", "zlib"]
+
+# zstd contexts are costly to create, but can't be used by two threads at
+# once, so each thread creates its own on first use and reuses it
+_zstd_contexts = threading.local()
+
+
+def _zstdCompress(data: bytes) -> bytes:
+    compressor = getattr(_zstd_contexts, "compressor", None)
+    if compressor is None:
+        compressor = _zstd_contexts.compressor = zstandard.ZstdCompressor()
+    return compressor.compress(data)  # type: ignore
+
+
+def _zstdDecompress(data: bytes) -> bytes:
+    decompressor = getattr(_zstd_contexts, "decompressor", None)
+    if decompressor is None:
+        decompressor = _zstd_contexts.decompressor = zstandard.ZstdDecompressor()
+    return decompressor.decompress(data)  # type: ignore
+
+
+def _codecFunctions(codec: str) -> Tuple[Callable, Callable]:
+    """Returns the compress and decompress functions of a codec."""
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImportError(
+                "zstd compression requires zstandard. "
+                + "Install it with `pip install zstandard`."
+            )
+        return _zstdCompress, _zstdDecompress
+    if codec == "lz4":
+        if lz4_frame is None:
+            raise ImportError(
+                "lz4 compression requires lz4. Install it with `pip install lz4`."
+            )
+        return lz4_frame.compress, lz4_frame.decompress
+    return zlib.compress, zlib.decompress
+
+
+def decompress(data: bytes) -> bytes:
+    """Decompresses a value written by a `Compressor`. Values that weren't
+    compressed are returned as is."""
+    if not data.startswith(_COMPRESSED_MAGIC):
+        return data
+
+    codec_id = data[len(_COMPRESSED_MAGIC) : len(_COMPRESSED_MAGIC) + 1]
+    for codec, cid in _CODEC_IDS.items():
+        if cid == codec_id:
+            _, decompress_func = _codecFunctions(codec)
+            return decompress_func(  # type: ignore
+                memoryview(data)[len(_COMPRESSED_MAGIC) + 1 :]
+            )
+    raise ValueError(f"Unknown compression codec {codec_id!r}.")
+
+
+class Compressor:
+    """Compresses values at or above a size threshold, and keeps counts of
+    the bytes and CPU time spent so they can be reported as metrics."""
+
+    def __init__(
+        self, codec: str = "auto", threshold: int = COMPRESSION_THRESHOLD
+    ) -> None:
+        """Creates a compressor.
+
+        Args:
+            codec (str, optional): One of "zstd", "lz4", or "zlib". "auto"
+                uses zstd or lz4 if installed, falling back to zlib.
+                Defaults to "auto".
+            threshold (int, optional): Values smaller than this many bytes
+                aren't compressed. Defaults to 1024.
+        """
+        if codec not in CODECS:
+            raise ValueError(
+                f"Unknown compression codec {codec!r}. Use one of {CODECS}."
+            )
+        if codec == "auto":
+            if zstandard is not None:
+                codec = "zstd"
+            elif lz4_frame is not None:
+                codec = "lz4"
+            else:
+                codec = "zlib"
+
+        self.codec = codec
+        self.threshold = threshold
+        self._compress, _ = _codecFunctions(codec)
+        self._lock = threading.Lock()
+        self._resetStats()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Compressors are sent to update processes, which keep their own stats
+        return {"codec": self.codec, "threshold": self.threshold}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["codec"], state["threshold"])  # type: ignore
+
+    def _resetStats(self) -> None:
+        self._stats = {
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "compress_seconds": 0.0,
+            "decompress_seconds": 0.0,
+        }
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses a value if it is at least `threshold` bytes and
+        compressing makes it smaller."""
+        if len(data) < self.threshold:
+            return data
+
+        start = time.thread_time()
+        compressed = b"".join(
+            [_COMPRESSED_MAGIC, _CODEC_IDS[self.codec], self._compress(data)]
+        )
+        if len(compressed) >= len(data):
+            compressed = data
+
+        with self._lock:
+            self._stats["bytes_in"] += len(data)
+            self._stats["bytes_out"] += len(compressed)
+            self._stats["compress_seconds"] += time.thread_time() - start
+        return compressed
+
+    def decompress(self, data: bytes) -> bytes:
+        """Decompresses a value, whichever codec compressed it."""
+        if not data.startswith(_COMPRESSED_MAGIC):
+            return data
+
+        start = time.thread_time()
+        decompressed = decompress(data)
+        with self._lock:
+            self._stats["decompress_seconds"] += time.thread_time() - start
+        return decompressed
+
+    def pop_stats(self) -> Dict[str, float]:
+        """Returns the stats gathered since the last call and resets them.
+        Includes "ratio", the uncompressed size over the stored size of the
+        values that were large enough to compress."""
+        with self._lock:
+            stats: Dict[str, float] = dict(self._stats)
+            self._resetStats()
+        if stats["bytes_out"]:
+            stats["ratio"] = stats["bytes_in"] / stats["bytes_out"]
+        return stats
+
+
+def get_compressor(
+    compression: Optional[str], threshold: int = COMPRESSION_THRESHOLD
+) -> Optional[Compressor]:
+    """Creates a compressor for a component's `compression` option, or
+    returns None if compression is disabled."""
+    if compression is None:
+        return None
+    return Compressor(compression, threshold)
@@ -5,7 +5,7 @@ from typing import Any, Dict, List, Optional, Tuple
 import redis
 import requests
 
-from motion.utils import get_redis_params, loadState, saveState
+from motion.utils import get_redis_params, getStateLayout, loadState, saveState
 
 
 def query_victoriametrics(victoria_metrics_url: str, query: str) -> Any:
@@ -266,7 +266,9 @@ def writeState(instance_name: str, new_updates: Dict[str, Any]) -> None:
     rp = get_redis_params()
     redis_con = redis.Redis(**rp.dict())
 
-    state, version = loadState(redis_con, instance_name, None)
+    # Look the layout up once for both the load and the save
+    state_layout = getStateLayout(redis_con, instance_name)
+    state, version = loadState(redis_con, instance_name, None, state_layout)
     if state is None:
         raise ValueError(f"Instance {instance_name} does not exist.")
 
@@ -274,7 +276,7 @@ def writeState(instance_name: str, new_updates: Dict[str, Any]) -> None:
     state.update(new_updates)
 
     # Save the state
-    saveState(state, version, redis_con, instance_name, None)
+    saveState(state, version, redis_con, instance_name, None, state_layout)
 
     # Close the connection to the Redis server
     redis_con.close()
@@ -3,7 +3,8 @@ This file contains the props class, which is used to store
 properties of a flow.
 """
 
-from typing import Any, Optional
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
 class CustomDict(dict):
@@ -154,6 +155,113 @@ class State(dict):
             )
 
 
+class _Pending:
+    """Placeholder for a state value that hasn't been fetched yet."""
+
+    def __repr__(self) -> str:
+        return "<not loaded>"
+
+
+_PENDING = _Pending()
+
+
+class LazyState(State):
+    """State whose values are fetched the first time they are accessed.
+
+    All keys are known up front, so membership checks, iteration, and `len`
+    don't fetch anything. Reading a value (`state[key]`, `get`, `items`,
+    ...) fetches it with `fetch`, which takes a list of keys and returns a
+    dict of their values. Keys `fetch` doesn't return are removed.
+    """
+
+    def __init__(
+        self,
+        component_name: str,
+        instance_id: str,
+        fetch: Callable[[List[str]], Dict[str, Any]],
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(component_name, instance_id, *args, **kwargs)
+        self._fetch = fetch
+        self._fetch_lock = threading.Lock()
+
+    def defer(self, key: str) -> None:
+        """Marks a key as present, to be fetched on first access."""
+        super().__setitem__(key, _PENDING)
+
+    def is_loaded(self, key: str) -> bool:
+        """Whether the value of a key has been fetched."""
+        return super().get(key, _PENDING) is not _PENDING
+
+    def load(self, keys: Iterable[str]) -> None:
+        """Fetches the values of `keys` that haven't been fetched yet."""
+        with self._fetch_lock:
+            pending = [k for k in keys if dict.get(self, k) is _PENDING]
+            if not pending:
+                return
+
+            values = self._fetch(pending)
+            for key in pending:
+                if key not in values:
+                    super().__delitem__(key)
+            for key, value in values.items():
+                super().__setitem__(key, value)
+
+    def load_all(self) -> None:
+        """Fetches every value that hasn't been fetched yet."""
+        self.load(list(super().keys()))
+
+    def __getitem__(self, key: str) -> object:
+        self.load([key])
+        return super().__getitem__(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self.load([key])
+        return super().get(key, default)
+
+    def pop(self, key: str, *args: Any) -> Any:
+        self.load([key])
+        return super().pop(key, *args)
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        self.load([key])
+        return super().setdefault(key, default)
+
+    def popitem(self) -> Tuple[str, Any]:
+        self.load_all()
+        return super().popitem()
+
+    def values(self):  # type: ignore
+        self.load_all()
+        return super().values()
+
+    def items(self):  # type: ignore
+        self.load_all()
+        return super().items()
+
+    def __iter__(self) -> Iterator[str]:
+        # Defining this makes dict(state) and {**state} go through
+        # __getitem__ instead of copying the placeholders
+        return super().__iter__()
+
+    def __eq__(self, other: object) -> bool:
+        self.load_all()
+        return super().__eq__(other)
+
+    def __repr__(self) -> str:
+        self.load_all()
+        return super().__repr__()
+
+    def copy(self) -> State:  # type: ignore
+        self.load_all()
+        return State(self.component_name, self._instance_id, super().items())
+
+    def __reduce__(self) -> Any:
+        # Pickle as a plain state, without the connection used to fetch
+        return (State, (self.component_name, self._instance_id, dict(self.items())))
+
+
 class Params(dict):
     def __init__(
         self,
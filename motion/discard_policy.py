@@ -21,10 +21,28 @@ class DiscardPolicy(Enum):
             items are removed.
         SECONDS: Items delete based on time. Items older than a specified
             number of seconds at the time of processing are removed.
+        COALESCE: Items are merged instead of deleted. When the update
+            operation is ready to run, every item in the queue is taken and
+            merged into one by the `merge` function passed to
+            `Component.update`, and the update operation runs once on the
+            merged props.
 
     Use the `discard_after` and `discard_policy` arguments in `Component.update`
     decorator to set the discard policy for an update operation.
 
+    COALESCE keeps every item's information without running the update
+    operation for each of them, e.g., to summarize many events in one LLM
+    call. The update operation then runs as often as it can keep up with,
+    no matter how fast items are queued:
+    ```python
+    def merge_events(props_list):
+        return {"events": [p["event"] for p in props_list]}
+
+    @C.update("event", discard_policy=DiscardPolicy.COALESCE, merge=merge_events)
+    def summarize(state, props):
+        return {"summary": llm_summarize(state["summary"], props["events"])}
+    ```
+
     Example Usage:
     ```python
     from motion import Component, DiscardPolicy
@@ -101,11 +119,14 @@ class DiscardPolicy(Enum):
     SECONDS = 2
     """ Delete items based on time (in seconds). """
 
+    COALESCE = 3
+    """ Merge all queued items into one before running the update. """
+
 
 def validate_policy(policy: DiscardPolicy, discard_after: Optional[int]) -> None:
-    if policy == DiscardPolicy.NONE:
+    if policy in (DiscardPolicy.NONE, DiscardPolicy.COALESCE):
         if discard_after is not None:
-            raise ValueError("discard_after must be None for policy NONE")
+            raise ValueError(f"discard_after must be None for policy {policy.name}")
         return
 
     if discard_after is None:
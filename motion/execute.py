@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import inspect
 import logging
 import multiprocessing
@@ -6,16 +7,19 @@ import os
 import threading
 import time
 import types
-from concurrent.futures import ThreadPoolExecutor
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import (
     Any,
     AsyncGenerator,
+    AsyncIterator,
     Callable,
     Dict,
     Generator,
     List,
     Literal,
     Optional,
+    Set,
     Tuple,
 )
 from uuid import uuid4
@@ -23,21 +27,49 @@ from uuid import uuid4
 import cloudpickle
 import psutil
 import redis
+import redis.asyncio as aioredis
 import requests
 
+from motion.blobs import BlobStore
+from motion.compression import COMPRESSION_THRESHOLD, decompress, get_compressor
 from motion.dicts import Properties, State
 from motion.discard_policy import DiscardPolicy
-from motion.route import Route
-from motion.server.update_task import UpdateProcess, UpdateThread
+from motion.hashing import PropsHasher
+from motion.redis_scripts import CACHED_SERVE_LOOKUP, RELEASE_LEASE
+from motion.result_cache import CachedResult, ResultCache, dump_result, load_result
+from motion.route import Route, check_writes, get_update_props, is_vectorized
+from motion.serializers import Serializer, get_serializer
+from motion.server.update_loop import get_update_loop
+from motion.server.update_pool import UpdateWorkerPool, get_update_pool
+from motion.server.update_task import BaseUpdateTask, UpdateProcess, UpdateThread
+from motion.server.version_listener import StateVersionListener
+from motion.shared_state import SharedStateCache
+from motion.singleflight import (
+    LEASE_POLL_INTERVAL,
+    MAX_LEASE_POLL_INTERVAL,
+    Flight,
+    FlightAbandoned,
+    SingleFlight,
+)
 from motion.utils import (
+    MAX_COMMIT_ATTEMPTS,
+    AsyncUpdateEvent,
     FlowOpStatus,
     RedisParams,
     UpdateEvent,
     UpdateEventGroup,
+    compressionMetrics,
+    conflictBackoff,
     get_redis_params,
+    get_version_channel,
+    get_worker_keys,
+    getHookFields,
     hash_object,
     loadState,
+    loadStateFields,
     saveState,
+    saveStateFields,
+    waitAfterConflict,
 )
 
 logger = logging.getLogger(__name__)
@@ -54,14 +86,32 @@ class Executor:
         load_state_func: Optional[Callable],
         serve_routes: Dict[str, Route],
         update_routes: Dict[str, List[Route]],
-        update_task_type: Literal["thread", "process"] = "thread",
+        update_task_type: Literal["thread", "process", "pool", "external"] = "thread",
         disable_update_task: bool = False,
         redis_socket_timeout: int = 60,
+        push_state_updates: bool = False,
+        max_state_staleness: float = 30.0,
+        props_hasher: Optional[PropsHasher] = None,
+        queue_backend: Literal["list", "stream"] = "list",
+        state_layout: Literal["blob", "hash"] = "blob",
+        lazy_state: bool = False,
+        concurrency: Literal["lock", "optimistic"] = "lock",
+        serializer: Optional[Serializer] = None,
+        compression: Optional[str] = None,
+        compression_threshold: int = COMPRESSION_THRESHOLD,
+        blob_store: Optional[BlobStore] = None,
+        shared_state: bool = False,
+        result_cache: Optional[ResultCache] = None,
+        singleflight: Optional[Literal["process", "redis"]] = None,
+        singleflight_lease: float = 30.0,
+        stale_while_revalidate: bool = False,
+        max_version_lag: Optional[int] = None,
     ):
         self._instance_name = instance_name
         self._component_name = instance_name.split("__")[0]
         self._instance_id = instance_name.split("__")[1]
         self._cache_ttl = cache_ttl
+        self._props_hasher = props_hasher if props_hasher else hash_object
         self._num_messages = 100
 
         # VictoriaMetrics Configuration
@@ -71,6 +121,44 @@ class Executor:
         self._init_state_params = init_state_params
         self._load_state_func = load_state_func
         self._save_state_func = save_state_func
+        # With the hash layout, each top-level state key is stored (and
+        # versioned) separately, so we keep the version of each key we have
+        self._state_layout = state_layout
+        self._lazy_state = lazy_state
+        self._field_versions: Dict[str, int] = {}
+        self._concurrency = concurrency
+        self._serializer = get_serializer(serializer)
+        self._compression = compression
+        self._compression_threshold = compression_threshold
+        self._compressor = get_compressor(compression, compression_threshold)
+        self._blob_store = blob_store
+        # Processes on this host share loaded state versions through
+        # memory-mapped files
+        self._shared_state = SharedStateCache() if shared_state else None
+        # Whether the loaded state maps another process's read-only copy
+        self._state_is_shared = False
+        # In-process cache of serve results, checked before Redis
+        self._result_cache = result_cache if cache_ttl else None
+        # Concurrent calls of a serve op on the same props wait for one
+        # execution of it, in this process or, with "redis", across
+        # processes. Calls to run and arun wait separately, so run never
+        # blocks an event loop waiting on arun
+        self._singleflight = singleflight if cache_ttl else None
+        self._singleflight_lease = singleflight_lease
+        self._flights = SingleFlight()
+        self._aflights = SingleFlight()
+        # Cached results computed against older state versions are served
+        # while they are recomputed in the background, and results more
+        # than max_version_lag versions behind aren't served
+        self._stale_while_revalidate = stale_while_revalidate
+        self._max_version_lag = max_version_lag
+        self._revalidating: Set[str] = set()
+        self._revalidation_lock = threading.Lock()
+        self._revalidation_tp: Optional[ThreadPoolExecutor] = None
+        # Tasks running on the caller's event loop after the call returned:
+        # async generator serve ops finishing for waiting calls after their
+        # caller stopped iterating them, and recomputed stale results
+        self._background_tasks: Set[asyncio.Task] = set()
         self.__lock_prefix = (
             f"MOTION_LOCK:DEV:{self._instance_name}"
             if os.getenv("MOTION_ENV", "prod") == "dev"
@@ -81,6 +169,14 @@ class Executor:
             if os.getenv("MOTION_ENV", "prod") == "dev"
             else f"MOTION_QUEUE:{self._instance_name}"
         )
+        # Update streams get their own keys, so they never clash with
+        # update queues left over from the list backend
+        self._queue_backend = queue_backend
+        self.__stream_prefix = (
+            f"MOTION_STREAM:DEV:{self._instance_name}"
+            if os.getenv("MOTION_ENV", "prod") == "dev"
+            else f"MOTION_STREAM:{self._instance_name}"
+        )
         self.__channel_prefix = (
             f"MOTION_CHANNEL:DEV:{self._instance_name}"
             if os.getenv("MOTION_ENV", "prod") == "dev"
@@ -91,11 +187,44 @@ class Executor:
             if os.getenv("MOTION_ENV", "prod") == "dev"
             else f"MOTION_RESULT:{self._instance_name}"
         )
+        self.__lease_prefix = (
+            f"MOTION_LEASE:DEV:{self._instance_name}"
+            if os.getenv("MOTION_ENV", "prod") == "dev"
+            else f"MOTION_LEASE:{self._instance_name}"
+        )
+
+        self.__version_keys = (
+            [
+                f"MOTION_VERSION:DEV:{self._instance_name}",
+                f"MOTION_VERSION:{self._instance_name}",
+            ]
+            if os.getenv("MOTION_ENV", "prod") == "dev"
+            else [f"MOTION_VERSION:{self._instance_name}"]
+        )
 
         self.running: Any = multiprocessing.Value("b", False)
         self._redis_socket_timeout = redis_socket_timeout
 
         self._redis_params, self._redis_con = self._connectToRedis()
+        self._cached_serve_lookup = self._redis_con.register_script(CACHED_SERVE_LOOKUP)
+        self._release_lease = self._redis_con.register_script(RELEASE_LEASE)
+        # Async clients used by arun, one per event loop since their
+        # connections are bound to the loop they were opened on
+        self._async_redis_cons: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[aioredis.Redis, Any]]" = (  # noqa: E501
+            weakref.WeakKeyDictionary()
+        )
+        self._async_state_locks: (
+            "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]"
+        ) = weakref.WeakKeyDictionary()  # noqa: E501
+        # State loads for async calls, by the version they load (and
+        # whether they load a private copy of it), which
+        # concurrent calls on any event loop wait on rather than each
+        # loading the state. Loads run one at a time
+        self._pending_loads: Dict[Tuple[Optional[int], bool], Future] = {}
+        self._pending_loads_lock = threading.Lock()
+        self._async_load_lock = threading.Lock()
+        # Durations (seconds) of each phase of the most recent serve op
+        self.serve_timings: Dict[str, float] = {}
         try:
             self._redis_con.ping()
         except redis.exceptions.ConnectionError:
@@ -107,10 +236,27 @@ class Executor:
             )
         self.running.value = True
 
+        # Offset between the Redis server clock and ours, so enqueueing
+        # updates doesn't need to ask Redis for the time
+        self._redis_clock_offset = self._redis_con.time()[0] - time.time()
+
         # If version does not exist, load state
         self.version: Optional[int] = None
+        self._last_version_check = 0.0
         self._loadState(only_create=True)
 
+        # Optionally listen for new state versions instead of looking the
+        # version up before every serve op
+        self._version_listener: Optional[StateVersionListener] = None
+        if push_state_updates:
+            self._version_listener = StateVersionListener(
+                instance_name=self._instance_name,
+                channel=get_version_channel(self._instance_name),
+                redis_params=self._redis_params.dict(),
+                max_staleness=max_state_staleness,
+            )
+            self._version_listener.start()
+
         # Set up routes
         self._serve_routes: Dict[str, Route] = serve_routes
         self._update_routes: Dict[str, Dict[str, Route]] = {
@@ -120,22 +266,666 @@ class Executor:
 
         # Set up update queues, batch sizes, and threads
         self.disable_update_task = disable_update_task
+        self._update_pool: Optional[UpdateWorkerPool] = None
+        self._pool_task: Optional[BaseUpdateTask] = None
         if not disable_update_task:
             self.update_task_type = update_task_type
             self._build_fit_jobs()
 
-        self.tp = ThreadPoolExecutor(max_workers=2)
+        # Instances whose updates run on workers register themselves for the
+        # workers whenever they queue updates
+        self._worker_keys: Optional[Tuple[str, str]] = (
+            get_worker_keys(self._component_name)
+            if not disable_update_task and update_task_type == "external"
+            else None
+        )
+
+        # Instances on the update pool share its threadpool
+        if self._update_pool is None:
+            self.tp = ThreadPoolExecutor(max_workers=2)
 
         # Add component name to set of components if we are not in dev mode
         if os.getenv("MOTION_ENV", "prod") != "dev":
             self._redis_con.sadd("MOTION_COMPONENTS", self._component_name)
 
-    def _setRedis(self, cache_result_key: str, props: Any) -> None:
-        """Method to set value in Redis."""
+    def _dumpCachedResult(
+        self, serve_result: Any, props_update: Dict[str, Any], version: Optional[int]
+    ) -> bytes:
+        """Serializes a serve result to cache, compressing it if enabled."""
+        data = dump_result(serve_result, props_update, version)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        return data
+
+    def _loadCachedResult(self, data: bytes) -> CachedResult:
+        """Deserializes a cached serve result, whether or not it was
+        compressed."""
+        if self._compressor is not None:
+            return load_result(self._compressor.decompress(data))
+        return load_result(decompress(data))
+
+    def _applyCachedResult(
+        self,
+        cache_result_key: str,
+        props: Properties,
+        data: bytes,
+        key: Optional[str] = None,
+        current_version: Optional[int] = None,
+    ) -> bool:
+        """Sets the serve result (and the props the serve op set) of a
+        cached result found in Redis on the caller's props. If the flow key
+        is passed, the state version the result was computed against is
+        checked against the current version.
+
+        Returns:
+            bool: Whether the cached result was usable.
+        """
+        cached = self._loadCachedResult(data)
+        if cached.serve_result is None:
+            return False
+        if key is not None and not self._checkStaleness(
+            key, cache_result_key, props, cached.version, current_version
+        ):
+            return False
+
+        props_update = cached.props_update
+        if cached.legacy_props is not None:
+            # Entries written by older versions hold the whole props. Keep
+            # the props the caller didn't pass, which the serve op set, and
+            # rewrite the entry in the current format
+            props_update = {
+                k: v for k, v in cached.legacy_props.items() if k not in props
+            }
+            self.tp.submit(
+                self._migrateCachedResult,
+                cache_result_key,
+                cached.serve_result,
+                props_update,
+            )
+
+        props._serve_result = cached.serve_result
+        props.update(props_update)
+        if self._result_cache is not None:
+            self._result_cache.put(
+                cache_result_key,
+                (cached.serve_result, props_update),
+                self._cache_ttl,
+                cached.version,
+            )
+        return True
+
+    def _migrateCachedResult(
+        self, cache_result_key: str, serve_result: Any, props_update: Dict[str, Any]
+    ) -> None:
+        """Rewrites a cached result written by an older version in the
+        current format, keeping its expiry."""
+        ttl = self._redis_con.pttl(cache_result_key)
+        if ttl is None or ttl <= 0:
+            return
         self._redis_con.set(
-            cache_result_key, cloudpickle.dumps(props), ex=self._cache_ttl
+            cache_result_key,
+            self._dumpCachedResult(serve_result, props_update, None),
+            px=ttl,
+            xx=True,
         )
 
+    def _checkStaleness(
+        self,
+        key: str,
+        cache_result_key: str,
+        props: Properties,
+        result_version: Optional[int],
+        current_version: Optional[int],
+    ) -> bool:
+        """Checks whether a cached result computed against an older state
+        version can be served, recomputing it in the background with
+        stale-while-revalidate. Results whose version isn't known, e.g.,
+        ones cached by older versions of Motion, count as too far behind
+        with a maximum version lag.
+
+        Returns:
+            bool: Whether the result can be served.
+        """
+        if not self._stale_while_revalidate and self._max_version_lag is None:
+            return True
+        if current_version is None or (
+            result_version is not None and result_version >= current_version
+        ):
+            return True
+        if self._max_version_lag is not None and (
+            result_version is None
+            or current_version - result_version > self._max_version_lag
+        ):
+            return False
+
+        if self._stale_while_revalidate:
+            self._revalidate(key, cache_result_key, props)
+        return True
+
+    def _revalidate(self, key: str, cache_result_key: str, props: Properties) -> None:
+        """Recomputes a stale cached result against the latest state in the
+        background, unless it is already being recomputed. Async serve ops
+        are rerun on the caller's event loop if there is one."""
+        with self._revalidation_lock:
+            if cache_result_key in self._revalidating:
+                return
+            self._revalidating.add(cache_result_key)
+            if self._revalidation_tp is None:
+                self._revalidation_tp = ThreadPoolExecutor(max_workers=2)
+
+        # The props haven't been updated with the cached result yet, so
+        # they're the props the caller passed
+        input_props = dict(props)
+        udf = self._serve_routes[key].udf
+        if inspect.iscoroutinefunction(udf) or inspect.isasyncgenfunction(udf):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                task = loop.create_task(
+                    self._arecomputeResult(key, cache_result_key, input_props)
+                )
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+                return
+
+        try:
+            self._revalidation_tp.submit(
+                self._recomputeResult, key, cache_result_key, input_props
+            )
+        except RuntimeError:
+            # The executor shut down, so keep serving the stale result
+            self._doneRevalidating(cache_result_key)
+
+    def _doneRevalidating(self, cache_result_key: str) -> None:
+        with self._revalidation_lock:
+            self._revalidating.discard(cache_result_key)
+
+    def _recomputeResult(
+        self, key: str, cache_result_key: str, input_props: Dict[str, Any]
+    ) -> None:
+        """Reruns a serve op against the latest state and caches its
+        result. The state is loaded into a copy of its own, so the
+        instance's state is left to the request path. Update ops aren't
+        run."""
+        udf = self._serve_routes[key].udf
+        if inspect.iscoroutinefunction(udf) or inspect.isasyncgenfunction(udf):
+            get_update_loop().run(
+                self._arecomputeResult(key, cache_result_key, input_props)
+            )
+            return
+
+        try:
+            state, version = self._loadStateSnapshot()
+            props = Properties(input_props)
+            serve_result = self._runServeRoute(key, props, state)
+            if isinstance(serve_result, types.GeneratorType):
+                serve_result = list(serve_result)
+            props._serve_result = serve_result
+            # Keep other calls from recomputing it until it's in Redis
+            self._cacheResult(
+                cache_result_key, props, input_props, version=version
+            ).result()
+        except Exception:
+            logger.warning(
+                f"Could not recompute stale cached result {cache_result_key}.",
+                exc_info=True,
+            )
+        finally:
+            self._doneRevalidating(cache_result_key)
+
+    async def _arecomputeResult(
+        self, key: str, cache_result_key: str, input_props: Dict[str, Any]
+    ) -> None:
+        """Async version of `_recomputeResult`."""
+        try:
+            state, version = await asyncio.to_thread(self._loadStateSnapshot)
+            props = Properties(input_props)
+            serve_result = self._runServeRoute(key, props, state)
+            if isinstance(serve_result, types.AsyncGeneratorType):
+                serve_result = [item async for item in serve_result]
+            elif asyncio.iscoroutine(serve_result):
+                serve_result = await serve_result
+                if is_vectorized(self._serve_routes[key].udf):
+                    serve_result = self._checkVectorizedResults(key, serve_result, 1)[0]
+            props._serve_result = serve_result
+            await asyncio.wrap_future(
+                self._cacheResult(cache_result_key, props, input_props, version=version)
+            )
+        except Exception:
+            logger.warning(
+                f"Could not recompute stale cached result {cache_result_key}.",
+                exc_info=True,
+            )
+        finally:
+            self._doneRevalidating(cache_result_key)
+
+    def _loadStateSnapshot(self) -> Tuple[State, int]:
+        """Loads the latest state into a copy of its own, leaving the
+        instance's state and version untouched."""
+        state: Optional[State]
+        if self._state_layout == "hash":
+            # Reuse the fields that didn't change from our copy
+            state, version, _ = loadStateFields(
+                self._redis_con,
+                self._instance_name,
+                getattr(self, "_state", None),
+                dict(self._field_versions),
+                self._load_state_func,
+                lazy=self._lazy_state,
+                serializer=self._serializer,
+                compressor=self._compressor,
+                blob_store=self._blob_store,
+            )
+        else:
+            state, version = loadState(
+                self._redis_con,
+                self._instance_name,
+                self._load_state_func,
+                self._state_layout,
+                self._serializer,
+                self._compressor,
+                self._blob_store,
+            )
+        if state is None:
+            raise ValueError(
+                f"Error loading state for {self._instance_name}. State is None."
+            )
+        return state, version
+
+    def _latestVersion(self) -> Optional[int]:
+        """Latest state version the instance has heard of without looking it
+        up, or None if it can't know about newer versions without a lookup,
+        i.e., if it isn't listening for new versions."""
+        listener = self._version_listener
+        if listener is None:
+            return None
+        subscribed_at = listener.subscribed_at
+        if subscribed_at is None or self._last_version_check < subscribed_at:
+            return None
+        versions = [v for v in (self.version, listener.latest_version) if v]
+        return max(versions) if versions else None
+
+    def _resultCacheVersion(self) -> Optional[int]:
+        """State version to check results in the in-process cache against,
+        or None if we know a newer version exists."""
+        if (
+            self._version_listener is not None
+            and not self._version_listener.is_current(
+                self.version, self._last_version_check
+            )
+        ):
+            return None
+        return self.version
+
+    def _propsUpdate(
+        self, props: Properties, input_props: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Returns the props the serve op added or reassigned, which are
+        cached along with its result. Props the caller passed aren't cached,
+        since a hit always comes with the same props."""
+        return {
+            k: v
+            for k, v in props.items()
+            if k not in input_props or input_props[k] is not v
+        }
+
+    def _cacheResult(
+        self,
+        cache_result_key: str,
+        props: Properties,
+        input_props: Dict[str, Any],
+        flight: Optional[Flight] = None,
+        lease: Optional[Tuple[str, str]] = None,
+        version: Optional[int] = None,
+    ) -> Future:
+        """Caches a serve result in process right away, and in Redis in the
+        background. Calls waiting on the flight get the result right away,
+        and new calls on the same props join the flight until the result
+        is in Redis. The result is recorded as computed against `version`,
+        which defaults to the version of the instance's state.
+
+        Returns:
+            Future: Done once the result is in Redis.
+        """
+        if version is None:
+            version = self.version
+        props_update = self._propsUpdate(props, input_props)
+        if self._result_cache is not None:
+            self._result_cache.put(
+                cache_result_key,
+                (props._serve_result, props_update),
+                self._cache_ttl,
+                version,
+            )
+        future = self.tp.submit(
+            self._setRedis,
+            cache_result_key,
+            props._serve_result,
+            props_update,
+            version,
+            lease,
+        )
+        if flight is not None:
+            flight.finish(props._serve_result, props_update)
+            future.add_done_callback(lambda _: flight.release())
+        return future
+
+    def _setRedis(
+        self,
+        cache_result_key: str,
+        serve_result: Any,
+        props_update: Dict[str, Any],
+        version: Optional[int],
+        lease: Optional[Tuple[str, str]] = None,
+    ) -> None:
+        """Method to set value in Redis, releasing the lease held on it."""
+        try:
+            self._redis_con.set(
+                cache_result_key,
+                self._dumpCachedResult(serve_result, props_update, version),
+                ex=self._cache_ttl,
+            )
+        finally:
+            if lease is not None:
+                self._releaseLease(lease)
+
+    def _releaseLease(self, lease: Tuple[str, str]) -> None:
+        lease_key, token = lease
+        self._release_lease(keys=[lease_key], args=[token])
+
+    def _newLease(self, key: str, value_hash: str) -> Tuple[str, str]:
+        """Returns the key of the lease on a serve result and a token to
+        take it with."""
+        return f"{self.__lease_prefix}/{key}/{value_hash}", uuid4().hex
+
+    def _leasedResult(
+        self, cache_result_key: str, props: Properties, data: Optional[bytes]
+    ) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """Returns the serve result, and the props the serve op set, of a
+        result cached by the process that held the lease on it."""
+        if data is None:
+            return None
+        found = Properties(props)
+        if not self._applyCachedResult(cache_result_key, found, data):
+            return None
+        return found.serve_result, self._propsUpdate(found, props)
+
+    def _waitForLeasedResult(
+        self, cache_result_key: str, lease_key: str, props: Properties
+    ) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """Waits for the process holding the lease on a serve result to
+        cache it.
+
+        Returns:
+            Optional[Tuple[Any, Dict[str, Any]]]: The serve result and the
+            props the serve op set, or None if the lease was released or
+            expired without the result being cached.
+        """
+        delay = LEASE_POLL_INTERVAL
+        while True:
+            # Read both at once, since the result is cached right before
+            # the lease is released
+            pipeline = self._redis_con.pipeline(transaction=True)
+            pipeline.get(cache_result_key)
+            pipeline.exists(lease_key)
+            cached_result, leased = pipeline.execute()
+
+            found = self._leasedResult(cache_result_key, props, cached_result)
+            if found is not None or not leased:
+                return found
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_LEASE_POLL_INTERVAL)
+
+    async def _awaitForLeasedResult(
+        self, cache_result_key: str, lease_key: str, props: Properties
+    ) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """Async version of `_waitForLeasedResult`."""
+        aredis, _ = self._asyncRedis()
+        delay = LEASE_POLL_INTERVAL
+        while True:
+            pipeline = aredis.pipeline(transaction=True)
+            pipeline.get(cache_result_key)
+            pipeline.exists(lease_key)
+            cached_result, leased = await pipeline.execute()
+
+            found = self._leasedResult(cache_result_key, props, cached_result)
+            if found is not None or not leased:
+                return found
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_LEASE_POLL_INTERVAL)
+
+    def _landFlight(
+        self, key: str, flight: Flight, serve_result: Any, props_update: Dict[str, Any]
+    ) -> None:
+        """Hands a serve result another process cached to the calls waiting
+        on the flight."""
+        udf = self._serve_routes[key].udf
+        if inspect.isgeneratorfunction(udf) or inspect.isasyncgenfunction(udf):
+            for item in serve_result:
+                flight.publish(item)
+        flight.finish(serve_result, props_update)
+        flight.release()
+
+    def _failFlight(
+        self, flight: Flight, lease: Optional[Tuple[str, str]], error: BaseException
+    ) -> None:
+        """Raises a serve op's error in the calls waiting on it. If the call
+        running it was cancelled, the waiting calls run it themselves."""
+        if not isinstance(error, Exception):
+            error = FlightAbandoned(f"Serve op for {flight.key} was cancelled.")
+        flight.fail(error)
+        flight.release()
+        if lease is not None:
+            self.tp.submit(self._releaseLease, lease)
+
+    def _joinFlight(
+        self,
+        key: str,
+        props: Properties,
+        value_hash: Optional[str],
+        ignore_cache: bool,
+        force_refresh: bool,
+    ) -> Tuple[Optional[Flight], bool, Optional[Tuple[str, str]]]:
+        """Joins the call running the serve op on the same props, or starts
+        one, if concurrent calls are coalesced. With "redis" coalescing, a
+        call that starts one takes a lease on the result in Redis, or waits
+        for the process holding the lease to cache the result.
+
+        Returns:
+            Tuple[Optional[Flight], bool, Optional[Tuple[str, str]]]: The
+            flight (None if calls aren't coalesced), whether the caller
+            must run the serve op, and the lease it took, if any.
+        """
+        if (
+            self._singleflight is None
+            or not value_hash
+            or ignore_cache
+            or force_refresh
+        ):
+            return None, True, None
+
+        cache_result_key = f"{self.__cache_result_prefix}/{key}/{value_hash}"
+        flight, leading = self._flights.join(cache_result_key)
+        if not leading or self._singleflight != "redis":
+            return flight, leading, None
+
+        lease = self._newLease(key, value_hash)
+        try:
+            if self._redis_con.set(
+                lease[0], lease[1], nx=True, px=int(self._singleflight_lease * 1000)
+            ):
+                return flight, True, lease
+
+            # Another process is running the serve op
+            found = self._waitForLeasedResult(cache_result_key, lease[0], props)
+        except BaseException as e:
+            # The lease may have been taken before the call was interrupted
+            self._failFlight(flight, lease, e)
+            raise
+
+        if found is None:
+            return flight, True, None
+        self._landFlight(key, flight, *found)
+        flight.follow()
+        return flight, False, None
+
+    async def _ajoinFlight(
+        self,
+        key: str,
+        props: Properties,
+        value_hash: Optional[str],
+        ignore_cache: bool,
+        force_refresh: bool,
+    ) -> Tuple[Optional[Flight], bool, Optional[Tuple[str, str]]]:
+        """Async version of `_joinFlight`."""
+        if (
+            self._singleflight is None
+            or not value_hash
+            or ignore_cache
+            or force_refresh
+        ):
+            return None, True, None
+
+        cache_result_key = f"{self.__cache_result_prefix}/{key}/{value_hash}"
+        flight, leading = self._aflights.join(cache_result_key)
+        if not leading or self._singleflight != "redis":
+            return flight, leading, None
+
+        lease = self._newLease(key, value_hash)
+        try:
+            aredis, _ = self._asyncRedis()
+            if await aredis.set(
+                lease[0], lease[1], nx=True, px=int(self._singleflight_lease * 1000)
+            ):
+                return flight, True, lease
+
+            # Another process is running the serve op
+            found = await self._awaitForLeasedResult(cache_result_key, lease[0], props)
+        except BaseException as e:
+            # The lease may have been taken before the call was cancelled
+            self._failFlight(flight, lease, e)
+            raise
+
+        if found is None:
+            return flight, True, None
+        self._landFlight(key, flight, *found)
+        flight.follow()
+        return flight, False, None
+
+    def _abandonFlight(
+        self,
+        flight: Optional[Flight],
+        lease: Optional[Tuple[str, str]],
+        serve_result: Generator[Any, None, None],
+        accumulated_result: List[Any],
+        props: Properties,
+        input_props: Dict[str, Any],
+    ) -> None:
+        """Runs a generator serve op its caller stopped iterating to
+        completion in the background, if calls are waiting on it."""
+        if flight is None:
+            return
+        if not flight.abandon():
+            if lease is not None:
+                self.tp.submit(self._releaseLease, lease)
+            return
+
+        threading.Thread(
+            target=self._drainServe,
+            args=(flight, lease, serve_result, accumulated_result, props, input_props),
+            daemon=True,
+        ).start()
+
+    def _drainServe(
+        self,
+        flight: Flight,
+        lease: Optional[Tuple[str, str]],
+        serve_result: Generator[Any, None, None],
+        accumulated_result: List[Any],
+        props: Properties,
+        input_props: Dict[str, Any],
+    ) -> None:
+        try:
+            for item in serve_result:
+                accumulated_result.append(item)
+                flight.publish(item)
+            props._serve_result = accumulated_result  # type: ignore
+            self._cacheResult(flight.key, props, input_props, flight, lease)
+        except BaseException as e:
+            self._failFlight(flight, lease, e)
+            if not isinstance(e, Exception):
+                raise
+
+    def _aabandonFlight(
+        self,
+        flight: Optional[Flight],
+        lease: Optional[Tuple[str, str]],
+        serve_result: AsyncGenerator[Any, None],
+        accumulated_result: List[Any],
+        props: Properties,
+        input_props: Dict[str, Any],
+    ) -> None:
+        """Async version of `_abandonFlight`, which runs the serve op to
+        completion in a task on the running loop."""
+        if flight is None:
+            return
+        if not flight.abandon():
+            if lease is not None:
+                self.tp.submit(self._releaseLease, lease)
+            return
+
+        try:
+            task = asyncio.get_running_loop().create_task(
+                self._adrainServe(
+                    flight, lease, serve_result, accumulated_result, props, input_props
+                )
+            )
+        except RuntimeError:
+            # The caller's generator was finalized outside of a loop
+            self._failFlight(
+                flight, lease, FlightAbandoned(f"Serve op for {flight.key} stopped.")
+            )
+            return
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _adrainServe(
+        self,
+        flight: Flight,
+        lease: Optional[Tuple[str, str]],
+        serve_result: AsyncGenerator[Any, None],
+        accumulated_result: List[Any],
+        props: Properties,
+        input_props: Dict[str, Any],
+    ) -> None:
+        try:
+            async for item in serve_result:
+                accumulated_result.append(item)
+                flight.publish(item)
+            props._serve_result = accumulated_result  # type: ignore
+            self._cacheResult(flight.key, props, input_props, flight, lease)
+        except BaseException as e:
+            self._failFlight(flight, lease, e)
+            if not isinstance(e, Exception):
+                raise
+
+    def _setRedisMany(
+        self,
+        cache_results: Dict[str, Tuple[Any, Dict[str, Any]]],
+        version: Optional[int],
+    ) -> None:
+        """Method to set many values in Redis in one round trip."""
+        pipeline = self._redis_con.pipeline(transaction=False)
+        for cache_result_key, (serve_result, props_update) in cache_results.items():
+            pipeline.set(
+                cache_result_key,
+                self._dumpCachedResult(serve_result, props_update, version),
+                ex=self._cache_ttl,
+            )
+        pipeline.execute()
+
     def _logMessage(
         self,
         flow_key: str,
@@ -171,21 +961,85 @@ class Executor:
             except requests.RequestException as e:
                 logger.error(f"Failed to send metric to VictoriaMetrics: {e}")
 
-    def _connectToRedis(self) -> Tuple[RedisParams, redis.Redis]:
-        rp = get_redis_params()
+    def _logPhaseTimings(
+        self, flow_key: str, timings: Dict[str, float], cache_hit: bool
+    ) -> None:
+        """Method to log the duration of each phase of a serve op, along
+        with the compression stats gathered since the last call, to
+        VictoriaMetrics using InfluxDB line protocol."""
+        if self.victoria_metrics_url:
+            timestamp = int(time.time() * 1000000000)
+
+            metrics = [
+                f"motion_serve_phase_duration_seconds,component={self._component_name},instance={self._instance_id},flow={flow_key},phase={phase},cache_hit={str(cache_hit).lower()} value={duration} {timestamp}"  # noqa: E501
+                for phase, duration in timings.items()
+            ]
+            metrics += compressionMetrics(
+                self._compressor,
+                self._component_name,
+                self._instance_id,
+                "executor",
+                timestamp,
+            )
+            payload = "\n".join(metrics)
 
+            try:
+                response = requests.post(
+                    self.victoria_metrics_url + "/write", data=payload
+                )
+                response.raise_for_status()
+            except requests.RequestException as e:
+                logger.error(f"Failed to send metric to VictoriaMetrics: {e}")
+
+    def _redisConnectionParams(self, rp: RedisParams) -> Dict[str, Any]:
         # Put a timeout on the connection
         param_dict = rp.dict()
         if "socket_timeout" not in param_dict:
             param_dict["socket_timeout"] = self._redis_socket_timeout
 
         # Pop all None values
-        param_dict = {k: v for k, v in param_dict.items() if v is not None}
+        return {k: v for k, v in param_dict.items() if v is not None}
 
-        r = redis.Redis(**param_dict)
+    def _connectToRedis(self) -> Tuple[RedisParams, redis.Redis]:
+        rp = get_redis_params()
+        r = redis.Redis(**self._redisConnectionParams(rp))
         return rp, r
 
+    def _asyncRedis(self) -> Tuple[aioredis.Redis, Any]:
+        """Gets the async Redis client for the running event loop, and the
+        cached serve lookup script registered with it. Each client has its
+        own connection pool."""
+        loop = asyncio.get_running_loop()
+        entry = self._async_redis_cons.get(loop)
+        if entry is None:
+            aredis = aioredis.Redis(**self._redisConnectionParams(self._redis_params))
+            entry = (aredis, aredis.register_script(CACHED_SERVE_LOOKUP))
+            self._async_redis_cons[loop] = entry
+        return entry
+
+    def _closeAsyncRedis(self) -> None:
+        """Closes the async Redis clients on the loops they belong to."""
+        for loop, (aredis, _) in list(self._async_redis_cons.items()):
+            if loop.is_closed():
+                continue
+            close = aredis.close(close_connection_pool=True)
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(close, loop)
+            else:
+                # Run the stopped loop until the client is closed, on another
+                # thread in case this one is running a loop
+                closer = threading.Thread(target=loop.run_until_complete, args=(close,))
+                closer.start()
+                closer.join()
+        self._async_redis_cons.clear()
+
+    def _redisTime(self) -> int:
+        """Current time on the Redis server (seconds)."""
+        return int(time.time() + self._redis_clock_offset)
+
     def _loadVersion(self) -> Optional[int]:
+        self._last_version_check = time.monotonic()
+
         # If in dev mode, try loading dev
         redis_v = None
         if os.getenv("MOTION_ENV", "prod") == "dev":
@@ -196,9 +1050,111 @@ class Executor:
 
         return int(redis_v) if redis_v else None
 
-    def _loadState(self, only_create: bool = False) -> None:
-        # If in dev mode, try loading dev state
-        redis_v = self._loadVersion()
+    async def _aloadVersion(self) -> Optional[int]:
+        """Async version of `_loadVersion`."""
+        self._last_version_check = time.monotonic()
+        aredis, _ = self._asyncRedis()
+
+        redis_v = None
+        for version_key in self.__version_keys:
+            redis_v = await aredis.get(version_key)
+            if redis_v:
+                break
+
+        return int(redis_v) if redis_v else None
+
+    async def _aloadState(
+        self,
+        trust_cache: bool = False,
+        redis_v: Optional[int] = None,
+        private: bool = False,
+    ) -> None:
+        """Async version of `_loadState`. Looks the version up without
+        blocking the event loop, and only loads the state (in a thread) if
+        it changed."""
+        if (
+            trust_cache
+            and self._version_listener is not None
+            and self._version_listener.is_current(
+                self.version, self._last_version_check
+            )
+        ):
+            return
+
+        if redis_v is None:
+            redis_v = await self._aloadVersion()
+        if not self._needsLoad(redis_v, private):
+            return
+
+        # Wait on the load of this version if another call started it
+        with self._pending_loads_lock:
+            pending = self._pending_loads.get((redis_v, private))
+            leading = pending is None
+            if pending is None:
+                pending = Future()
+                # Cancelling a waiting call doesn't cancel the load
+                pending.set_running_or_notify_cancel()
+                self._pending_loads[(redis_v, private)] = pending
+        if leading:
+            asyncio.get_running_loop().run_in_executor(
+                None, self._loadPendingState, pending, redis_v, private
+            )
+        await asyncio.wrap_future(pending)
+
+    def _needsLoad(self, redis_v: Optional[int], private: bool) -> bool:
+        """Whether the state must be loaded to get version `redis_v`, or a
+        private copy of it."""
+        if redis_v and self.version and self.version >= redis_v:
+            return private and self._state_is_shared
+        return True
+
+    def _loadPendingState(
+        self, pending: Future, redis_v: Optional[int], private: bool
+    ) -> None:
+        """Loads a state version for the async calls waiting on it."""
+        error: Optional[BaseException] = None
+        try:
+            with self._async_load_lock:
+                # An earlier load may have loaded this version already
+                if self._needsLoad(redis_v, private):
+                    self._loadState(redis_v=redis_v, private=private)
+        except BaseException as e:
+            error = e
+        finally:
+            with self._pending_loads_lock:
+                del self._pending_loads[(redis_v, private)]
+
+        if error is not None:
+            pending.set_exception(error)
+        else:
+            pending.set_result(None)
+
+    def _loadState(
+        self,
+        only_create: bool = False,
+        trust_cache: bool = False,
+        redis_v: Optional[int] = None,
+        private: bool = False,
+    ) -> None:
+        """Loads the latest state version if it's newer than the one loaded.
+        With `private`, a state mapping another process's read-only copy is
+        replaced with a writable copy of its own, e.g., for update ops that
+        modify it in place."""
+        # Skip the version lookup if we are listening for new versions and
+        # haven't heard of one newer than what we have
+        if (
+            trust_cache
+            and self._version_listener is not None
+            and self._version_listener.is_current(
+                self.version, self._last_version_check
+            )
+        ):
+            return
+
+        # If in dev mode, try loading dev state. The version may already
+        # have been looked up alongside the cached result
+        if redis_v is None:
+            redis_v = self._loadVersion()
         if not redis_v:
             # If state does not exist, run setUp
             with self._redis_con.lock(self.__queue_prefix, timeout=120):
@@ -220,8 +1176,21 @@ class Executor:
                         self._redis_con,
                         self._instance_name,
                         self._save_state_func,
+                        self._state_layout,
+                        self._serializer,
+                        self._compressor,
+                        self._blob_store,
                     )
+                    self._field_versions = {key: version for key in state}
                     assert version == 1, "Version should be 1 after saving state."
+                    if self._state_layout == "hash" and self._load_state_func:
+                        # Transform the declared fields like a reload would
+                        hook_fields = getHookFields(self._load_state_func)
+                        state.update(
+                            self._load_state_func(
+                                {f: state[f] for f in hook_fields if f in state}
+                            )
+                        )
                     loaded_state = True
 
             if loaded_state:
@@ -230,10 +1199,23 @@ class Executor:
                 return
 
         if not only_create:
-            if self.version is None or (self.version and self.version < redis_v):  # type: ignore # noqa: E501
+            if self._needsLoad(redis_v, private):
                 # Reload state
+                if self._state_layout == "hash":
+                    self._loadStateFields()
+                    return
+                if self._shared_state is not None and not private:
+                    self._loadSharedState(redis_v)  # type: ignore
+                    return
+
                 new_state, self.version = loadState(
-                    self._redis_con, self._instance_name, self._load_state_func
+                    self._redis_con,
+                    self._instance_name,
+                    self._load_state_func,
+                    self._state_layout,
+                    self._serializer,
+                    self._compressor,
+                    self._blob_store,
                 )
                 if new_state is None:
                     raise ValueError(
@@ -241,27 +1223,160 @@ class Executor:
                         + " State is None."
                     )
                 self._state = new_state
+                self._state_is_shared = False
+
+    def _loadSharedState(self, redis_v: int) -> None:
+        """Maps the state version if another process on this host already
+        loaded it, or loads it from Redis and shares it otherwise."""
+        assert self._shared_state is not None
+        stored = self._shared_state.attach(
+            self._redis_con, self._instance_name, redis_v
+        )
+        version = redis_v
+        if stored is None:
+            # Load the state as stored, and run the load_state hook below,
+            # since what it returns (e.g., connections) can't be shared
+            loaded, version = loadState(
+                self._redis_con,
+                self._instance_name,
+                None,
+                self._state_layout,
+                self._serializer,
+                self._compressor,
+                self._blob_store,
+            )
+            if loaded is None:
+                raise ValueError(
+                    f"Error loading state for {self._instance_name}. State is None."
+                )
+            self._shared_state.publish(
+                self._redis_con, self._instance_name, version, loaded
+            )
+            # Use the shared copy too, so this process doesn't keep its own
+            stored = (
+                self._shared_state.attach(self._redis_con, self._instance_name, version)
+                or loaded
+            )
 
-    def _saveState(self, new_state: State) -> None:
-        assert self.version is not None, "Version should not be None."
-
-        # Save state to redis
-        new_version = saveState(
-            new_state,
-            self.version,
+        new_state = State(
+            self._instance_name.split("__")[0], self._instance_name.split("__")[1], {}
+        )
+        if self._load_state_func is not None:
+            new_state.update(self._load_state_func(stored))
+        else:
+            new_state.update(stored)
+        self._state = new_state
+        self._state_is_shared = True
+        self.version = version
+
+    def _loadStateFields(self) -> None:
+        # Only fetch the keys that changed since our copy
+        new_state, self.version, self._field_versions = loadStateFields(
             self._redis_con,
             self._instance_name,
-            self._save_state_func,
+            getattr(self, "_state", None),
+            self._field_versions,
+            self._load_state_func,
+            lazy=self._lazy_state,
+            serializer=self._serializer,
+            compressor=self._compressor,
+            blob_store=self._blob_store,
         )
+        if new_state is None:
+            raise ValueError(
+                f"Error loading state for {self._instance_name}. State is None."
+            )
+        self._state = new_state
+
+    def _stateLock(self) -> Any:
+        """Lock to hold while updating the state. With optimistic
+        concurrency, commits are checked against the version instead."""
+        if self._concurrency == "optimistic":
+            return contextlib.nullcontext()
+        return self._redis_con.lock(self.__lock_prefix, timeout=120)
+
+    @contextlib.asynccontextmanager
+    async def _astateLock(self) -> AsyncIterator[None]:
+        """Async version of `_stateLock`, which waits for the lock without
+        blocking the event loop. Coroutines on the same loop take turns on
+        a local lock first, so only one of them polls the lock in Redis."""
+        if self._concurrency == "optimistic":
+            yield
+            return
+
+        loop = asyncio.get_running_loop()
+        local_lock = self._async_state_locks.get(loop)
+        if local_lock is None:
+            local_lock = self._async_state_locks[loop] = asyncio.Lock()
+
+        aredis, _ = self._asyncRedis()
+        async with local_lock:
+            async with aredis.lock(self.__lock_prefix, timeout=120):
+                yield
+
+    def _saveState(
+        self, new_state: State, state_update: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Saves the state, or reloads it if another writer saved a newer
+        state first.
+
+        Returns:
+            bool: Whether the state was saved.
+        """
+        assert self.version is not None, "Version should not be None."
+
+        # Save state to redis
+        if self._state_layout == "hash":
+            # Only write the keys that were updated
+            if state_update is None:
+                state_update = new_state
+            new_version = saveStateFields(
+                state_update,
+                self.version,
+                self._redis_con,
+                self._instance_name,
+                serializer=self._serializer,
+                compressor=self._compressor,
+                blob_store=self._blob_store,
+            )
+            if new_version == -1:
+                # Our copies of these keys were never committed
+                for key in state_update:
+                    self._field_versions.pop(key, None)
+            else:
+                self._field_versions.update({key: new_version for key in state_update})
+                hook_fields = getHookFields(self._load_state_func)
+                if any(key in hook_fields for key in state_update):
+                    # Rerun the load_state hook on the fields we just saved
+                    for key in hook_fields:
+                        self._field_versions.pop(key, None)
+                    self._loadStateFields()
+                    return True
+        else:
+            new_version = saveState(
+                new_state,
+                self.version,
+                self._redis_con,
+                self._instance_name,
+                self._save_state_func,
+                self._state_layout,
+                self._serializer,
+                self._compressor,
+                self._blob_store,
+            )
         if new_version == -1:
-            logger.error(
+            # Conflicts are expected with optimistic concurrency, and the
+            # caller reruns the update
+            (logger.debug if self._concurrency == "optimistic" else logger.error)(
                 f"Error saving state to Redis for {self._instance_name}:"
                 + " there was a newer state found."
             )
             # Reload state
             self._loadState()
-        else:
-            self.version = new_version
+            return False
+
+        self.version = new_version
+        return True
 
     def setUp(self, **kwargs: Any) -> Dict[str, Any]:
         # Set up initial state
@@ -280,7 +1395,13 @@ class Executor:
             UpdateProcess if self.update_task_type == "process" else UpdateThread
         )
 
-        # Set up update task
+        # Set up update task. The control queue wakes the task up when
+        # shutting down, so it can block on the update queues indefinitely
+        self._control_queue = (
+            f"{self.__stream_prefix}::control/{uuid4()}"
+            if self._queue_backend == "stream"
+            else f"{self.__queue_prefix}::control/{uuid4()}"
+        )
         self.route_dict_for_fit = {}
         self.channel_dict_for_fit = {}
         self.queue_ids_for_fit = []
@@ -294,7 +1415,32 @@ class Executor:
                 )
 
         self.worker_task = None
-        if self.queue_ids_for_fit:
+        if self.queue_ids_for_fit and self.update_task_type == "pool":
+            # Share the process-wide worker pool instead of starting a task
+            self._update_pool = get_update_pool(self._redis_params.dict())
+            self.tp = self._update_pool.background
+            self._pool_task = BaseUpdateTask(
+                task_type="pool",
+                instance_name=self._instance_name,
+                routes=self.route_dict_for_fit,
+                save_state_func=self._save_state_func,
+                load_state_func=self._load_state_func,
+                queue_identifiers=self.queue_ids_for_fit,
+                channel_identifiers=self.channel_dict_for_fit,
+                lock_identifier=self.__lock_prefix,
+                redis_params=self._redis_params.dict(),
+                running=self.running,
+                control_queue=self._control_queue,
+                victoria_metrics_url=self.victoria_metrics_url,
+                state_layout=self._state_layout,
+                concurrency=self._concurrency,
+                serializer=self._serializer,
+                compression=self._compression,
+                compression_threshold=self._compression_threshold,
+                blob_store=self._blob_store,
+            )
+            self._update_pool.register(self._pool_task)
+        elif self.queue_ids_for_fit and self.update_task_type != "external":
             self.worker_task = update_cls(
                 instance_name=self._instance_name,
                 routes=self.route_dict_for_fit,
@@ -305,7 +1451,15 @@ class Executor:
                 lock_identifier=self.__lock_prefix,
                 redis_params=self._redis_params.dict(),
                 running=self.running,
+                control_queue=self._control_queue,
                 victoria_metrics_url=self.victoria_metrics_url,
+                queue_backend=self._queue_backend,
+                state_layout=self._state_layout,
+                concurrency=self._concurrency,
+                serializer=self._serializer,
+                compression=self._compression,
+                compression_threshold=self._compression_threshold,
+                blob_store=self._blob_store,
             )
             self.worker_task.start()  # type: ignore
 
@@ -343,6 +1497,14 @@ class Executor:
                     lock_identifier=self.__lock_prefix,
                     redis_params=self._redis_params.dict(),
                     running=self.running,
+                    control_queue=self._control_queue,
+                    queue_backend=self._queue_backend,
+                    state_layout=self._state_layout,
+                    concurrency=self._concurrency,
+                    serializer=self._serializer,
+                    compression=self._compression,
+                    compression_threshold=self._compression_threshold,
+                    blob_store=self._blob_store,
                 )
                 self.worker_task.start()  # type: ignore
 
@@ -354,13 +1516,27 @@ class Executor:
 
     def _get_queue_identifier(self, route_key: str, udf_name: str) -> str:
         """Gets the queue identifier for a given route key and UDF name."""
+        if self._queue_backend == "stream":
+            return f"{self.__stream_prefix}/{route_key}/{udf_name}"
         return f"{self.__queue_prefix}/{route_key}/{udf_name}"
 
     def _get_channel_identifier(self, route_key: str, udf_name: str) -> str:
         """Gets the channel identifier for a given route key and UDF name."""
         return f"{self.__channel_prefix}/{route_key}/{udf_name}"
 
+    def stop_version_listener(self) -> None:
+        if self._version_listener is not None:
+            self._version_listener.stop()
+            self._version_listener = None
+
     def shutdown(self, is_open: bool, wait_for_logging_threads: bool) -> None:
+        self.stop_version_listener()
+
+        if self._revalidation_tp is not None:
+            self._revalidation_tp.shutdown(wait=False)
+
+        self._closeAsyncRedis()
+
         if self.disable_update_task:
             if self._redis_con:
                 self._redis_con.close()
@@ -378,6 +1554,27 @@ class Executor:
         self.stop_event.set()
         self.running.value = False
 
+        # Wake up the update task. The control queue expires in case the
+        # task already exited and never pops it
+        if self.worker_task:
+            try:
+                pipeline = self._redis_con.pipeline(transaction=True)
+                if self._queue_backend == "stream":
+                    pipeline.xadd(self._control_queue, {"stop": "1"})
+                else:
+                    pipeline.rpush(self._control_queue, "STOP")
+                pipeline.expire(self._control_queue, 60)
+                pipeline.execute()
+            except redis.exceptions.RedisError:
+                logger.warning(
+                    "Could not wake up the update task. Shutdown may take up "
+                    + "to 30 seconds.",
+                    exc_info=True,
+                )
+
+        if self._update_pool is not None and self._pool_task is not None:
+            self._update_pool.deregister(self._pool_task)
+
         # If process, check if pid exists
         if self.update_task_type == "process":
             if self.worker_task:
@@ -388,8 +1585,10 @@ class Executor:
             if self.worker_task and self.worker_task.is_alive():  # type: ignore
                 self.worker_task.join()  # type: ignore
 
-        # Shut down threadpool for writing to Redis and logging
-        self.tp.shutdown(wait=wait_for_logging_threads)
+        # Shut down threadpool for writing to Redis and logging, unless it's
+        # shared with other instances
+        if self._update_pool is None:
+            self.tp.shutdown(wait=wait_for_logging_threads)
 
         self._redis_con.close()
 
@@ -404,22 +1603,35 @@ class Executor:
         new_state: Dict[str, Any],
         force_update: bool = True,
         use_lock: bool = True,
-    ) -> None:
+    ) -> bool:
         if not new_state:
-            return
+            return True
 
         if not isinstance(new_state, dict):
             raise TypeError("State should be a dict.")
 
         # Get latest state
         if use_lock:
-            with self._redis_con.lock(self.__lock_prefix, timeout=120):
+            with self._stateLock():
                 if force_update:
-                    self._loadState()
+                    # Reapply the update to the latest state until it
+                    # commits, in case a writer that doesn't take the same
+                    # lock committed first
+                    for attempt in range(MAX_COMMIT_ATTEMPTS):
+                        self._loadState()
+                        self._state.update(new_state)
+                        if self._saveState(self._state, new_state):
+                            return True
+                        waitAfterConflict(attempt)
+                    raise RuntimeError(
+                        f"Could not commit state for {self._instance_name} "
+                        + f"after {MAX_COMMIT_ATTEMPTS} attempts."
+                    )
+
                 self._state.update(new_state)
 
                 # Save state to redis
-                self._saveState(self._state)
+                return self._saveState(self._state, new_state)
 
         else:
             if force_update:
@@ -427,7 +1639,106 @@ class Executor:
             self._state.update(new_state)
 
             # Save state to redis
-            self._saveState(self._state)
+            return self._saveState(self._state, new_state)
+
+    def _enqueue_updates(self, key: str, props_list: List[Properties]) -> None:
+        """Pushes each of the props onto the queue of every update op for
+        the flow key in a single transaction."""
+        pipeline = self._redis_con.pipeline(transaction=True)
+        self._queueUpdates(pipeline, key, props_list)
+        pipeline.execute()
+
+    async def _aenqueue_updates(self, key: str, props_list: List[Properties]) -> None:
+        """Async version of `_enqueue_updates`."""
+        aredis, _ = self._asyncRedis()
+        pipeline = aredis.pipeline(transaction=True)
+        self._queueUpdates(pipeline, key, props_list)
+        await pipeline.execute()
+
+    def _queueUpdates(
+        self, pipeline: Any, key: str, props_list: List[Properties]
+    ) -> None:
+        """Adds the commands that push each of the props onto the queue of
+        every update op for the flow key to a pipeline, sync or async."""
+        if self.disable_update_task:
+            raise RuntimeError(
+                f"Update process is disabled. Cannot run update for {key}."
+            )
+
+        if not props_list:
+            return
+
+        for update_udf_name, route in self._update_routes[key].items():
+            func = route.udf
+            queue_identifier: str = self._get_queue_identifier(key, update_udf_name)
+
+            if self._queue_backend == "stream":
+                # If the func has a NUM_NEW_UPDATES discard policy, cap the
+                # stream's length. Items older than discard_after seconds
+                # for the SECONDS policy are dropped by the update task
+                # based on their stream IDs.
+                maxlen = (
+                    func._discard_after  # type: ignore
+                    if func._discard_policy  # type: ignore
+                    == DiscardPolicy.NUM_NEW_UPDATES
+                    else None
+                )
+                for props in props_list:
+                    pipeline.xadd(
+                        queue_identifier,
+                        {
+                            "item": cloudpickle.dumps(
+                                {"props": props, "identifier": str(uuid4())}
+                            )
+                        },
+                        maxlen=maxlen,
+                        approximate=False,
+                    )
+                continue
+
+            # If the func has a SECONDS discard policy, expire_at
+            # = current Redis time + discard_after
+            expire_at = (
+                self._redisTime() + func._discard_after  # type: ignore
+                if func._discard_policy == DiscardPolicy.SECONDS  # type: ignore
+                else None
+            )
+
+            # Add to update queue
+            pipeline.rpush(
+                queue_identifier,
+                *[
+                    cloudpickle.dumps(
+                        {
+                            "props": props,
+                            "identifier": str(uuid4()),
+                            "expire_at": expire_at,
+                        }
+                    )
+                    for props in props_list
+                ],
+            )
+
+            # If the func has a NUM_NEW_UPDATES discard policy, only keep
+            # the newest discard_after items. Trimming from the end in the
+            # same transaction means concurrent producers can't over-trim.
+            # Items older than discard_after seconds for the SECONDS policy
+            # are dropped in the update task.
+            if func._discard_policy == DiscardPolicy.NUM_NEW_UPDATES:  # type: ignore
+                pipeline.ltrim(queue_identifier, -func._discard_after, -1)  # type: ignore # noqa: E501
+
+        self._announceUpdates(pipeline)
+
+    def _announceUpdates(self, pipeline: Any) -> None:
+        """Adds the commands that tell workers this instance has updates to
+        run to a pipeline, sync or async. Workers can't discover instances by
+        their queues, since Redis deletes lists once they are drained."""
+        if self._worker_keys is None:
+            return
+
+        instances_key, channel = self._worker_keys
+        pipeline.sadd(instances_key, self._instance_name)
+        pipeline.publish(channel, self._instance_name)
 
     def _enqueue_and_trigger_update(
         self,
@@ -441,119 +1752,75 @@ class Executor:
         if key in self._update_routes.keys():
             route_hit = True
 
-            # update_events = UpdateEventGroup(key)
+            if not flush_update:
+                self._enqueue_updates(key, [props])
+                return route_hit
+
+            # If flushing update, just run the routes
             for update_udf_name in self._update_routes[key].keys():
-                # If flushing update, just run the route
-                if flush_update:
-                    route = self._update_routes[key][update_udf_name]
+                route = self._update_routes[key][update_udf_name]
 
-                    # Hold lock
-                    start_time = time.time()
+                # Hold lock
+                start_time = time.time()
 
-                    with self._redis_con.lock(self.__lock_prefix, timeout=120):
-                        try:
-                            self._loadState()
+                with self._stateLock():
+                    try:
+                        # With optimistic concurrency, rerun the update op on
+                        # the latest state until it commits
+                        for attempt in range(MAX_COMMIT_ATTEMPTS):
+                            # Update ops may modify the state in place
+                            self._loadState(private=True)
 
                             state_update = route.run(
                                 state=self._state,
-                                props=props,
+                                props=get_update_props(route.udf, [props]),
                             )
 
                             if not isinstance(state_update, dict):
                                 raise ValueError("State update must be a dict.")
-                            else:
-                                # Update state
-                                self._updateState(
-                                    state_update,
-                                    force_update=False,
-                                    use_lock=False,
-                                )
-
-                            # Log message
-                            if self.victoria_metrics_url:
-                                self.tp.submit(
-                                    self._logMessage,
-                                    key,
-                                    "update",
-                                    FlowOpStatus.SUCCESS,
-                                    time.time() - start_time,
-                                    route.udf.__name__,
-                                )
-
-                        except Exception as e:
-                            # Log message
-                            if self.victoria_metrics_url:
-                                self.tp.submit(
-                                    self._logMessage,
-                                    key,
-                                    "update",
-                                    FlowOpStatus.FAILURE,
-                                    time.time() - start_time,
-                                    route.udf.__name__,
-                                )
-
+                            check_writes(route.udf, state_update)
+
+                            # Update state
+                            if self._updateState(
+                                state_update,
+                                force_update=False,
+                                use_lock=False,
+                            ):
+                                break
+                            waitAfterConflict(attempt)
+                        else:
                             raise RuntimeError(
-                                "Error running update route in main process: " + str(e)
+                                f"Could not commit state after {MAX_COMMIT_ATTEMPTS}"
+                                + " attempts."
                             )
 
-                else:
-                    # Enqueue update
+                        # Log message
+                        if self.victoria_metrics_url:
+                            self.tp.submit(
+                                self._logMessage,
+                                key,
+                                "update",
+                                FlowOpStatus.SUCCESS,
+                                time.time() - start_time,
+                                route.udf.__name__,
+                            )
+
+                    except Exception as e:
+                        # Log message
+                        if self.victoria_metrics_url:
+                            self.tp.submit(
+                                self._logMessage,
+                                key,
+                                "update",
+                                FlowOpStatus.FAILURE,
+                                time.time() - start_time,
+                                route.udf.__name__,
+                            )
 
-                    if self.disable_update_task:
                         raise RuntimeError(
-                            f"Update process is disabled. Cannot run update for {key}."
+                            "Error running update route in main process: " + str(e)
                         )
 
-                    func = self._update_routes[key][update_udf_name].udf
-
-                    queue_identifier: str = self._get_queue_identifier(
-                        key, update_udf_name
-                    )
-
-                    identifier = str(uuid4())
-
-                    # If the func has a discard_after attribute, expire_at
-                    # = current time + discard_after
-                    expire_at = (
-                        self._redis_con.time()[0] + func._discard_after  # type: ignore
-                        if func._discard_policy == DiscardPolicy.SECONDS  # type: ignore
-                        else None
-                    )  # type: ignore
-
-                    # Add to update queue
-                    self._redis_con.rpush(
-                        queue_identifier,
-                        cloudpickle.dumps(
-                            {
-                                "props": props,
-                                "identifier": identifier,
-                                "expire_at": expire_at,
-                            }
-                        ),
-                    )
-
-                    # If the func has a discard_after attribute, delete
-                    # old items in a queue
-                    if func._discard_after is not None:  # type: ignore
-                        if func._discard_policy == DiscardPolicy.NUM_NEW_UPDATES:  # type: ignore # noqa: E501
-                            # Get the length of the queue
-                            queue_length = self._redis_con.llen(queue_identifier)
-                            # If the queue length is greater than the
-                            # discard_after attribute, delete the oldest
-                            # (queue_length - discard_after) items
-                            if queue_length > func._discard_after:  # type: ignore
-                                self._redis_con.ltrim(
-                                    queue_identifier,
-                                    queue_length - func._discard_after,  # type: ignore
-                                    -1,
-                                )
-
-                        elif func._discard_policy == DiscardPolicy.SECONDS:  # type: ignore # noqa: E501
-                            # Need to delete items that are older than
-                            # discard_after seconds
-                            # Can just do this in the update task
-                            pass
-
         return route_hit
 
     async def _async_enqueue_and_trigger_update(
@@ -568,21 +1835,28 @@ class Executor:
         if key in self._update_routes.keys():
             route_hit = True
 
-            # update_events = UpdateEventGroup(key)
+            if not flush_update:
+                await self._aenqueue_updates(key, [props])
+                return route_hit
+
+            # If flushing update, just run the routes
             for update_udf_name in self._update_routes[key].keys():
-                # If flushing update, just run the route
-                if flush_update:
-                    route = self._update_routes[key][update_udf_name]
+                route = self._update_routes[key][update_udf_name]
 
-                    start_time = time.time()
+                # Hold lock
+                start_time = time.time()
 
-                    with self._redis_con.lock(self.__lock_prefix, timeout=120):
-                        try:
-                            self._loadState()
+                async with self._astateLock():
+                    try:
+                        # With optimistic concurrency, rerun the update op on
+                        # the latest state until it commits
+                        for attempt in range(MAX_COMMIT_ATTEMPTS):
+                            # Update ops may modify the state in place
+                            await self._aloadState(private=True)
 
                             state_update = route.run(
                                 state=self._state,
-                                props=props,
+                                props=get_update_props(route.udf, [props]),
                             )
 
                             if asyncio.iscoroutine(state_update):
@@ -590,134 +1864,241 @@ class Executor:
 
                             if not isinstance(state_update, dict):
                                 raise ValueError("State update must be a dict.")
-                            else:
-                                # Update state
-                                self._updateState(
-                                    state_update,
-                                    force_update=False,
-                                    use_lock=False,
-                                )
-
-                            # Log message
-                            if self.victoria_metrics_url:
-                                self.tp.submit(
-                                    self._logMessage,
-                                    key,
-                                    "update",
-                                    FlowOpStatus.SUCCESS,
-                                    time.time() - start_time,
-                                    route.udf.__name__,
-                                )
+                            check_writes(route.udf, state_update)
+
+                            # Update state
+                            if await asyncio.to_thread(
+                                self._updateState,
+                                state_update,
+                                force_update=False,
+                                use_lock=False,
+                            ):
+                                break
+                            await asyncio.sleep(conflictBackoff(attempt))
+                        else:
+                            raise RuntimeError(
+                                f"Could not commit state after {MAX_COMMIT_ATTEMPTS}"
+                                + " attempts."
+                            )
 
-                        except Exception as e:
-                            # Log message
-                            if self.victoria_metrics_url:
-                                self.tp.submit(
-                                    self._logMessage,
-                                    key,
-                                    "update",
-                                    FlowOpStatus.FAILURE,
-                                    time.time() - start_time,
-                                    route.udf.__name__,
-                                )
+                        # Log message
+                        if self.victoria_metrics_url:
+                            self.tp.submit(
+                                self._logMessage,
+                                key,
+                                "update",
+                                FlowOpStatus.SUCCESS,
+                                time.time() - start_time,
+                                route.udf.__name__,
+                            )
 
-                            raise RuntimeError(
-                                "Error running update route in main process: " + str(e)
+                    except Exception as e:
+                        # Log message
+                        if self.victoria_metrics_url:
+                            self.tp.submit(
+                                self._logMessage,
+                                key,
+                                "update",
+                                FlowOpStatus.FAILURE,
+                                time.time() - start_time,
+                                route.udf.__name__,
                             )
 
-                else:
-                    # Enqueue update
-                    if self.disable_update_task:
                         raise RuntimeError(
-                            f"Update process is disabled. Cannot run update for {key}."
+                            "Error running update route in main process: " + str(e)
                         )
 
-                    func = self._update_routes[key][update_udf_name].udf
-                    queue_identifier: str = self._get_queue_identifier(
-                        key, update_udf_name
-                    )
+        return route_hit
 
-                    identifier = str(uuid4())
+    def _lookupCachedResult(
+        self, cache_result_key: str
+    ) -> Tuple[Optional[bytes], Optional[int]]:
+        """Gets the cached result and the current state version in one
+        round trip."""
+        last_version_check = time.monotonic()
+        cached_result, redis_v = self._cached_serve_lookup(
+            keys=[cache_result_key, *self.__version_keys]
+        )
+        self._last_version_check = last_version_check
+
+        return cached_result, int(redis_v) if redis_v else None
+
+    async def _alookupCachedResult(
+        self, cache_result_key: str
+    ) -> Tuple[Optional[bytes], Optional[int]]:
+        """Async version of `_lookupCachedResult`."""
+        _, cached_serve_lookup = self._asyncRedis()
+        last_version_check = time.monotonic()
+        cached_result, redis_v = await cached_serve_lookup(
+            keys=[cache_result_key, *self.__version_keys]
+        )
+        self._last_version_check = last_version_check
+
+        return cached_result, int(redis_v) if redis_v else None
+
+    def _lookupCachedResults(
+        self, cache_result_keys: List[str]
+    ) -> Tuple[List[Optional[bytes]], Optional[int]]:
+        """Gets many cached results and the current state version in one
+        round trip."""
+        last_version_check = time.monotonic()
+        pipeline = self._redis_con.pipeline(transaction=False)
+        pipeline.mget(cache_result_keys)
+        for version_key in self.__version_keys:
+            pipeline.get(version_key)
+        cached_results, *versions = pipeline.execute()
+        self._last_version_check = last_version_check
+
+        redis_v = next((v for v in versions if v), None)
+        return cached_results, int(redis_v) if redis_v else None
+
+    async def _alookupCachedResults(
+        self, cache_result_keys: List[str]
+    ) -> Tuple[List[Optional[bytes]], Optional[int]]:
+        """Async version of `_lookupCachedResults`."""
+        aredis, _ = self._asyncRedis()
+        last_version_check = time.monotonic()
+        pipeline = aredis.pipeline(transaction=False)
+        pipeline.mget(cache_result_keys)
+        for version_key in self.__version_keys:
+            pipeline.get(version_key)
+        cached_results, *versions = await pipeline.execute()
+        self._last_version_check = last_version_check
+
+        redis_v = next((v for v in versions if v), None)
+        return cached_results, int(redis_v) if redis_v else None
 
-                    # If the func has a discard_after attribute, expire_at
-                    # = current time + discard_after
-                    expire_at = (
-                        self._redis_con.time()[0] + func._discard_after  # type: ignore
-                        if func._discard_policy == DiscardPolicy.SECONDS  # type: ignore
-                        else None
-                    )
+    def _try_cached_serve(
+        self,
+        key: str,
+        props: Properties,
+        ignore_cache: bool,
+        force_refresh: bool,
+    ) -> Tuple[bool, Optional[Any], Properties, Optional[str], Optional[int]]:
+        route_run = False
+        serve_result = None
+        redis_v = None
 
-                    # Add to update queue
-                    self._redis_con.rpush(
-                        queue_identifier,
-                        cloudpickle.dumps(
-                            {
-                                "props": props,
-                                "identifier": identifier,
-                                "expire_at": expire_at,
-                            }
-                        ),
-                    )
+        if force_refresh:
+            self.flush_update()
 
-                    # If the func has a discard_after attribute, delete
-                    # old items in a queue
-                    if func._discard_after is not None:  # type: ignore
-                        if func._discard_policy == DiscardPolicy.NUM_NEW_UPDATES:  # type: ignore # noqa: E501
-                            # Get the length of the queue
-                            queue_length = self._redis_con.llen(queue_identifier)
-                            # If the queue length is greater than the
-                            # discard_after attribute, delete the oldest
-                            # (queue_length - discard_after) items
-                            if queue_length > func._discard_after:  # type: ignore
-                                self._redis_con.ltrim(
-                                    queue_identifier,
-                                    queue_length - func._discard_after,  # type: ignore
-                                    -1,
-                                )
+        # If caching is disabled, return
+        if self._cache_ttl == 0:
+            return route_run, serve_result, props, None, redis_v
 
-                        elif func._discard_policy == DiscardPolicy.SECONDS:  # type: ignore # noqa: E501
-                            # Need to delete items that are older than
-                            # discard_after seconds
-                            # Can just do this in the update task
-                            pass
+        value_hash, cache_result_key = self._cachedServeKey(
+            key, props, ignore_cache, force_refresh
+        )
+        if cache_result_key is not None:
+            if self._checkResultCache(key, cache_result_key, props):
+                return True, props.serve_result, props, value_hash, redis_v
 
-        return route_hit
+            cached_result, redis_v = self._lookupCachedResult(cache_result_key)
+            if cached_result is not None and self._applyCachedResult(
+                cache_result_key, props, cached_result, key, redis_v
+            ):
+                serve_result = props.serve_result
+                route_run = True
 
-    def _try_cached_serve(
+        return route_run, serve_result, props, value_hash, redis_v
+
+    async def _atry_cached_serve(
         self,
         key: str,
         props: Properties,
         ignore_cache: bool,
         force_refresh: bool,
-    ) -> Tuple[bool, Optional[Any], Properties, Optional[str]]:
+    ) -> Tuple[bool, Optional[Any], Properties, Optional[str], Optional[int]]:
+        """Async version of `_try_cached_serve`."""
         route_run = False
         serve_result = None
+        redis_v = None
 
         if force_refresh:
-            self.flush_update()
+            await self.aflush_update()
 
         # If caching is disabled, return
         if self._cache_ttl == 0:
-            return route_run, serve_result, props, None
+            return route_run, serve_result, props, None, redis_v
 
+        value_hash, cache_result_key = self._cachedServeKey(
+            key, props, ignore_cache, force_refresh
+        )
+        if cache_result_key is not None:
+            if self._checkResultCache(key, cache_result_key, props):
+                return True, props.serve_result, props, value_hash, redis_v
+
+            cached_result, redis_v = await self._alookupCachedResult(cache_result_key)
+            if cached_result is not None and self._applyCachedResult(
+                cache_result_key, props, cached_result, key, redis_v
+            ):
+                serve_result = props.serve_result
+                route_run = True
+
+        return route_run, serve_result, props, value_hash, redis_v
+
+    def _cachedServeKey(
+        self, key: str, props: Properties, ignore_cache: bool, force_refresh: bool
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """Hashes the props.
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: The hash (None if the props
+            can't be hashed), and the key to look the cached result up by
+            (None if it shouldn't be looked up).
+        """
         # Try hashing the value
         try:
-            value_hash = hash_object(props)
+            value_hash = self._props_hasher(props)
         except TypeError:
             value_hash = None
 
         # Check if key is in cache if value can be hashed and
         # user doesn't want to force refresh state
         if value_hash and not force_refresh and not ignore_cache:
-            cache_result_key = f"{self.__cache_result_prefix}/{key}/{value_hash}"
-            if self._redis_con.exists(cache_result_key):
-                new_props = cloudpickle.loads(self._redis_con.get(cache_result_key))
-                if new_props._serve_result is not None:
-                    props = new_props
-                    serve_result = props.serve_result
-                    route_run = True
+            return value_hash, f"{self.__cache_result_prefix}/{key}/{value_hash}"
+        return value_hash, None
 
-        return route_run, serve_result, props, value_hash
+    def _checkResultCache(
+        self, key: str, cache_result_key: str, props: Properties
+    ) -> bool:
+        """Sets the serve result on the props if it's in the in-process
+        result cache. With stale-while-revalidate or a maximum version lag,
+        its state version is checked against the latest version the
+        instance has heard of, and it is only used if the instance listens
+        for new versions; otherwise the result is looked up in Redis along
+        with the current version.
+
+        Returns:
+            bool: Whether it was.
+        """
+        if self._result_cache is None:
+            return False
+
+        current_version = self.version
+        if self._stale_while_revalidate or self._max_version_lag is not None:
+            current_version = self._latestVersion()
+            if current_version is None:
+                return False
+
+        # Results too far behind are misses, so they aren't counted as hits
+        min_version = (
+            current_version - self._max_version_lag
+            if self._max_version_lag is not None and current_version is not None
+            else None
+        )
+        hit, result, result_version = self._result_cache.get_entry(
+            cache_result_key, self._resultCacheVersion(), min_version
+        )
+        if not hit or not self._checkStaleness(
+            key, cache_result_key, props, result_version, current_version
+        ):
+            return False
+
+        serve_result, props_update = result
+        props._serve_result = serve_result
+        props.update(props_update)
+        return True
 
     def run(
         self,
@@ -732,9 +2113,12 @@ class Executor:
             serve_result = None
             is_generated = False
             props = Properties(props)
+            input_props = dict(props)
 
             # Run the serve route
             start_time = time.time()
+            timings: Dict[str, float] = {}
+            route_run = False
             if key in self._serve_routes.keys():
                 route_hit = True
                 (
@@ -742,7 +2126,14 @@ class Executor:
                     serve_result,
                     props,
                     value_hash,
+                    redis_v,
                 ) = self._try_cached_serve(key, props, ignore_cache, force_refresh)
+                flight, leading, lease = None, True, None
+                if not route_run:
+                    flight, leading, lease = self._joinFlight(
+                        key, props, value_hash, ignore_cache, force_refresh
+                    )
+                timings["cache_lookup"] = time.time() - start_time
 
                 # If route is run and serve result is not None and self.
                 # _serve_routes[key].udf is a generator, iterate through the serve
@@ -757,48 +2148,102 @@ class Executor:
                         for item in serve_result:
                             yield item
 
+                # If another call with the same props ran the serve op,
+                # use its result, streaming it if the serve op is a generator
+                if flight is not None and not leading:
+                    num_streamed = 0
+                    try:
+                        if inspect.isgeneratorfunction(self._serve_routes[key].udf):
+                            is_generated = True
+                            for item in flight.stream():
+                                num_streamed += 1
+                                yield item
+
+                        serve_result, props_update = flight.result()
+                        props._serve_result = serve_result
+                        props.update(props_update)
+                        route_run = True
+                    except FlightAbandoned:
+                        # The call running the serve op was cancelled, so run
+                        # it here unless items were already streamed
+                        if num_streamed:
+                            raise
+                    finally:
+                        flight.leave()
+                    if not route_run:
+                        flight, lease = None, None
+
                 # If not in cache or value can't be hashed or
                 # user wants to force refresh state, run route
                 if not route_run:
-                    self._loadState()
-                    serve_result = self._serve_routes[key].run(
-                        state=self._state, props=props
-                    )
-
-                    # Check if the serve_result is a generator (streaming result)
-                    if isinstance(serve_result, types.GeneratorType):
-                        # Accumulate items from generator
-                        is_generated = True
-                        accumulated_result = []
-
-                        # Process each item yielded by the generator
-                        for item in serve_result:
-                            accumulated_result.append(item)
-                            yield item  # Yield the item for streaming
+                    try:
+                        phase_start = time.time()
+                        self._loadState(trust_cache=True, redis_v=redis_v)
+                        timings["load_state"] = time.time() - phase_start
+
+                        phase_start = time.time()
+                        serve_result = self._runServeRoute(key, props)
+
+                        # Check if the serve_result is a generator (streaming result)
+                        if isinstance(serve_result, types.GeneratorType):
+                            # Accumulate items from generator
+                            is_generated = True
+                            accumulated_result: List[Any] = []
+
+                            # Process each item yielded by the generator
+                            try:
+                                for item in serve_result:
+                                    accumulated_result.append(item)
+                                    if flight is not None:
+                                        flight.publish(item)
+                                    yield item  # Yield the item for streaming
+                            except GeneratorExit:
+                                # The caller stopped iterating
+                                self._abandonFlight(
+                                    flight,
+                                    lease,
+                                    serve_result,
+                                    accumulated_result,
+                                    props,
+                                    input_props,
+                                )
+                                raise
 
-                        serve_result = accumulated_result
+                            serve_result = accumulated_result
 
-                    props._serve_result = serve_result
+                        props._serve_result = serve_result
+                        timings["serve"] = time.time() - phase_start
 
-                    # Check that serve_result is not an awaitable
-                    if asyncio.iscoroutine(serve_result):
-                        raise TypeError(
-                            f"Route {key} returned an awaitable. "
-                            + "Call `await instance.arun(...)` instead."
-                        )
+                        # Check that serve_result is not an awaitable
+                        if asyncio.iscoroutine(serve_result):
+                            raise TypeError(
+                                f"Route {key} returned an awaitable. "
+                                + "Call `await instance.arun(...)` instead."
+                            )
 
-                    # Cache result
-                    if value_hash:
-                        cache_result_key = (
-                            f"{self.__cache_result_prefix}/{key}/{value_hash}"
-                        )
-                        self.tp.submit(self._setRedis, cache_result_key, props)
+                        # Cache result
+                        if value_hash:
+                            cache_result_key = (
+                                f"{self.__cache_result_prefix}/{key}/{value_hash}"
+                            )
+                            self._cacheResult(
+                                cache_result_key, props, input_props, flight, lease
+                            )
+                    except GeneratorExit:
+                        # The flight was handed off when the caller stopped
+                        raise
+                    except BaseException as e:
+                        if flight is not None:
+                            self._failFlight(flight, lease, e)
+                        raise
 
             # Run the update routes
             # Enqueue results into update queues
+            phase_start = time.time()
             route_hit = self._enqueue_and_trigger_update(
                 key, props, flush_update, route_hit
             )
+            timings["enqueue_update"] = time.time() - phase_start
 
             if not route_hit:
                 raise KeyError(
@@ -806,6 +2251,7 @@ class Executor:
                 )
 
             duration = time.time() - start_time
+            self.serve_timings = timings
 
             if not is_generated:
                 yield serve_result
@@ -814,6 +2260,7 @@ class Executor:
                 self.tp.submit(
                     self._logMessage, key, "serve", FlowOpStatus.SUCCESS, duration
                 )
+                self.tp.submit(self._logPhaseTimings, key, timings, route_run)
 
         except Exception as e:
             duration = time.time() - start_time
@@ -837,10 +2284,13 @@ class Executor:
             route_hit = False
             serve_result = None
             props = Properties(props)
+            input_props = dict(props)
 
             # Run the serve route
             is_generated = False
             start_time = time.time()
+            timings: Dict[str, float] = {}
+            route_run = False
             if key in self._serve_routes.keys():
                 route_hit = True
                 (
@@ -848,7 +2298,16 @@ class Executor:
                     serve_result,
                     props,
                     value_hash,
-                ) = self._try_cached_serve(key, props, ignore_cache, force_refresh)
+                    redis_v,
+                ) = await self._atry_cached_serve(
+                    key, props, ignore_cache, force_refresh
+                )
+                flight, leading, lease = None, True, None
+                if not route_run:
+                    flight, leading, lease = await self._ajoinFlight(
+                        key, props, value_hash, ignore_cache, force_refresh
+                    )
+                timings["cache_lookup"] = time.time() - start_time
 
                 # If route is run and serve result is not None and self.
                 # _serve_routes[key].udf is a generator, iterate through the serve
@@ -863,45 +2322,103 @@ class Executor:
                         for item in serve_result:
                             yield item
 
+                # If another call with the same props ran the serve op,
+                # use its result, streaming it if the serve op is a generator
+                if flight is not None and not leading:
+                    num_streamed = 0
+                    try:
+                        if inspect.isasyncgenfunction(self._serve_routes[key].udf):
+                            is_generated = True
+                            async for item in flight.astream():
+                                num_streamed += 1
+                                yield item
+
+                        serve_result, props_update = await flight.aresult()
+                        props._serve_result = serve_result
+                        props.update(props_update)
+                        route_run = True
+                    except FlightAbandoned:
+                        # The call running the serve op was cancelled, so run
+                        # it here unless items were already streamed
+                        if num_streamed:
+                            raise
+                    finally:
+                        flight.leave()
+                    if not route_run:
+                        flight, lease = None, None
+
                 # If not in cache or value can't be hashed or
                 # user wants to force refresh state, run route
                 if not route_run:
-                    self._loadState()
-                    serve_result = self._serve_routes[key].run(
-                        state=self._state, props=props
-                    )
-                    # Check if the serve_result is an async generator (streaming result)
-                    if isinstance(serve_result, types.AsyncGeneratorType):
-                        # Accumulate items from generator
-                        is_generated = True
-                        accumulated_result = []
-
-                        # Process each item yielded by the generator
-                        # but don't trigger a "return statement with value is
-                        # not allowed in an async generator" error
-                        async for item in serve_result:
-                            accumulated_result.append(item)
-                            yield item
+                    try:
+                        phase_start = time.time()
+                        await self._aloadState(trust_cache=True, redis_v=redis_v)
+                        timings["load_state"] = time.time() - phase_start
+
+                        phase_start = time.time()
+                        serve_result = self._runServeRoute(key, props)
+                        # Check if the serve_result is an async generator (streaming)
+                        if isinstance(serve_result, types.AsyncGeneratorType):
+                            # Accumulate items from generator
+                            is_generated = True
+                            accumulated_result: List[Any] = []
+
+                            # Process each item yielded by the generator
+                            # but don't trigger a "return statement with value is
+                            # not allowed in an async generator" error
+                            try:
+                                async for item in serve_result:
+                                    accumulated_result.append(item)
+                                    if flight is not None:
+                                        flight.publish(item)
+                                    yield item
+                            except GeneratorExit:
+                                # The caller stopped iterating
+                                self._aabandonFlight(
+                                    flight,
+                                    lease,
+                                    serve_result,
+                                    accumulated_result,
+                                    props,
+                                    input_props,
+                                )
+                                raise
 
-                        serve_result = accumulated_result
+                            serve_result = accumulated_result
 
-                    elif asyncio.iscoroutine(serve_result):
-                        serve_result = await serve_result
+                        elif asyncio.iscoroutine(serve_result):
+                            serve_result = await serve_result
+                            if is_vectorized(self._serve_routes[key].udf):
+                                serve_result = self._checkVectorizedResults(
+                                    key, serve_result, 1
+                                )[0]
 
-                    props._serve_result = serve_result
+                        props._serve_result = serve_result
+                        timings["serve"] = time.time() - phase_start
 
-                    # Cache result
-                    if value_hash:
-                        cache_result_key = (
-                            f"{self.__cache_result_prefix}/{key}/{value_hash}"
-                        )
-                        self.tp.submit(self._setRedis, cache_result_key, props)
+                        # Cache result
+                        if value_hash:
+                            cache_result_key = (
+                                f"{self.__cache_result_prefix}/{key}/{value_hash}"
+                            )
+                            self._cacheResult(
+                                cache_result_key, props, input_props, flight, lease
+                            )
+                    except GeneratorExit:
+                        # The flight was handed off when the caller stopped
+                        raise
+                    except BaseException as e:
+                        if flight is not None:
+                            self._failFlight(flight, lease, e)
+                        raise
 
             # Run the update routes
             # Enqueue results into update queues
+            phase_start = time.time()
             route_hit = await self._async_enqueue_and_trigger_update(
                 key, props, flush_update, route_hit
             )
+            timings["enqueue_update"] = time.time() - phase_start
 
             if not route_hit:
                 raise KeyError(
@@ -909,6 +2426,7 @@ class Executor:
                 )
 
             duration = time.time() - start_time
+            self.serve_timings = timings
 
             if not is_generated:
                 yield serve_result
@@ -917,6 +2435,7 @@ class Executor:
                 self.tp.submit(
                     self._logMessage, key, "serve", FlowOpStatus.SUCCESS, duration
                 )
+                self.tp.submit(self._logPhaseTimings, key, timings, route_run)
 
         except Exception as e:
             duration = time.time() - start_time
@@ -927,19 +2446,543 @@ class Executor:
 
             raise e
 
-    def flush_update(self, flow_key: str = "*ALL*") -> None:
-        flow_keys: List[str] = []
+    def _checkVectorizedResults(
+        self, key: str, results: Any, num_props: int
+    ) -> List[Any]:
+        """Checks that a vectorized serve op returned one result per props."""
+        if not isinstance(results, (list, tuple)) or len(results) != num_props:
+            raise ValueError(
+                f"Vectorized serve op for {key} must return a list with one "
+                + f"result per props. Expected {num_props} results but got "
+                + f"{results!r}."
+            )
+        return list(results)
+
+    def _runServeRoute(
+        self, key: str, props: Properties, state: Optional[State] = None
+    ) -> Any:
+        """Runs the serve op for a single props, on the instance's state
+        unless another is passed. Vectorized serve ops are passed a list of
+        one props, and their result is unwrapped unless it is an awaitable,
+        which the caller awaits and unwraps."""
+        route = self._serve_routes[key]
+        if state is None:
+            state = self._state
+        if not is_vectorized(route.udf):
+            return route.run(state=state, props=props)
+
+        results = route.run(state=state, props=[props])
+        if asyncio.iscoroutine(results):
+            return results
+        return self._checkVectorizedResults(key, results, 1)[0]
+
+    def _checkResultCacheMany(
+        self,
+        key: str,
+        props_list: List[Properties],
+        ignore_cache: bool,
+        force_refresh: bool,
+    ) -> Tuple[List[Any], List[Optional[str]], Set[int], Dict[int, str]]:
+        """Hashes the props and sets the results found in the in-process
+        result cache on them.
+
+        Returns:
+            Tuple[List[Any], List[Optional[str]], Set[int], Dict[int, str]]:
+            Serve results (None for misses), value hashes, indices of the
+            props that hit the cache, and the keys to look the other cached
+            results up by in Redis, by index.
+        """
+        serve_results: List[Any] = [None] * len(props_list)
+        value_hashes: List[Optional[str]] = [None] * len(props_list)
+
+        # Try hashing the values
+        for i, props in enumerate(props_list):
+            try:
+                value_hashes[i] = self._props_hasher(props)
+            except TypeError:
+                value_hashes[i] = None
+
+        hits: Set[int] = set()
+        cache_result_keys: Dict[int, str] = {}
+        if force_refresh or ignore_cache:
+            return serve_results, value_hashes, hits, cache_result_keys
+
+        for i, value_hash in enumerate(value_hashes):
+            if not value_hash:
+                continue
+            cache_result_key = f"{self.__cache_result_prefix}/{key}/{value_hash}"
+            if self._result_cache is not None and self._checkResultCache(
+                key, cache_result_key, props_list[i]
+            ):
+                serve_results[i] = props_list[i].serve_result
+                hits.add(i)
+            else:
+                cache_result_keys[i] = cache_result_key
+
+        return serve_results, value_hashes, hits, cache_result_keys
+
+    def _applyCachedResults(
+        self,
+        key: str,
+        props_list: List[Properties],
+        serve_results: List[Any],
+        hits: Set[int],
+        cache_result_keys: Dict[int, str],
+        cached_results: List[Optional[bytes]],
+        redis_v: Optional[int],
+    ) -> List[int]:
+        """Sets the usable cached results found in Redis on the props.
+
+        Returns:
+            List[int]: Indices of the props that missed the cache.
+        """
+        for (i, cache_result_key), cached_result in zip(
+            cache_result_keys.items(), cached_results
+        ):
+            if cached_result is not None and self._applyCachedResult(
+                cache_result_key, props_list[i], cached_result, key, redis_v
+            ):
+                serve_results[i] = props_list[i].serve_result
+                hits.add(i)
+
+        return [i for i in range(len(props_list)) if i not in hits]
+
+    def _try_cached_serve_many(
+        self,
+        key: str,
+        props_list: List[Properties],
+        ignore_cache: bool,
+        force_refresh: bool,
+    ) -> Tuple[List[Any], List[int], List[Optional[str]], Optional[int]]:
+        """Batched version of `_try_cached_serve`. Looks up the cached
+        results for all props in one round trip, setting the results on the
+        props that hit the cache in `props_list`.
+
+        Returns:
+            Tuple[List[Any], List[int], List[Optional[str]], Optional[int]]:
+            Serve results (None for misses), indices of the props that missed
+            the cache, value hashes, and the state version if it was looked up.
+        """
+        if force_refresh:
+            self.flush_update()
 
+        # If caching is disabled, everything is a miss
+        if self._cache_ttl == 0:
+            return (
+                [None] * len(props_list),
+                list(range(len(props_list))),
+                [None] * len(props_list),
+                None,
+            )
+
+        (
+            serve_results,
+            value_hashes,
+            hits,
+            cache_result_keys,
+        ) = self._checkResultCacheMany(key, props_list, ignore_cache, force_refresh)
+
+        cached_results: List[Optional[bytes]] = []
+        redis_v = None
+        if cache_result_keys:
+            cached_results, redis_v = self._lookupCachedResults(
+                list(cache_result_keys.values())
+            )
+
+        miss_indices = self._applyCachedResults(
+            key,
+            props_list,
+            serve_results,
+            hits,
+            cache_result_keys,
+            cached_results,
+            redis_v,
+        )
+        return serve_results, miss_indices, value_hashes, redis_v
+
+    async def _atry_cached_serve_many(
+        self,
+        key: str,
+        props_list: List[Properties],
+        ignore_cache: bool,
+        force_refresh: bool,
+    ) -> Tuple[List[Any], List[int], List[Optional[str]], Optional[int]]:
+        """Async version of `_try_cached_serve_many`."""
+        if force_refresh:
+            await self.aflush_update()
+
+        # If caching is disabled, everything is a miss
+        if self._cache_ttl == 0:
+            return (
+                [None] * len(props_list),
+                list(range(len(props_list))),
+                [None] * len(props_list),
+                None,
+            )
+
+        (
+            serve_results,
+            value_hashes,
+            hits,
+            cache_result_keys,
+        ) = self._checkResultCacheMany(key, props_list, ignore_cache, force_refresh)
+
+        cached_results: List[Optional[bytes]] = []
+        redis_v = None
+        if cache_result_keys:
+            cached_results, redis_v = await self._alookupCachedResults(
+                list(cache_result_keys.values())
+            )
+
+        miss_indices = self._applyCachedResults(
+            key,
+            props_list,
+            serve_results,
+            hits,
+            cache_result_keys,
+            cached_results,
+            redis_v,
+        )
+        return serve_results, miss_indices, value_hashes, redis_v
+
+    def _propsForMany(
+        self, key: str, props_list: List[Dict[str, Any]]
+    ) -> List[Properties]:
+        """Validates the flow and serve op of `run_many` and `arun_many`."""
+        if key not in self._serve_routes and key not in self._update_routes:
+            raise KeyError(
+                f"Key {key} not in routes for component {self._instance_name}."
+            )
+
+        if key in self._serve_routes:
+            udf = self._serve_routes[key].udf
+            if inspect.isgeneratorfunction(udf) or inspect.isasyncgenfunction(udf):
+                raise TypeError(
+                    f"Serve op for {key} is a generator, which run_many does "
+                    + "not support. Call `gen` or `agen` for each props instead."
+                )
+
+        return [Properties(props) for props in props_list]
+
+    def _start_many(
+        self,
+        key: str,
+        props_list: List[Dict[str, Any]],
+        ignore_cache: bool,
+        force_refresh: bool,
+        timings: Dict[str, float],
+    ) -> Tuple[List[Properties], List[Any], List[int], List[Optional[str]]]:
+        """Shared setup for `run_many`: validates the flow and serve op,
+        looks up cached results, and loads the state for the misses."""
+        all_props = self._propsForMany(key, props_list)
+        if key not in self._serve_routes:
+            return all_props, [None] * len(all_props), [], []
+
+        phase_start = time.time()
+        (
+            serve_results,
+            miss_indices,
+            value_hashes,
+            redis_v,
+        ) = self._try_cached_serve_many(key, all_props, ignore_cache, force_refresh)
+        timings["cache_lookup"] = time.time() - phase_start
+
+        # Load the state once for all the misses
+        if miss_indices:
+            phase_start = time.time()
+            self._loadState(trust_cache=True, redis_v=redis_v)
+            timings["load_state"] = time.time() - phase_start
+
+        return all_props, serve_results, miss_indices, value_hashes
+
+    async def _astart_many(
+        self,
+        key: str,
+        props_list: List[Dict[str, Any]],
+        ignore_cache: bool,
+        force_refresh: bool,
+        timings: Dict[str, float],
+    ) -> Tuple[List[Properties], List[Any], List[int], List[Optional[str]]]:
+        """Async version of `_start_many`."""
+        all_props = self._propsForMany(key, props_list)
+        if key not in self._serve_routes:
+            return all_props, [None] * len(all_props), [], []
+
+        phase_start = time.time()
+        (
+            serve_results,
+            miss_indices,
+            value_hashes,
+            redis_v,
+        ) = await self._atry_cached_serve_many(
+            key, all_props, ignore_cache, force_refresh
+        )
+        timings["cache_lookup"] = time.time() - phase_start
+
+        # Load the state once for all the misses
+        if miss_indices:
+            phase_start = time.time()
+            await self._aloadState(trust_cache=True, redis_v=redis_v)
+            timings["load_state"] = time.time() - phase_start
+
+        return all_props, serve_results, miss_indices, value_hashes
+
+    def _cache_many(
+        self,
+        key: str,
+        props_list: List[Properties],
+        serve_results: List[Any],
+        miss_indices: List[int],
+        miss_inputs: List[Dict[str, Any]],
+        miss_results: List[Any],
+        value_hashes: List[Optional[str]],
+    ) -> None:
+        """Records the serve results for the misses and caches them in one
+        round trip."""
+        cache_results: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+        for i, input_props, serve_result in zip(
+            miss_indices, miss_inputs, miss_results
+        ):
+            props_list[i]._serve_result = serve_result
+            serve_results[i] = serve_result
+            if value_hashes[i]:
+                cache_result_key = (
+                    f"{self.__cache_result_prefix}/{key}/{value_hashes[i]}"
+                )
+                cache_results[cache_result_key] = (
+                    serve_result,
+                    self._propsUpdate(props_list[i], input_props),
+                )
+                if self._result_cache is not None:
+                    self._result_cache.put(
+                        cache_result_key,
+                        cache_results[cache_result_key],
+                        self._cache_ttl,
+                        self.version,
+                    )
+
+        if cache_results:
+            self.tp.submit(self._setRedisMany, cache_results, self.version)
+
+    def _finish_many(
+        self,
+        key: str,
+        start_time: float,
+        timings: Dict[str, float],
+        cache_hit: bool,
+    ) -> None:
+        """Records the phase timings of a batched serve op and logs them."""
+        self.serve_timings = timings
+        if self.victoria_metrics_url:
+            self.tp.submit(
+                self._logMessage,
+                key,
+                "serve",
+                FlowOpStatus.SUCCESS,
+                time.time() - start_time,
+            )
+            self.tp.submit(self._logPhaseTimings, key, timings, cache_hit)
+
+    def run_many(
+        self,
+        key: str,
+        props_list: List[Dict[str, Any]],
+        ignore_cache: bool,
+        force_refresh: bool,
+        flush_update: bool,
+    ) -> List[Any]:
+        start_time = time.time()
+        timings: Dict[str, float] = {}
+        try:
+            (
+                all_props,
+                serve_results,
+                miss_indices,
+                value_hashes,
+            ) = self._start_many(key, props_list, ignore_cache, force_refresh, timings)
+
+            # Run the serve op for the misses only
+            if miss_indices and key in self._serve_routes:
+                phase_start = time.time()
+                route = self._serve_routes[key]
+                miss_props = [all_props[i] for i in miss_indices]
+                miss_inputs = [dict(props) for props in miss_props]
+                if is_vectorized(route.udf):
+                    results = route.run(state=self._state, props=miss_props)
+                    if asyncio.iscoroutine(results):
+                        results.close()
+                        raise TypeError(
+                            f"Route {key} returned an awaitable. "
+                            + "Call `await instance.arun_many(...)` instead."
+                        )
+                    miss_results = self._checkVectorizedResults(
+                        key, results, len(miss_props)
+                    )
+                else:
+                    miss_results = []
+                    for props in miss_props:
+                        serve_result = route.run(state=self._state, props=props)
+                        if asyncio.iscoroutine(serve_result):
+                            serve_result.close()
+                            raise TypeError(
+                                f"Route {key} returned an awaitable. "
+                                + "Call `await instance.arun_many(...)` instead."
+                            )
+                        miss_results.append(serve_result)
+                timings["serve"] = time.time() - phase_start
+
+                self._cache_many(
+                    key,
+                    all_props,
+                    serve_results,
+                    miss_indices,
+                    miss_inputs,
+                    miss_results,
+                    value_hashes,
+                )
+
+            # Enqueue all the props into the update queues at once
+            if key in self._update_routes:
+                phase_start = time.time()
+                if flush_update:
+                    for props in all_props:
+                        self._enqueue_and_trigger_update(key, props, True, True)
+                else:
+                    self._enqueue_updates(key, all_props)
+                timings["enqueue_update"] = time.time() - phase_start
+
+            self._finish_many(key, start_time, timings, not miss_indices)
+            return serve_results
+
+        except Exception as e:
+            if self.victoria_metrics_url and key in self._serve_routes.keys():
+                self.tp.submit(
+                    self._logMessage,
+                    key,
+                    "serve",
+                    FlowOpStatus.FAILURE,
+                    time.time() - start_time,
+                )
+
+            raise e
+
+    async def arun_many(
+        self,
+        key: str,
+        props_list: List[Dict[str, Any]],
+        ignore_cache: bool,
+        force_refresh: bool,
+        flush_update: bool,
+    ) -> List[Any]:
+        start_time = time.time()
+        timings: Dict[str, float] = {}
+        try:
+            (
+                all_props,
+                serve_results,
+                miss_indices,
+                value_hashes,
+            ) = await self._astart_many(
+                key, props_list, ignore_cache, force_refresh, timings
+            )
+
+            # Run the serve op for the misses only, awaiting async serve ops
+            # concurrently
+            if miss_indices and key in self._serve_routes:
+                phase_start = time.time()
+                route = self._serve_routes[key]
+                miss_props = [all_props[i] for i in miss_indices]
+                miss_inputs = [dict(props) for props in miss_props]
+                if is_vectorized(route.udf):
+                    results = route.run(state=self._state, props=miss_props)
+                    if asyncio.iscoroutine(results):
+                        results = await results
+                    miss_results = self._checkVectorizedResults(
+                        key, results, len(miss_props)
+                    )
+                else:
+                    miss_results = [
+                        route.run(state=self._state, props=props)
+                        for props in miss_props
+                    ]
+                    awaitables = [
+                        (j, result)
+                        for j, result in enumerate(miss_results)
+                        if asyncio.iscoroutine(result)
+                    ]
+                    if awaitables:
+                        awaited = await asyncio.gather(*[a for _, a in awaitables])
+                        for (j, _), result in zip(awaitables, awaited):
+                            miss_results[j] = result
+                timings["serve"] = time.time() - phase_start
+
+                self._cache_many(
+                    key,
+                    all_props,
+                    serve_results,
+                    miss_indices,
+                    miss_inputs,
+                    miss_results,
+                    value_hashes,
+                )
+
+            # Enqueue all the props into the update queues at once
+            if key in self._update_routes:
+                phase_start = time.time()
+                if flush_update:
+                    for props in all_props:
+                        await self._async_enqueue_and_trigger_update(
+                            key, props, True, True
+                        )
+                else:
+                    await self._aenqueue_updates(key, all_props)
+                timings["enqueue_update"] = time.time() - phase_start
+
+            self._finish_many(key, start_time, timings, not miss_indices)
+            return serve_results
+
+        except Exception as e:
+            if self.victoria_metrics_url and key in self._serve_routes.keys():
+                self.tp.submit(
+                    self._logMessage,
+                    key,
+                    "serve",
+                    FlowOpStatus.FAILURE,
+                    time.time() - start_time,
+                )
+
+            raise e
+
+    def _flushFlowKeys(self, flow_key: str) -> List[str]:
         # If flow_key is *ALL*, flush all update queues
         if flow_key == "*ALL*":
-            flow_keys = list(self._update_routes.keys())
+            return list(self._update_routes.keys())
 
         # Check if key has update ops
-        elif flow_key not in self._update_routes.keys():
+        if flow_key not in self._update_routes.keys():
+            return []
+
+        return [flow_key]
+
+    def _noopItem(self, identifier: str) -> bytes:
+        """Queue item that update tasks acknowledge once the items queued
+        before it are processed."""
+        return cloudpickle.dumps(  # type: ignore
+            {
+                "value": None,
+                "serve_result": None,
+                "identifier": identifier,
+            }
+        )
+
+    def flush_update(
+        self, flow_key: str = "*ALL*", timeout: Optional[float] = None
+    ) -> None:
+        flow_keys = self._flushFlowKeys(flow_key)
+        if not flow_keys:
             return
 
-        else:
-            flow_keys = [flow_key]
+        deadline = time.monotonic() + timeout if timeout is not None else None
 
         # Push a noop into the relevant queues
         for flow_key in flow_keys:
@@ -961,19 +3004,64 @@ class Executor:
                 update_events.add(update_udf_name, update_event)
 
                 # Add to update queue
-                self._redis_con.rpush(
-                    queue_identifier,
-                    cloudpickle.dumps(
-                        {
-                            "value": None,
-                            "serve_result": None,
-                            "identifier": identifier,
-                        }
-                    ),
-                )
+                noop = self._noopItem(identifier)
+                pipeline = self._redis_con.pipeline(transaction=True)
+                if self._queue_backend == "stream":
+                    pipeline.xadd(queue_identifier, {"item": noop, "noop": "1"})
+                else:
+                    pipeline.rpush(queue_identifier, noop)
+                self._announceUpdates(pipeline)
+                pipeline.execute()
 
             # Wait for update result to finish
-            update_events.wait()
+            update_events.wait(
+                max(deadline - time.monotonic(), 0) if deadline is not None else None
+            )
 
         # Update state
         self._loadState()
+
+    async def aflush_update(
+        self, flow_key: str = "*ALL*", timeout: Optional[float] = None
+    ) -> None:
+        """Async version of `flush_update`, which waits for the update ops
+        without blocking the event loop."""
+        flow_keys = self._flushFlowKeys(flow_key)
+        if not flow_keys:
+            return
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        aredis, _ = self._asyncRedis()
+        for flow_key in flow_keys:
+            update_events: List[AsyncUpdateEvent] = []
+            for update_udf_name in self._update_routes[flow_key].keys():
+                queue_identifier = self._get_queue_identifier(flow_key, update_udf_name)
+                channel_identifier = self._get_channel_identifier(
+                    flow_key, update_udf_name
+                )
+
+                identifier = "NOOP_" + str(uuid4())
+
+                # Subscribe before pushing the noop so the ack isn't missed
+                update_event = AsyncUpdateEvent(aredis, channel_identifier, identifier)
+                await update_event.subscribe()
+                update_events.append(update_event)
+
+                noop = self._noopItem(identifier)
+                pipeline = aredis.pipeline(transaction=True)
+                if self._queue_backend == "stream":
+                    pipeline.xadd(queue_identifier, {"item": noop, "noop": "1"})
+                else:
+                    pipeline.rpush(queue_identifier, noop)
+                self._announceUpdates(pipeline)
+                await pipeline.execute()
+
+            for update_event in update_events:
+                await update_event.wait(
+                    max(deadline - time.monotonic(), 0)
+                    if deadline is not None
+                    else None
+                )
+
+        await self._aloadState()
@@ -0,0 +1,203 @@
+"""
+This file contains the canonical hasher used to key cached serve results
+on props.
+"""
+
+import hashlib
+import struct
+import sys
+from typing import Any, Callable
+
+import cloudpickle
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+PropsHasher = Callable[[Any], str]
+
+
+class _BufferedHasher:
+    """Collects small updates into one buffer so that hashing many small
+    values doesn't pay for a digest update call per value."""
+
+    def __init__(self) -> None:
+        # xxh3 is much faster than any cryptographic digest. blake2b is
+        # the fastest digest in the standard library, so fall back to it
+        self.hasher: Any = (
+            xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+        )
+        self.buffer = bytearray()
+
+    def update(self, data: Any) -> None:
+        size = data.nbytes if isinstance(data, memoryview) else len(data)
+        if size < 4096:
+            self.buffer += data
+        else:
+            self._flush()
+            self.hasher.update(data)
+
+    def _flush(self) -> None:
+        if self.buffer:
+            self.hasher.update(self.buffer)
+            self.buffer.clear()
+
+    def digest(self) -> bytes:
+        self._flush()
+        return self.hasher.digest()  # type: ignore
+
+    def hexdigest(self) -> str:
+        self._flush()
+        return self.hasher.hexdigest()  # type: ignore
+
+
+def _sub_digest(obj: Any) -> bytes:
+    hasher = _BufferedHasher()
+    _update(hasher, obj)
+    return hasher.digest()
+
+
+def _update_sized(hasher: _BufferedHasher, tag: bytes, data: bytes) -> None:
+    # Prefix variable-length data with its length so that adjacent
+    # values can't run into each other
+    hasher.update(tag + struct.pack("<Q", len(data)))
+    hasher.update(data)
+
+
+def _update_numpy(hasher: _BufferedHasher, obj: Any) -> None:
+    import numpy as np
+
+    if isinstance(obj, np.ndarray):
+        hasher.update(b"n" + obj.dtype.str.encode() + repr(obj.shape).encode())
+        if obj.dtype.hasobject:
+            # Object arrays hold pointers, so hash the elements instead
+            _update(hasher, obj.tolist())
+        else:
+            # Hash the raw buffer, never the (truncated) repr
+            hasher.update(np.ascontiguousarray(obj).data)
+    else:
+        # Numpy scalar
+        hasher.update(b"g" + obj.dtype.str.encode())
+        hasher.update(obj.tobytes())
+
+
+def _update_pandas(hasher: _BufferedHasher, obj: Any) -> bool:
+    import pandas as pd
+
+    if isinstance(obj, pd.DataFrame):
+        hasher.update(b"P")
+        _update(hasher, [str(c) for c in obj.columns])
+        _update(hasher, [str(d) for d in obj.dtypes])
+    elif isinstance(obj, pd.Series):
+        hasher.update(b"S")
+        _update(hasher, str(obj.name))
+        _update(hasher, str(obj.dtype))
+    else:
+        return False
+
+    hasher.update(pd.util.hash_pandas_object(obj, index=True).values.data)
+    return True
+
+
+def _update_arrow(hasher: _BufferedHasher, obj: Any) -> bool:
+    import pyarrow as pa
+
+    if isinstance(obj, (pa.Array, pa.ChunkedArray)):
+        obj = pa.table({"_": obj})
+    elif isinstance(obj, pa.RecordBatch):
+        obj = pa.Table.from_batches([obj])
+    elif not isinstance(obj, pa.Table):
+        return False
+
+    # The IPC stream carries the schema and only the sliced part of each
+    # buffer, so the digest respects types, shapes, and offsets
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, obj.schema) as writer:
+        writer.write_table(obj)
+    hasher.update(b"A")
+    hasher.update(memoryview(sink.getvalue()))
+    return True
+
+
+def _update(hasher: _BufferedHasher, obj: Any) -> None:
+    # Each type gets its own tag so that, e.g., 1, 1.0, True, and "1"
+    # don't collide
+    if obj is None:
+        hasher.update(b"N")
+    elif isinstance(obj, bool):
+        hasher.update(b"T" if obj else b"F")
+    elif isinstance(obj, int):
+        _update_sized(hasher, b"i", str(obj).encode())
+    elif isinstance(obj, float):
+        _update_sized(hasher, b"f", repr(obj).encode())
+    elif isinstance(obj, str):
+        _update_sized(hasher, b"s", obj.encode("utf-8", "surrogatepass"))
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        _update_sized(hasher, b"b", bytes(obj))
+    elif isinstance(obj, dict):
+        # Hash entries in sorted key order so the hash doesn't depend on
+        # insertion order
+        if all(isinstance(k, str) for k in obj):
+            hasher.update(b"D" + struct.pack("<Q", len(obj)))
+            for k in sorted(obj):
+                _update_sized(hasher, b"s", k.encode("utf-8", "surrogatepass"))
+                _update(hasher, obj[k])
+        else:
+            # Keys of different types can't be compared, so sort the
+            # entries by the digest of their key instead
+            entries = sorted((_sub_digest(k), _sub_digest(v)) for k, v in obj.items())
+            hasher.update(b"d" + struct.pack("<Q", len(entries)))
+            for key_digest, value_digest in entries:
+                hasher.update(key_digest + value_digest)
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(
+            (b"l" if isinstance(obj, list) else b"t") + struct.pack("<Q", len(obj))
+        )
+        for item in obj:
+            _update(hasher, item)
+    elif isinstance(obj, (set, frozenset)):
+        digests = sorted(_sub_digest(item) for item in obj)
+        hasher.update(b"e" + struct.pack("<Q", len(digests)))
+        for digest in digests:
+            hasher.update(digest)
+    elif "numpy" in sys.modules and isinstance(
+        obj, (sys.modules["numpy"].ndarray, sys.modules["numpy"].generic)
+    ):
+        _update_numpy(hasher, obj)
+    elif "pandas" in sys.modules and _update_pandas(hasher, obj):
+        pass
+    elif "pyarrow" in sys.modules and _update_arrow(hasher, obj):
+        pass
+    else:
+        # Pickling captures the full contents of arbitrary objects, unlike
+        # their repr. Unpicklable objects raise a TypeError, which means the
+        # result is not cached
+        try:
+            pickled = cloudpickle.dumps(obj)
+        except Exception as e:
+            raise TypeError(f"Cannot hash object of type {type(obj)}: {e}")
+
+        _update_sized(hasher, b"o", type(obj).__qualname__.encode())
+        _update_sized(hasher, b"p", pickled)
+
+
+def canonical_hash(obj: Any) -> str:
+    """Hashes an object based on its contents. Dicts and sets hash the same
+    regardless of order, and numpy, pandas, and pyarrow objects are hashed
+    from their underlying buffers along with their dtypes and shapes.
+
+    Uses xxh3 if the `xxhash` package is installed, and blake2b otherwise.
+
+    Args:
+        obj (Any): Object to hash.
+
+    Raises:
+        TypeError: If the object cannot be hashed.
+
+    Returns:
+        str: Hex digest of the object.
+    """
+    hasher = _BufferedHasher()
+    _update(hasher, obj)
+    return hasher.hexdigest()
@@ -13,12 +13,21 @@ from typing import (
     Set,
 )
 
+from motion.blobs import BlobStore
+from motion.compression import COMPRESSION_THRESHOLD
 from motion.execute import Executor
+from motion.hashing import PropsHasher
+from motion.result_cache import ResultCache
 from motion.route import Route
+from motion.serializers import Serializer
 from motion.utils import DEFAULT_KEY_TTL, configureLogging
 
 logger = logging.getLogger(__name__)
 
+# How long shutdown waits for workers to flush the updates of an instance
+# with update_task_type="external" (seconds), since none may be running
+EXTERNAL_FLUSH_TIMEOUT = 60.0
+
 
 def is_logger_open(logger: logging.Logger) -> bool:
     for handler in logger.handlers:
@@ -43,11 +52,28 @@ class ComponentInstance:
         serve_routes: Dict[str, Route],
         update_routes: Dict[str, List[Route]],
         logging_level: str = "WARNING",
-        update_task_type: Literal["thread", "process"] = "thread",
+        update_task_type: Literal["thread", "process", "pool", "external"] = "thread",
         disable_update_task: bool = False,
         cache_ttl: int = DEFAULT_KEY_TTL,
+        props_hasher: Optional[PropsHasher] = None,
         redis_socket_timeout: int = 60,
         flush_on_exit: bool = False,
+        push_state_updates: bool = False,
+        max_state_staleness: float = 30.0,
+        queue_backend: Literal["list", "stream"] = "list",
+        state_layout: Literal["blob", "hash"] = "blob",
+        lazy_state: bool = False,
+        concurrency: Literal["lock", "optimistic"] = "lock",
+        serializer: Optional[Serializer] = None,
+        compression: Optional[str] = None,
+        compression_threshold: int = COMPRESSION_THRESHOLD,
+        blob_store: Optional[BlobStore] = None,
+        shared_state: bool = False,
+        result_cache: Optional[ResultCache] = None,
+        singleflight: Optional[Literal["process", "redis"]] = None,
+        singleflight_lease: float = 30.0,
+        stale_while_revalidate: bool = False,
+        max_version_lag: Optional[int] = None,
     ):
         """Creates a new instance of a Motion component.
 
@@ -60,8 +86,29 @@ class ComponentInstance:
                 Logging level for the Motion logger. Uses the logging library.
                 Defaults to "WARNING".
         """
-        if update_task_type not in ["thread", "process"]:
-            raise ValueError("update_task must be either 'thread' or 'process'")
+        if update_task_type not in ["thread", "process", "pool", "external"]:
+            raise ValueError(
+                "update_task must be either 'thread', 'process', 'pool', "
+                + "or 'external'"
+            )
+        if queue_backend not in ["list", "stream"]:
+            raise ValueError("queue_backend must be either 'list' or 'stream'")
+        if queue_backend == "stream" and update_task_type not in ["thread", "process"]:
+            raise ValueError(
+                "The stream queue backend requires update_task_type "
+                + "'thread' or 'process'"
+            )
+        if state_layout == "hash" and save_state_func:
+            raise ValueError("save_state can't be used with the hash state layout")
+        if (
+            state_layout == "hash"
+            and load_state_func
+            and not getattr(load_state_func, "_fields", None)
+        ):
+            raise ValueError(
+                "load_state must declare the fields it transforms with the hash "
+                + "state layout, e.g., @C.load_state(fields=[...])"
+            )
 
         self._component_name = component_name
         configureLogging(logging_level)
@@ -77,6 +124,7 @@ class ComponentInstance:
         self.running = False
         self.disable_update_task = disable_update_task
         self.flush_on_exit = flush_on_exit
+        self.update_task_type = update_task_type
 
         if self.disable_update_task and self.flush_on_exit:
             raise ValueError("Cannot flush on exit if update task is disabled.")
@@ -86,6 +134,7 @@ class ComponentInstance:
         self._executor = Executor(
             self._instance_name,
             cache_ttl=self._cache_ttl,
+            props_hasher=props_hasher,
             init_state_func=init_state_func,
             init_state_params=init_state_params if init_state_params else {},
             save_state_func=save_state_func,
@@ -95,6 +144,22 @@ class ComponentInstance:
             update_task_type=update_task_type,
             disable_update_task=self.disable_update_task,
             redis_socket_timeout=redis_socket_timeout,
+            push_state_updates=push_state_updates,
+            max_state_staleness=max_state_staleness,
+            queue_backend=queue_backend,
+            state_layout=state_layout,
+            lazy_state=lazy_state,
+            concurrency=concurrency,
+            serializer=serializer,
+            compression=compression,
+            compression_threshold=compression_threshold,
+            blob_store=blob_store,
+            shared_state=shared_state,
+            result_cache=result_cache,
+            singleflight=singleflight,
+            singleflight_lease=singleflight_lease,
+            stale_while_revalidate=stale_while_revalidate,
+            max_version_lag=max_version_lag,
         )
         self.running = True
 
@@ -183,16 +248,27 @@ class ComponentInstance:
                 c_instance.run(...)
         ```
         """
-        if self.disable_update_task:
+        if not self.running:
             return
 
-        if not self.running:
+        if self.disable_update_task:
+            self._executor.stop_version_listener()
+            self.running = False
             return
 
         # Flush the update queue
         if self.flush_on_exit:
+            timeout = (
+                EXTERNAL_FLUSH_TIMEOUT if self.update_task_type == "external" else None
+            )
             for flow_key in self.flows_run:
-                self.flush_update(flow_key)
+                try:
+                    self.flush_update(flow_key, timeout=timeout)
+                except TimeoutError:
+                    logger.warning(
+                        f"Timed out flushing updates for flow {flow_key}. "
+                        + "Are any workers running for this component?"
+                    )
 
         is_open = is_logger_open(logger)
 
@@ -229,6 +305,33 @@ class ComponentInstance:
         """
         return self._executor.version  # type: ignore
 
+    def get_serve_timings(self) -> Dict[str, float]:
+        """
+        Gets how long (in seconds) each phase of the most recent flow took.
+        Phases are `cache_lookup`, `load_state`, `serve`, and
+        `enqueue_update`. `load_state` and `serve` are missing if the
+        serve result was cached.
+
+        Usage:
+        ```python
+        from motion import Component
+
+        C = Component("MyComponent")
+
+        @C.serve("add")
+        def add(state, props):
+            return props["value"] + 1
+
+        if __name__ == "__main__":
+            with C() as c_instance:
+                c_instance.run("add", props={"value": 1})
+                c_instance.get_serve_timings() # Includes serve time
+                c_instance.run("add", props={"value": 1})
+                c_instance.get_serve_timings() # Only cache lookup time
+        ```
+        """
+        return dict(self._executor.serve_timings)
+
     def write_state(self, state_update: Dict[str, Any]) -> None:
         """Writes the state update to the component instance's state.
         If a update op is currently running, the state update will be
@@ -302,10 +405,10 @@ class ComponentInstance:
             Any: Current value for the key, or default_value if the key
             is not found.
         """
-        self._executor._loadState()
+        self._executor._loadState(trust_cache=True)
         return self._executor._state.get(key, default_value)
 
-    def flush_update(self, flow_key: str) -> None:
+    def flush_update(self, flow_key: str, timeout: Optional[float] = None) -> None:
         """Flushes the update queue corresponding to the flow
         key, if it exists, and updates the instance state.
         Warning: this is a blocking operation and could take
@@ -344,15 +447,44 @@ class ComponentInstance:
 
         Args:
             flow_key (str): Key of the flow.
+            timeout (Optional[float], optional): Seconds to wait for the
+                update ops. Defaults to None, which waits indefinitely.
+                Useful with update_task_type="external", where nothing
+                runs the update ops if no workers are running.
+
+        Raises:
+            RuntimeError:
+                If the component instance was initialized as disable_update_task.
+            TimeoutError:
+                If the update ops didn't finish within `timeout` seconds.
+        """
+        if self.disable_update_task:
+            raise RuntimeError("Cannot run a disable_update_task component instance.")
+
+        self._executor.flush_update(flow_key, timeout=timeout)
+
+    async def aflush_update(
+        self, flow_key: str, timeout: Optional[float] = None
+    ) -> None:
+        """Async version of flush_update. Waits for the update queue
+        corresponding to the flow key to be flushed without blocking the
+        event loop, then updates the instance state.
+
+        Args:
+            flow_key (str): Key of the flow.
+            timeout (Optional[float], optional): Seconds to wait for the
+                update ops. Defaults to None, which waits indefinitely.
 
         Raises:
             RuntimeError:
                 If the component instance was initialized as disable_update_task.
+            TimeoutError:
+                If the update ops didn't finish within `timeout` seconds.
         """
         if self.disable_update_task:
             raise RuntimeError("Cannot run a disable_update_task component instance.")
 
-        self._executor.flush_update(flow_key)
+        await self._executor.aflush_update(flow_key, timeout=timeout)
 
     def gen(
         self,
@@ -513,6 +645,76 @@ class ComponentInstance:
 
         return serve_result[0]
 
+    def run_many(
+        self,
+        flow_key: str,
+        props_list: List[Dict[str, Any]],
+        ignore_cache: bool = False,
+        force_refresh: bool = False,
+        flush_update: bool = False,
+    ) -> List[Any]:
+        """Runs the flow (serve and update ops) for each of the props in
+        `props_list`. This is faster than calling `run` for each props: the
+        state is loaded once, all cache lookups and cache writes happen in one
+        round trip each, and all update ops are enqueued in one transaction.
+        The serve op only runs for the props whose results aren't cached, and
+        a vectorized serve op receives all of them in a single call.
+
+        Example Usage:
+        ```python
+        from motion import Component
+
+        C = Component("MyComponent")
+
+        @C.init_state
+        def setUp():
+            return {"weight": 2}
+
+        @C.serve("score", vectorized=True)
+        def score(state, props):
+            return [state["weight"] * p["value"] for p in props]
+
+        if __name__ == "__main__":
+            with C() as c:
+                c.run_many("score", [{"value": 1}, {"value": 2}]) # Returns [2, 4]
+        ```
+
+        Args:
+            flow_key (str): Key of the flow to run.
+            props_list (List[Dict[str, Any]]): Props to run the flow for.
+            ignore_cache (bool, optional):
+                If True, ignores the cache and runs the serve op. Does not
+                force refresh the state. Defaults to False.
+            force_refresh (bool, optional): Whether to wait for all the pending
+                updates to finish processing, resulting in the most up-to-date
+                state, before running the serve op. Defaults to False, where a
+                stale version of the state or cached results may be used.
+            flush_update (bool, optional):
+                If True, runs the update ops for each props before returning.
+                Defaults to False.
+
+        Raises:
+            KeyError: If the flow key has no ops.
+            TypeError: If the serve op is a generator or is async.
+            RuntimeError:
+                If the component instance update processes are disabled and
+                the flow has update ops.
+
+        Returns:
+            List[Any]: Results of the serve op, in the same order as
+            `props_list`.
+        """
+        results = self._executor.run_many(
+            key=flow_key,
+            props_list=props_list,
+            ignore_cache=ignore_cache,
+            force_refresh=force_refresh,
+            flush_update=flush_update,
+        )
+
+        self.flows_run.add(flow_key)
+        return results
+
     async def agen(
         self,
         flow_key: str,
@@ -653,3 +855,71 @@ class ComponentInstance:
             results.append(elem)
 
         return results[0]  # type: ignore
+
+    async def arun_many(
+        self,
+        flow_key: str,
+        props_list: List[Dict[str, Any]],
+        ignore_cache: bool = False,
+        force_refresh: bool = False,
+        flush_update: bool = False,
+    ) -> List[Any]:
+        """Async version of run_many. Runs the flow (serve and update ops)
+        for each of the props in `props_list`. Async serve ops that aren't
+        vectorized run concurrently for the props whose results aren't cached.
+
+        Example Usage:
+        ```python
+        from motion import Component
+        import asyncio
+
+        C = Component("MyComponent")
+
+        @C.serve("sleep")
+        async def sleep(state, props):
+            await asyncio.sleep(props["value"])
+            return "Slept!"
+
+        async def main():
+            with C() as c:
+                await c.arun_many("sleep", [{"value": 1}, {"value": 2}])
+
+        if __name__ == "__main__":
+            asyncio.run(main())
+        ```
+
+        Args:
+            flow_key (str): Key of the flow to run.
+            props_list (List[Dict[str, Any]]): Props to run the flow for.
+            ignore_cache (bool, optional):
+                If True, ignores the cache and runs the serve op. Does not
+                force refresh the state. Defaults to False.
+            force_refresh (bool, optional): Whether to wait for all the pending
+                updates to finish processing, resulting in the most up-to-date
+                state, before running the serve op. Defaults to False, where a
+                stale version of the state or cached results may be used.
+            flush_update (bool, optional):
+                If True, runs the update ops for each props before returning.
+                Defaults to False.
+
+        Raises:
+            KeyError: If the flow key has no ops.
+            TypeError: If the serve op is a generator.
+            RuntimeError:
+                If the component instance update processes are disabled and
+                the flow has update ops.
+
+        Returns:
+            List[Any]: Results of the serve op, in the same order as
+            `props_list`.
+        """
+        results = await self._executor.arun_many(
+            key=flow_key,
+            props_list=props_list,
+            ignore_cache=ignore_cache,
+            force_refresh=force_refresh,
+            flush_update=flush_update,
+        )
+
+        self.flows_run.add(flow_key)
+        return results
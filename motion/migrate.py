@@ -8,9 +8,12 @@ import redis
 from pydantic import BaseConfig, BaseModel, Field
 from tqdm import tqdm
 
+from motion.blobs import BlobStore
 from motion.component import Component
+from motion.compression import Compressor, get_compressor
 from motion.dicts import State
-from motion.utils import get_redis_params, loadState, saveState
+from motion.serializers import Serializer
+from motion.utils import get_redis_params, getStateLayout, loadState, saveState
 
 logger = logging.getLogger(__name__)
 
@@ -20,13 +23,26 @@ def process_migration(
     migrate_func: Callable,
     load_state_fn: Callable,
     save_state_fn: Callable,
+    serializer: Optional[Serializer] = None,
+    compressor: Optional[Compressor] = None,
+    blob_store: Optional[BlobStore] = None,
 ) -> Tuple[str, Optional[Exception]]:
     try:
         rp = get_redis_params()
         redis_con = redis.Redis(
             **rp.dict(),
         )
-        state, version = loadState(redis_con, instance_name, load_state_fn)
+        # Look the layout up once for both the load and the save
+        state_layout = getStateLayout(redis_con, instance_name)
+        state, version = loadState(
+            redis_con,
+            instance_name,
+            load_state_fn,
+            state_layout,
+            serializer=serializer,
+            compressor=compressor,
+            blob_store=blob_store,
+        )
 
         new_state = migrate_func(state)
         assert isinstance(new_state, dict), (
@@ -40,7 +56,15 @@ def process_migration(
         )
         empty_state.update(new_state)
         success_indicator = saveState(
-            empty_state, version, redis_con, instance_name, save_state_fn
+            empty_state,
+            version,
+            redis_con,
+            instance_name,
+            save_state_fn,
+            state_layout,
+            serializer=serializer,
+            compressor=compressor,
+            blob_store=blob_store,
         )
 
         if success_indicator == -1:
@@ -136,8 +160,9 @@ class StateMigrator:
         ]
         if not instance_names:
             instance_names = [
-                key.decode("utf-8").replace("MOTION_STATE:", "")  # type: ignore
-                for key in redis_con.keys(f"MOTION_STATE:{self.component.name}__*")
+                key.decode("utf-8").split(":", 1)[1]  # type: ignore
+                for prefix in ["MOTION_STATE:", "MOTION_STATE_FIELDS:"]
+                for key in redis_con.keys(f"{prefix}{self.component.name}__*")
             ]
 
         if not instance_names:
@@ -152,6 +177,12 @@ class StateMigrator:
                     self.migrate_func,
                     self.component._load_state_func,
                     self.component._save_state_func,
+                    self.component._serializer,
+                    get_compressor(
+                        self.component._compression,
+                        self.component._compression_threshold,
+                    ),
+                    self.component._blob_store,
                 )
                 for instance_name in instance_names
             ]
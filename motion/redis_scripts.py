@@ -0,0 +1,203 @@
+"""
+This file contains Lua scripts that Motion registers with Redis to
+cut down on round trips for common operations.
+"""
+
+import threading
+import weakref
+from typing import Dict
+
+import redis
+from redis.commands.core import Script
+
+CACHED_SERVE_LOOKUP = """
+-- KEYS[1]: key of the cached serve result
+-- KEYS[2..n]: state version keys to try, in order
+local result = redis.call('GET', KEYS[1])
+local version = false
+for i = 2, #KEYS do
+    version = redis.call('GET', KEYS[i])
+    if version then
+        break
+    end
+end
+return {result, version}
+"""
+
+SAVE_STATE = """
+-- KEYS[1]: state key to write to
+-- KEYS[2]: version key to write to
+-- KEYS[3]: (optional) version key to check instead if KEYS[2] doesn't
+--     exist yet, e.g., the prod version of a dev copy of the state
+-- ARGV[1]: version the caller's state is at
+-- ARGV[2]: pickled state
+-- ARGV[3]: channel to publish the new version to
+local current = redis.call('GET', KEYS[2])
+if not current and #KEYS > 2 then
+    current = redis.call('GET', KEYS[3])
+end
+-- Another process already saved a newer state
+if current and tonumber(current) > tonumber(ARGV[1]) then
+    return -1
+end
+local new_version = tonumber(ARGV[1]) + 1
+redis.call('SET', KEYS[1], ARGV[2])
+redis.call('SET', KEYS[2], new_version)
+redis.call('PUBLISH', ARGV[3], new_version)
+return new_version
+"""
+
+LOAD_STATE_FIELDS = """
+-- KEYS[1..3]: version key, field versions hash, and fields hash of the state
+-- KEYS[4..6]: (optional) keys to read instead if KEYS[1] doesn't exist
+-- ARGV[1]: '1' to return the values of changed fields, '0' to only return
+--     the field versions
+-- ARGV[2..n]: field, version pairs of the caller's cached copy of the state
+local base = 0
+if #KEYS > 3 and redis.call('EXISTS', KEYS[1]) == 0 then
+    base = 3
+end
+local version = redis.call('GET', KEYS[base + 1])
+if not version then
+    return {}
+end
+local field_versions = redis.call('HGETALL', KEYS[base + 2])
+local changed = {}
+local values = {}
+if ARGV[1] == '1' then
+    local cached = {}
+    for i = 2, #ARGV, 2 do
+        cached[ARGV[i]] = ARGV[i + 1]
+    end
+    -- Only return the fields that changed since the cached copy
+    for i = 1, #field_versions, 2 do
+        if cached[field_versions[i]] ~= field_versions[i + 1] then
+            table.insert(changed, field_versions[i])
+            table.insert(values, redis.call('HGET', KEYS[base + 3], field_versions[i]))
+        end
+    end
+end
+return {version, field_versions, changed, values, KEYS[base + 2], KEYS[base + 3]}
+"""
+
+SAVE_STATE_FIELDS = """
+-- KEYS[1..3]: version key, field versions hash, and fields hash to write to
+-- KEYS[4..6]: (optional) keys to copy the state from if KEYS[1] doesn't
+--     exist yet, e.g., a dev copy of a prod state
+-- ARGV[1]: version the caller's state is at, or '' to only check the
+--     versions of the fields in ARGV[4..]
+-- ARGV[2]: channel to publish the new version to
+-- ARGV[3]: number n of fields to check
+-- ARGV[4..3 + 2n]: field, version pairs the caller's copies of the fields
+--     are at (0 if the field didn't exist)
+-- ARGV[4 + 2n..]: field, value pairs to write
+local current = redis.call('GET', KEYS[1])
+if not current and #KEYS > 3 then
+    current = redis.call('GET', KEYS[4])
+    if current then
+        local field_versions = redis.call('HGETALL', KEYS[5])
+        for i = 1, #field_versions, 2 do
+            redis.call('HSET', KEYS[2], field_versions[i], field_versions[i + 1])
+        end
+        local fields = redis.call('HGETALL', KEYS[6])
+        for i = 1, #fields, 2 do
+            redis.call('HSET', KEYS[3], fields[i], fields[i + 1])
+        end
+    end
+end
+-- Another process already saved a newer state, or newer copies of the
+-- checked fields
+local new_version
+if ARGV[1] ~= '' then
+    if current and tonumber(current) > tonumber(ARGV[1]) then
+        return -1
+    end
+    new_version = tonumber(ARGV[1]) + 1
+else
+    new_version = tonumber(current or 0) + 1
+end
+local first_value = 4 + 2 * tonumber(ARGV[3])
+for i = 4, first_value - 1, 2 do
+    local field_version = redis.call('HGET', KEYS[2], ARGV[i]) or '0'
+    if tonumber(field_version) ~= tonumber(ARGV[i + 1]) then
+        return -1
+    end
+end
+for i = first_value, #ARGV, 2 do
+    redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 1])
+    redis.call('HSET', KEYS[2], ARGV[i], new_version)
+end
+redis.call('SET', KEYS[1], new_version)
+redis.call('PUBLISH', ARGV[2], new_version)
+return new_version
+"""
+
+RELEASE_LEASE = """
+-- KEYS[1]: lease key
+-- ARGV[1]: token the lease was taken with, so leases that expired and were
+--     taken by someone else aren't released
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+CLAIM_ORPHANS = """
+-- KEYS[1]: orphaned blobs of an instance, scored by when they were orphaned
+-- ARGV[1]: blobs orphaned at or before this time are claimed for deletion
+-- Claimed blobs are scored -1 until `FORGET_ORPHAN` removes them. Blobs
+-- claimed by a sweep that didn't finish are claimed again
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], -1, ARGV[1])
+for _, sha in ipairs(expired) do
+    redis.call('ZADD', KEYS[1], -1, sha)
+end
+return expired
+"""
+
+FORGET_ORPHAN = """
+-- KEYS[1]: orphaned blobs of an instance
+-- KEYS[2]: (optional) key of the blob, deleted along with its orphan entry
+-- ARGV[1]: hash of a blob claimed by `CLAIM_ORPHANS`
+-- Returns 0 if a writer took the blob out of the orphans while it was
+-- being deleted, so it must be kept
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) == '-1' then
+    if #KEYS > 1 then
+        redis.call('DEL', KEYS[2])
+    end
+    return redis.call('ZREM', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+FORGET_IDLE_INSTANCE = """
+-- KEYS[1]: set of instances with updates for workers to run
+-- KEYS[2..n]: update queues of the instance
+-- ARGV[1]: instance name
+-- Removes the instance from the set, unless an update was queued for it
+for i = 2, #KEYS do
+    if redis.call('LLEN', KEYS[i]) > 0 then
+        return 0
+    end
+end
+redis.call('SREM', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Scripts registered with each client, so their SHA is only computed once.
+# Registering a script doesn't contact Redis; the script is loaded into
+# Redis the first time it is run
+_registered: "weakref.WeakKeyDictionary[redis.Redis, Dict[str, Script]]" = (
+    weakref.WeakKeyDictionary()
+)
+_registered_lock = threading.Lock()
+
+
+def get_script(redis_con: redis.Redis, script: str) -> Script:
+    """Registers a script with a client the first time it is used with it,
+    and returns the registered script after that."""
+    with _registered_lock:
+        scripts = _registered.setdefault(redis_con, {})
+        if script not in scripts:
+            scripts[script] = redis_con.register_script(script)
+        return scripts[script]
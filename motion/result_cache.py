@@ -0,0 +1,276 @@
+"""
+This file contains the format serve results are cached in, and the
+in-process cache that sits in front of the cached results in Redis.
+"""
+
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import cloudpickle
+
+# Cached results start with the magic prefix and a header holding the format
+# version, the state version the result was computed against (-1 if
+# unknown), and when it was cached. Entries without the prefix were written
+# by older versions, which pickled the whole props
+_RESULT_MAGIC = b"MOTION:R"
+_RESULT_HEADER = struct.Struct("<Bqd")
+_RESULT_FORMAT = 1
+
+
+class CachedResult(NamedTuple):
+    """A serve result read from the cache."""
+
+    serve_result: Any
+    # Props the serve op set, applied to the caller's props on a hit
+    props_update: Dict[str, Any]
+    # State version the result was computed against, if known
+    version: Optional[int]
+    cached_at: Optional[float]
+    # Whole props of entries written in the old format
+    legacy_props: Any = None
+
+
+def dump_result(
+    serve_result: Any, props_update: Dict[str, Any], version: Optional[int]
+) -> bytes:
+    """Serializes a serve result to cache, with the props the serve op set
+    but without the rest of the props."""
+    header = _RESULT_HEADER.pack(
+        _RESULT_FORMAT, -1 if version is None else version, time.time()
+    )
+    return b"".join(
+        [_RESULT_MAGIC, header, cloudpickle.dumps((serve_result, props_update))]
+    )
+
+
+def load_result(data: bytes) -> CachedResult:
+    """Deserializes a cached serve result, in either format."""
+    if not data.startswith(_RESULT_MAGIC):
+        props = cloudpickle.loads(data)
+        return CachedResult(props._serve_result, {}, None, None, props)
+
+    offset = len(_RESULT_MAGIC)
+    _, version, cached_at = _RESULT_HEADER.unpack_from(data, offset)
+    serve_result, props_update = cloudpickle.loads(
+        memoryview(data)[offset + _RESULT_HEADER.size :]
+    )
+    return CachedResult(
+        serve_result, props_update, None if version < 0 else version, cached_at
+    )
+
+
+def estimate_size(obj: Any, _depth: int = 0) -> int:
+    """Estimates how many bytes an object holds, counting the buffers of
+    numpy, pandas, and Arrow objects and the items of containers a few
+    levels deep."""
+    memory_usage = getattr(obj, "memory_usage", None)
+    if callable(memory_usage) and not isinstance(obj, type):
+        # pandas objects
+        try:
+            usage = memory_usage(deep=True)
+            return int(usage.sum() if hasattr(usage, "sum") else usage)
+        except TypeError:
+            pass
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):
+        # numpy arrays and Arrow arrays and tables
+        return nbytes + sys.getsizeof(object())
+
+    size = sys.getsizeof(obj)
+    if _depth < 3:
+        if isinstance(obj, dict):
+            size += sum(
+                estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+                for k, v in obj.items()
+            )
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            size += sum(estimate_size(item, _depth + 1) for item in obj)
+    return size
+
+
+class ResultCache:
+    """Bounded, in-process LRU cache of serve results, checked before the
+    cache in Redis. A hit skips the round trip to Redis and unpickling.
+
+    Only serve results (and the props serve ops set) are kept, not the
+    props they were computed from, and they are keyed by instance, flow
+    key, and props hash, so props don't take up memory here no matter how
+    many instances see them. Pass the
+    same cache to several components to bound them together.
+
+    Usage:
+    ```python
+    from motion import Component
+    from motion.result_cache import ResultCache
+
+    MyComponent = Component(
+        "MyComponent",
+        result_cache=ResultCache(max_entries=10_000, max_bytes=256 * 1024 * 1024),
+    )
+    ```
+
+    Results returned on a hit are the cached objects themselves, so serve
+    op callers shouldn't modify them in place.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        versioned: bool = False,
+    ) -> None:
+        """Creates a result cache.
+
+        Args:
+            max_entries (int, optional): Maximum number of results to keep.
+                Defaults to 1024.
+            max_bytes (int, optional): Maximum estimated size of the results
+                to keep, in bytes. Results larger than this aren't kept.
+                Defaults to 64 MiB.
+            versioned (bool, optional): Only serve results computed against
+                the state version the instance has loaded. Results found in
+                Redis, whose version isn't known, are then not kept.
+                Defaults to False.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.versioned = versioned
+
+        # Key -> (result, size, expiry time, state version)
+        self._entries: "OrderedDict[str, Tuple[Any, int, float, Optional[int]]]" = (
+            OrderedDict()
+        )
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Caches are local to a process
+        return {
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "versioned": self.versioned,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)  # type: ignore
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, version: Optional[int] = None) -> Tuple[bool, Any]:
+        """Looks up a result.
+
+        Args:
+            key (str): Key of the cached result.
+            version (Optional[int], optional): State version the caller has
+                loaded, checked if the cache is versioned. Defaults to None.
+
+        Returns:
+            Tuple[bool, Any]: Whether there was a hit, and the result.
+        """
+        hit, result, _ = self.get_entry(key, version)
+        return hit, result
+
+    def get_entry(
+        self,
+        key: str,
+        version: Optional[int] = None,
+        min_version: Optional[int] = None,
+    ) -> Tuple[bool, Any, Optional[int]]:
+        """Looks up a result, along with the state version it was computed
+        against, if known.
+
+        Args:
+            key (str): Key of the cached result.
+            version (Optional[int], optional): State version the caller has
+                loaded, checked if the cache is versioned. Defaults to None.
+            min_version (Optional[int], optional): Oldest state version the
+                caller accepts results computed against. Results whose
+                version isn't known are then misses. Defaults to None.
+
+        Returns:
+            Tuple[bool, Any, Optional[int]]: Whether there was a hit, the
+            result, and its state version.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, size, expires_at, entry_version = entry
+                if expires_at <= time.monotonic():
+                    self._remove(key)
+                    self.expirations += 1
+                elif (
+                    not self.versioned
+                    or (entry_version is not None and entry_version == version)
+                ) and (
+                    min_version is None
+                    or (entry_version is not None and entry_version >= min_version)
+                ):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, result, entry_version
+
+            self.misses += 1
+            return False, None, None
+
+    def put(
+        self, key: str, result: Any, ttl: float, version: Optional[int] = None
+    ) -> None:
+        """Caches a result, evicting the least recently used results to
+        stay within bounds.
+
+        Args:
+            key (str): Key of the cached result.
+            result (Any): Serve result.
+            ttl (float): Seconds to keep the result for.
+            version (Optional[int], optional): State version the result was
+                computed against. Defaults to None.
+        """
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        if self.versioned and version is None:
+            return
+
+        size = estimate_size(result)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (result, size, time.monotonic() + ttl, version)
+            self._num_bytes += size
+            while len(self._entries) > self.max_entries or (
+                self._num_bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, size, _, _ = self._entries.pop(key)
+        self._num_bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._num_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the cache's counters and how much it holds."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self._num_bytes,
+            }
@@ -1,6 +1,6 @@
 import inspect
 import logging
-from typing import Any, Callable, Dict
+from typing import Any, Callable, Dict, List, Optional
 
 from pydantic import BaseModel, Field, PrivateAttr
 
@@ -37,3 +37,59 @@ class Route(BaseModel):
             raise e
 
         return result
+
+
+def is_vectorized(udf: Callable) -> bool:
+    """Whether a serve op takes a list of props and returns a list of
+    results."""
+    return getattr(udf, "_vectorized", False)
+
+
+def get_batch_size(udf: Callable) -> int:
+    """Maximum number of props an update op is run on at once. Update ops
+    with a batch size greater than 1 are passed a list of props."""
+    return getattr(udf, "_batch_size", 1)
+
+
+def get_merge(udf: Callable) -> Optional[Callable]:
+    """Function that merges queued props into one for an update op with the
+    COALESCE discard policy, or None if the update op doesn't coalesce."""
+    return getattr(udf, "_merge", None)
+
+
+def get_update_props(udf: Callable, props_list: List[Any]) -> Any:
+    """Props to run an update op on for queued props: merged into one if the
+    update op coalesces them, the list if it is batched, and the only props
+    otherwise."""
+    merge = get_merge(udf)
+    if merge is not None:
+        return merge(props_list)
+    if get_batch_size(udf) > 1:
+        return props_list
+    return props_list[0]
+
+
+def get_writes(udf: Callable) -> Optional[List[str]]:
+    """State keys an update op declared it writes, or None if it may write
+    any key."""
+    return getattr(udf, "_writes", None)
+
+
+def check_writes(udf: Callable, state_update: Dict[str, Any]) -> None:
+    """Raises a ValueError if an update op that declared the state keys it
+    writes returned an update to other keys."""
+    writes = get_writes(udf)
+    if writes is None:
+        return
+    undeclared = [key for key in state_update if key not in writes]
+    if undeclared:
+        raise ValueError(
+            f"Update op {udf.__name__} returned keys {undeclared} "
+            + "that aren't in its writes."
+        )
+
+
+def get_reads(udf: Callable) -> List[str]:
+    """State keys an update op declared it reads, besides the keys it
+    writes."""
+    return getattr(udf, "_reads", [])
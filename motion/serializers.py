@@ -0,0 +1,176 @@
+"""
+This file contains the serializers used to store component state in Redis.
+"""
+
+import pickle
+import struct
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Union
+
+import cloudpickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Serializer(ABC):
+    """Converts state to bytes to store in Redis, and back.
+
+    Subclass this to plug in your own codec:
+    ```python
+    from motion import Component
+    from motion.serializers import Serializer
+
+    class JSONSerializer(Serializer):
+        def dumps(self, obj):
+            return json.dumps(obj).encode("utf-8")
+
+        def loads(self, data):
+            return json.loads(data)
+
+    MyComponent = Component("MyComponent", serializer=JSONSerializer())
+    ```
+
+    Serializers must be picklable, since they are sent to update processes.
+    """
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> bytes:
+        """Converts an object to bytes."""
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        """Converts bytes written by `dumps` back to an object."""
+
+
+# Payloads of the serializers below start with a magic prefix, so that state
+# written by any of them can be read without knowing which one wrote it
+_PICKLE5_MAGIC = b"MOTION:P5"
+_MSGPACK_MAGIC = b"MOTION:MP"
+
+
+class CloudpickleSerializer(Serializer):
+    """Pickles state with cloudpickle, so that it can hold almost any
+    object, including functions and classes defined in `__main__`. This
+    is the default."""
+
+    def dumps(self, obj: Any) -> bytes:
+        return cloudpickle.dumps(obj)  # type: ignore
+
+    def loads(self, data: bytes) -> Any:
+        if data.startswith(_PICKLE5_MAGIC):
+            return Pickle5Serializer().loads(data)
+        if data.startswith(_MSGPACK_MAGIC):
+            return MsgpackSerializer().loads(data)
+        return cloudpickle.loads(data)
+
+
+class Pickle5Serializer(Serializer):
+    """Pickles state with pickle protocol 5, writing large buffers (numpy
+    arrays, Arrow buffers, bytes-like objects that support it) out of band
+    instead of copying them into the pickle stream. The pickle and the
+    buffers are framed into one payload:
+
+        magic | number of buffers | buffer lengths | pickle | buffers
+
+    Unpickled arrays are views into the payload, so loading large numeric
+    state copies it at most once.
+    """
+
+    def __init__(self, readonly: bool = False) -> None:
+        """Creates a protocol 5 serializer.
+
+        Args:
+            readonly (bool, optional): Unpickle arrays as read-only views
+                into the payload Redis returned, without copying it. With
+                the default, the payload is copied once into a writable
+                buffer, so arrays in the state can be modified in place.
+                Defaults to False.
+        """
+        self.readonly = readonly
+
+    def dumps(self, obj: Any) -> bytes:
+        buffers: List[pickle.PickleBuffer] = []
+        payload = cloudpickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        raws = [buffer.raw() for buffer in buffers]
+        header = struct.pack(
+            f"<{len(raws) + 2}Q", len(raws), len(payload), *[r.nbytes for r in raws]
+        )
+        return b"".join([_PICKLE5_MAGIC, header, payload, *raws])
+
+    def loads(self, data: bytes) -> Any:
+        # Accept any buffer, e.g., a memory-mapped file
+        if bytes(memoryview(data)[: len(_PICKLE5_MAGIC)]) != _PICKLE5_MAGIC:
+            # Written by another serializer
+            return CloudpickleSerializer().loads(data)
+
+        view = memoryview(data if self.readonly else bytearray(data))
+        offset = len(_PICKLE5_MAGIC)
+        (num_buffers,) = struct.unpack_from("<Q", view, offset)
+        lengths = struct.unpack_from(f"<{num_buffers + 1}Q", view, offset + 8)
+        offset += 8 * (num_buffers + 2)
+
+        payload_length, buffer_lengths = lengths[0], lengths[1:]
+        payload = view[offset : offset + payload_length]
+        offset += payload_length
+        buffers = []
+        for length in buffer_lengths:
+            buffers.append(view[offset : offset + length])
+            offset += length
+
+        return pickle.loads(payload, buffers=buffers)
+
+
+class MsgpackSerializer(Serializer):
+    """Serializes plain, JSON-like state (dicts, lists, strings, numbers,
+    bools, None, and bytes) with msgpack, which is faster and more compact
+    than pickling. Tuples are loaded as lists. Requires the `msgpack`
+    package."""
+
+    def __init__(self) -> None:
+        if msgpack is None:
+            raise ImportError(
+                "The msgpack serializer requires msgpack. "
+                + "Install it with `pip install msgpack`."
+            )
+
+    def dumps(self, obj: Any) -> bytes:
+        return _MSGPACK_MAGIC + msgpack.packb(obj)  # type: ignore
+
+    def loads(self, data: bytes) -> Any:
+        if not data.startswith(_MSGPACK_MAGIC):
+            # Written by another serializer
+            return CloudpickleSerializer().loads(data)
+        return msgpack.unpackb(memoryview(data)[len(_MSGPACK_MAGIC) :])
+
+
+SERIALIZERS: Dict[str, type] = {
+    "cloudpickle": CloudpickleSerializer,
+    "pickle5": Pickle5Serializer,
+    "msgpack": MsgpackSerializer,
+}
+
+
+def get_serializer(serializer: Optional[Union[str, Serializer]] = None) -> Serializer:
+    """Gets a serializer by name, or passes a serializer through.
+
+    Args:
+        serializer (Optional[Union[str, Serializer]], optional): One of
+            "cloudpickle", "pickle5", or "msgpack", or a `Serializer`.
+            Defaults to None, which uses cloudpickle.
+
+    Returns:
+        Serializer: The serializer.
+    """
+    if serializer is None:
+        return CloudpickleSerializer()
+    if isinstance(serializer, Serializer):
+        return serializer
+    if serializer not in SERIALIZERS:
+        raise ValueError(
+            f"Unknown serializer {serializer!r}. Use one of {list(SERIALIZERS)} "
+            + "or pass a Serializer."
+        )
+    return SERIALIZERS[serializer]()  # type: ignore
@@ -356,7 +356,7 @@ class Application:
                 if run_kwargs.get("flush_update", False):
                     background_tasks.add_task(
                         component_instance.flush_update,
-                        **{"flow_key": flow_key},
+                        flow_key=flow_key,
                     )
 
                 background_tasks.add_task(component_instance.shutdown)
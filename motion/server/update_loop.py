@@ -0,0 +1,135 @@
+import asyncio
+import atexit
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+# Maximum number of async update ops running at once in a process, across
+# all the instances and update tasks in it
+DEFAULT_MAX_ASYNC_UPDATES = 32
+
+# How long stopping the loop waits for the update ops running on it to
+# finish before cancelling them (seconds)
+STOP_TIMEOUT = 10.0
+
+
+class UpdateLoop:
+    """Long-lived event loop, run in its own thread, that the async update
+    ops of every update task in the process run on.
+
+    Update tasks hand coroutines to the loop, so async update ops of
+    different instances (and update ops of one instance that lock different
+    keys) overlap while they wait on I/O, rather than each getting a new
+    event loop. The update pool submits them without waiting, so they don't
+    hold its threads while they wait. Clients that bind to the loop they were
+    created on, e.g., an `httpx.AsyncClient` kept in a module, can be reused
+    across updates.
+
+    At most `max_concurrency` update ops run on the loop at once; the rest
+    wait their turn. Update ops share the loop, so they shouldn't block it
+    with long synchronous calls.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_ASYNC_UPDATES) -> None:
+        if max_concurrency < 1:
+            raise ValueError(
+                f"max_concurrency must be positive, got {max_concurrency}."
+            )
+
+        self.max_concurrency = max_concurrency
+        self._loop = asyncio.new_event_loop()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._thread = threading.Thread(
+            target=self._runLoop, name="UpdateLoop", daemon=True
+        )
+        self._thread.start()
+
+    def _runLoop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _limited(self, coro: Coroutine) -> Any:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await coro
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Schedules a coroutine on the loop without waiting for it. It runs
+        once fewer than `max_concurrency` coroutines are running.
+
+        Returns:
+            Future: The coroutine's result.
+        """
+        return asyncio.run_coroutine_threadsafe(self._limited(coro), self._loop)
+
+    def run(self, coro: Coroutine) -> Any:
+        """Runs a coroutine on the loop and waits for its result. Must not
+        be called from the loop's own thread."""
+        return self.submit(coro).result()
+
+    @property
+    def stopped(self) -> bool:
+        return self._loop.is_closed()
+
+    def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        """Waits up to `timeout` seconds for the coroutines running on the
+        loop to finish, cancels the rest, and stops the loop and its
+        thread. Must not be called from the loop's own thread."""
+        if self._loop.is_closed():
+            return
+
+        async def drain() -> None:
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            if tasks:
+                _, pending = await asyncio.wait(tasks, timeout=timeout)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if self._thread.is_alive():
+            asyncio.run_coroutine_threadsafe(drain(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+        self._loop.close()
+
+
+_update_loop: Optional[UpdateLoop] = None
+_update_loop_pid: Optional[int] = None
+_update_loop_lock = threading.Lock()
+
+
+def get_update_loop() -> UpdateLoop:
+    """Gets the process-wide update loop, creating it on first use. Its
+    concurrency limit is read from the MOTION_MAX_ASYNC_UPDATES env var, or
+    defaults to 32."""
+    global _update_loop, _update_loop_pid
+    with _update_loop_lock:
+        # The loop's thread doesn't survive a fork, so update processes
+        # start their own
+        if (
+            _update_loop is None
+            or _update_loop.stopped
+            or _update_loop_pid != os.getpid()
+        ):
+            _update_loop = UpdateLoop(
+                int(
+                    os.getenv(
+                        "MOTION_MAX_ASYNC_UPDATES", str(DEFAULT_MAX_ASYNC_UPDATES)
+                    )
+                )
+            )
+            _update_loop_pid = os.getpid()
+        return _update_loop
+
+
+def stop_update_loop() -> None:
+    """Stops the process-wide update loop, if it was started. It is stopped
+    when the process exits, and started again if it's used after."""
+    with _update_loop_lock:
+        if _update_loop is not None and _update_loop_pid == os.getpid():
+            _update_loop.stop()
+
+
+atexit.register(stop_update_loop)
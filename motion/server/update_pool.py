@@ -0,0 +1,346 @@
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+
+import cloudpickle
+import redis
+
+from motion.route import get_writes
+from motion.server.update_loop import get_update_loop
+from motion.server.update_task import BaseUpdateTask, get_block_timeout
+from motion.utils import logger
+
+DEFAULT_POOL_SIZE = 8
+
+
+class UpdateWorkerPool:
+    """Runs the update ops of every registered component instance in the
+    process on a bounded number of threads.
+
+    A single dispatcher thread blocks on the update queues of all registered
+    instances at once and hands each item it pops to a worker thread. An
+    instance has at most one item in flight, so its update ops still run
+    one at a time, and instances are polled in round-robin order so that a
+    busy instance can't starve the others.
+
+    The exception is update ops that declared the state keys they write:
+    these lock only those keys, so an instance can have one item in flight
+    per such update op. An item of an update op that locks the whole
+    instance waits for the instance's items in flight to finish, and no
+    new items of the instance start in the meantime, so it isn't starved.
+
+    Items of async update ops are handed to the process-wide update loop
+    rather than a worker thread, so they don't hold a thread while they
+    wait on I/O. Up to the loop's `max_concurrency` of them are in flight
+    at once, besides the `num_workers` items of sync update ops.
+    """
+
+    def __init__(self, redis_params: Dict[str, Any], num_workers: int) -> None:
+        if num_workers < 1:
+            raise ValueError(f"num_workers must be positive, got {num_workers}.")
+
+        self.redis_params = redis_params
+        self.num_workers = num_workers
+        self._redis_con = redis.Redis(**redis_params)
+        self._block_timeout = get_block_timeout(redis_params)
+
+        # Update tasks running by instance name, in round-robin order. More
+        # than one executor in the process may register a task for the same
+        # instance, and its update ops run until the last one deregisters
+        self._tasks: "OrderedDict[str, BaseUpdateTask]" = OrderedDict()
+        self._registrations: Dict[str, List[BaseUpdateTask]] = {}
+        # Queues with an item in flight, and the instances running an
+        # update op that has the whole instance locked
+        self._in_flight: Set[str] = set()
+        self._exclusive: Set[str] = set()
+        self._num_in_flight: Dict[str, int] = {}
+        # Items of update ops that lock the whole instance, popped while
+        # the instance had other items in flight, by instance name
+        self._waiting: Dict[str, Tuple[str, bytes]] = {}
+        # Items the dispatcher can still hand off, to worker threads and to
+        # the update loop
+        self._free_workers = num_workers
+        self._free_async = get_update_loop().max_concurrency
+        self._cond = threading.Condition()
+
+        # Pushing to the control queue wakes up the dispatcher when the set
+        # of queues it should block on changes
+        self._control_queue = f"MOTION_QUEUE:pool::control/{uuid4()}"
+        self._blocking = False
+
+        self._workers = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="UpdateWorkerPool"
+        )
+        # Shared by the instances for caching results and logging, so they
+        # don't each need their own threads
+        self.background = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="UpdateWorkerPool-background"
+        )
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, name="UpdateWorkerPool-dispatcher", daemon=True
+        )
+        self._dispatcher.start()
+
+    def register(self, task: BaseUpdateTask) -> None:
+        """Starts running the update ops of an instance."""
+        with self._cond:
+            registrations = self._registrations.setdefault(task.instance_name, [])
+            registrations.append(task)
+            if len(registrations) == 1:
+                self._tasks[task.instance_name] = task
+                self._wake()
+
+    def deregister(self, task: BaseUpdateTask) -> None:
+        """Withdraws a task passed to `register`. Once no task of its
+        instance is registered, stops running the instance's update ops,
+        waiting for its in-flight items to finish."""
+        instance_name = task.instance_name
+        with self._cond:
+            registrations = self._registrations.get(instance_name, [])
+            if not any(t is task for t in registrations):
+                return
+            registrations[:] = [t for t in registrations if t is not task]
+            if registrations:
+                # Another executor of the instance is still running
+                if self._tasks.get(instance_name) is task:
+                    self._tasks[instance_name] = registrations[0]
+                return
+
+            del self._registrations[instance_name]
+            self._tasks.pop(instance_name, None)
+            self._wake()
+            while self._num_in_flight.get(instance_name):
+                self._cond.wait()
+
+    def _wake(self) -> None:
+        # Called with self._cond held
+        self._cond.notify_all()
+        if self._blocking:
+            try:
+                self._redis_con.rpush(self._control_queue, "WAKE")
+            except redis.exceptions.RedisError:
+                logger.warning("Could not wake up the update pool.", exc_info=True)
+
+    def _next_queues(self) -> Tuple[List[str], Dict[str, str]]:
+        # Called with self._cond held. Returns the queues to block on, in
+        # round-robin order of their instances, and the instance of each
+        queues: List[str] = []
+        owners: Dict[str, str] = {}
+        for instance_name, task in self._tasks.items():
+            if instance_name in self._exclusive or instance_name in self._waiting:
+                continue
+            for queue in task.queue_identifiers:
+                if queue in self._in_flight:
+                    continue
+                # Only block on queues whose items can be handed off
+                if self._isAsync(task, queue):
+                    if not self._free_async:
+                        continue
+                elif not self._free_workers:
+                    continue
+                queues.append(queue)
+                owners[queue] = instance_name
+        return queues, owners
+
+    @staticmethod
+    def _isExclusive(task: BaseUpdateTask, queue_name: str) -> bool:
+        return get_writes(task.routes[queue_name].udf) is None
+
+    @staticmethod
+    def _isAsync(task: BaseUpdateTask, queue_name: str) -> bool:
+        return inspect.iscoroutinefunction(task.routes[queue_name].udf)
+
+    def _next_waiting(self) -> Optional[Tuple[str, str, bytes]]:
+        # Called with self._cond held. Pops a waiting item that can start,
+        # because nothing else is running on its instance, or whose
+        # instance deregistered
+        for instance_name, (queue_name, raw_item) in self._waiting.items():
+            task = self._tasks.get(instance_name)
+            if task is not None:
+                if self._num_in_flight.get(instance_name):
+                    continue
+                if not (
+                    self._free_async
+                    if self._isAsync(task, queue_name)
+                    else self._free_workers
+                ):
+                    continue
+            del self._waiting[instance_name]
+            return instance_name, queue_name, raw_item
+        return None
+
+    def _dispatch(self) -> None:
+        backoff = 0.1
+        while True:
+            try:
+                with self._cond:
+                    waiting = self._next_waiting()
+                    queues, owners = self._next_queues()
+                    while waiting is None and not queues:
+                        self._cond.wait()
+                        waiting = self._next_waiting()
+                        queues, owners = self._next_queues()
+                    self._blocking = waiting is None
+
+                if waiting is not None:
+                    self._start(*waiting)
+                    continue
+
+                try:
+                    full_item = self._redis_con.blpop(
+                        queues + [self._control_queue], timeout=self._block_timeout
+                    )
+                    backoff = 0.1
+                finally:
+                    with self._cond:
+                        self._blocking = False
+
+            except redis.exceptions.RedisError:
+                logger.error(
+                    "Update pool could not pop update items from Redis.",
+                    exc_info=True,
+                )
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+                continue
+
+            if full_item is None:
+                continue
+
+            queue_name = full_item[0].decode("utf-8")
+            if queue_name == self._control_queue:
+                continue
+
+            self._start(owners[queue_name], queue_name, full_item[1])
+
+    def _start(self, instance_name: str, queue_name: str, raw_item: bytes) -> None:
+        """Hands an item to a worker thread or the update loop, or holds it
+        until the instance's items in flight finish if it locks the whole
+        instance."""
+        with self._cond:
+            task = self._tasks.get(instance_name)
+            if task is not None:
+                if self._isExclusive(task, queue_name) and self._num_in_flight.get(
+                    instance_name
+                ):
+                    self._waiting[instance_name] = (queue_name, raw_item)
+                    return
+
+                is_async = self._isAsync(task, queue_name)
+                if is_async:
+                    self._free_async -= 1
+                else:
+                    self._free_workers -= 1
+                self._in_flight.add(queue_name)
+                self._num_in_flight[instance_name] = (
+                    self._num_in_flight.get(instance_name, 0) + 1
+                )
+                if self._isExclusive(task, queue_name):
+                    self._exclusive.add(task.instance_name)
+                # Serve the other instances first next time
+                self._tasks.move_to_end(instance_name)
+
+        if task is None:
+            # The instance deregistered while we were blocked, so put the
+            # item back for whoever picks up its queues next
+            self._requeue(queue_name, raw_item)
+            return
+
+        try:
+            if is_async:
+                get_update_loop().submit(self._awork(task, queue_name, raw_item))
+            else:
+                self._workers.submit(self._work, task, queue_name, raw_item)
+        except Exception:
+            logger.error(
+                f"Could not run update op for {task.instance_name}.", exc_info=True
+            )
+            self._requeue(queue_name, raw_item)
+            self._finish(task, queue_name, is_async)
+
+    def _requeue(self, queue_name: str, raw_item: bytes) -> None:
+        """Puts an item that was popped but not run back at the front of its
+        queue."""
+        try:
+            self._redis_con.lpush(queue_name, raw_item)
+        except redis.exceptions.RedisError:
+            logger.error(
+                f"Could not put an update item back on {queue_name}. "
+                + "The item is lost.",
+                exc_info=True,
+            )
+
+    def _work(self, task: BaseUpdateTask, queue_name: str, raw_item: bytes) -> None:
+        try:
+            task.process(self._redis_con, queue_name, cloudpickle.loads(raw_item))
+        except Exception:
+            logger.error(
+                f"Error running update op for {task.instance_name}.", exc_info=True
+            )
+        finally:
+            self._finish(task, queue_name, is_async=False)
+
+    async def _awork(
+        self, task: BaseUpdateTask, queue_name: str, raw_item: bytes
+    ) -> None:
+        try:
+            await task.aprocess(
+                self._redis_con, queue_name, cloudpickle.loads(raw_item)
+            )
+        except Exception:
+            logger.error(
+                f"Error running update op for {task.instance_name}.", exc_info=True
+            )
+        finally:
+            self._finish(task, queue_name, is_async=True)
+
+    def _finish(self, task: BaseUpdateTask, queue_name: str, is_async: bool) -> None:
+        with self._cond:
+            self._in_flight.discard(queue_name)
+            self._exclusive.discard(task.instance_name)
+            self._num_in_flight[task.instance_name] -= 1
+            if not self._num_in_flight[task.instance_name]:
+                del self._num_in_flight[task.instance_name]
+            if is_async:
+                self._free_async += 1
+            else:
+                self._free_workers += 1
+            self._wake()
+
+
+_pools: Dict[Tuple[Tuple[str, Any], ...], UpdateWorkerPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_update_pool(
+    redis_params: Dict[str, Any], num_workers: Optional[int] = None
+) -> UpdateWorkerPool:
+    """Gets the process-wide update pool for a Redis backend, creating it
+    on first use.
+
+    Args:
+        redis_params (Dict[str, Any]): Params of the Redis backend.
+        num_workers (Optional[int], optional): Number of worker threads.
+            Only used when creating the pool. Defaults to the
+            MOTION_UPDATE_POOL_SIZE env var, or 8 if it isn't set.
+
+    Returns:
+        UpdateWorkerPool: The update pool.
+    """
+    key = tuple(sorted((k, v) for k, v in redis_params.items() if v is not None))
+    with _pools_lock:
+        if key not in _pools:
+            if num_workers is None:
+                num_workers = int(
+                    os.getenv("MOTION_UPDATE_POOL_SIZE", str(DEFAULT_POOL_SIZE))
+                )
+            _pools[key] = UpdateWorkerPool(
+                {k: v for k, v in redis_params.items() if v is not None},
+                num_workers,
+            )
+        return _pools[key]
@@ -1,16 +1,195 @@
 import asyncio
+import contextlib
+import os
+import socket
 import time
 import traceback
 from multiprocessing import Process
-from threading import Thread
-from typing import Any, Callable, Dict, List, Optional
+from threading import Event, Lock, Thread
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+from uuid import uuid4
 
 import cloudpickle
 import redis
 import requests
 
-from motion.route import Route
-from motion.utils import FlowOpStatus, loadState, logger, saveState
+from motion.blobs import BlobStore
+from motion.compression import COMPRESSION_THRESHOLD, get_compressor
+from motion.dicts import State
+from motion.discard_policy import DiscardPolicy
+from motion.route import (
+    Route,
+    check_writes,
+    get_batch_size,
+    get_merge,
+    get_reads,
+    get_update_props,
+    get_writes,
+)
+from motion.serializers import Serializer
+from motion.server.update_loop import get_update_loop
+from motion.utils import (
+    MAX_COMMIT_ATTEMPTS,
+    FlowOpStatus,
+    compressionMetrics,
+    getHookFields,
+    loadState,
+    loadStateFields,
+    logger,
+    saveState,
+    saveStateFields,
+    waitAfterConflict,
+)
+
+# How long an idle update task blocks waiting for items. The task is woken
+# up by an item on its control queue to shut down, so this only bounds how
+# long it takes to notice a lost shutdown signal
+IDLE_BLOCK_SECONDS = 30.0
+
+
+def get_block_timeout(redis_params: Dict[str, Any]) -> float:
+    """How long to block waiting for update items without tripping the
+    socket timeout."""
+    block_timeout = IDLE_BLOCK_SECONDS
+    socket_timeout = redis_params.get("socket_timeout")
+    if socket_timeout:
+        block_timeout = min(block_timeout, max(socket_timeout / 2, 0.01))
+    return block_timeout
+
+
+# Consumer group that update tasks read update streams with
+STREAM_GROUP = "motion"
+# Stream entries that a consumer hasn't acknowledged after this long are
+# claimed by another consumer, e.g., if the consumer crashed mid-update.
+# Consumers reset the idle time of the entries they are processing every
+# STREAM_HEARTBEAT_INTERVAL, so an update op that is still running isn't
+# run twice however long it takes
+STREAM_CLAIM_IDLE_MS = 150000
+# How often to look for stream entries to claim (seconds)
+STREAM_CLAIM_INTERVAL = 30.0
+# How often a consumer resets the idle time of the entries it is
+# processing and the expiry of its control stream (seconds)
+STREAM_HEARTBEAT_INTERVAL = 30.0
+# Control streams expire after this long without a heartbeat, so those of
+# crashed consumers don't pile up (seconds)
+CONTROL_STREAM_TTL = 300
+
+T = TypeVar("T")
+
+# Processing an item is written as a generator that yields the awaitables
+# of async update ops and is sent their results, so it can either block on
+# them (`runSteps`) or await them on the update loop without holding a
+# thread (`arunSteps`)
+Steps = Generator[Awaitable[Any], Any, T]
+
+
+def runSteps(steps: Steps[T]) -> T:
+    """Runs the steps, blocking on each awaitable on the update loop."""
+    try:
+        awaitable = next(steps)
+        while True:
+            try:
+                result = get_update_loop().run(awaitable)  # type: ignore
+            except Exception as e:
+                awaitable = steps.throw(e)
+            else:
+                awaitable = steps.send(result)
+    except StopIteration as stop:
+        return stop.value  # type: ignore
+
+
+def _advance(
+    steps: Steps[Any], result: Any, error: Optional[Exception]
+) -> Tuple[bool, Any]:
+    # StopIteration can't be raised through a future, so it's returned
+    try:
+        if error is not None:
+            return False, steps.throw(error)
+        return False, steps.send(result)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+async def arunSteps(steps: Steps[T]) -> T:
+    """Runs the steps on the running loop. The code between awaitables,
+    which blocks on Redis, runs in a thread."""
+    result: Any = None
+    error: Optional[Exception] = None
+    while True:
+        done, value = await asyncio.to_thread(_advance, steps, result, error)
+        if done:
+            return value  # type: ignore
+        try:
+            result, error = await value, None
+        except Exception as e:
+            result, error = None, e
+
+
+class _StreamHeartbeat(Thread):
+    """Resets the idle time of the stream entries a consumer is processing,
+    so other consumers don't claim them while a long update op runs, and
+    keeps the consumer's control stream from expiring while it is alive."""
+
+    def __init__(
+        self, redis_con: redis.Redis, consumer: str, control_stream: str
+    ) -> None:
+        super().__init__()
+        self.name = f"StreamHeartbeat-{consumer}"
+        self.daemon = True
+
+        self.redis_con = redis_con
+        self.consumer = consumer
+        self.control_stream = control_stream
+
+        self._entries: Optional[Tuple[str, List[bytes]]] = None
+        self._lock = Lock()
+        self.stop_event = Event()
+
+    def track(self, stream: str, entry_ids: List[bytes]) -> None:
+        """Sets the entries being processed."""
+        with self._lock:
+            self._entries = (stream, entry_ids) if entry_ids else None
+
+    def untrack(self) -> None:
+        with self._lock:
+            self._entries = None
+
+    def beat(self) -> None:
+        with self._lock:
+            entries = self._entries
+        pipeline = self.redis_con.pipeline(transaction=False)
+        if entries is not None:
+            # Claiming our own entries resets their idle time
+            stream, entry_ids = entries
+            pipeline.xclaim(
+                stream, STREAM_GROUP, self.consumer, 0, entry_ids, justid=True
+            )
+        pipeline.expire(self.control_stream, CONTROL_STREAM_TTL)
+        pipeline.execute()
+
+    def run(self) -> None:
+        while not self.stop_event.wait(STREAM_HEARTBEAT_INTERVAL):
+            try:
+                self.beat()
+            except redis.exceptions.RedisError:
+                logger.warning(
+                    f"Could not send heartbeat for {self.consumer}.", exc_info=True
+                )
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
 
 
 class BaseUpdateTask:
@@ -26,7 +205,15 @@ class BaseUpdateTask:
         lock_identifier: str,
         redis_params: Dict[str, Any],
         running: Any,
+        control_queue: str,
         victoria_metrics_url: Optional[str] = None,
+        queue_backend: str = "list",
+        state_layout: str = "blob",
+        concurrency: str = "lock",
+        serializer: Optional[Serializer] = None,
+        compression: Optional[str] = None,
+        compression_threshold: int = COMPRESSION_THRESHOLD,
+        blob_store: Optional[BlobStore] = None,
     ):
         super().__init__()
         self.task_type = task_type
@@ -42,8 +229,20 @@ class BaseUpdateTask:
 
         self.routes = routes
         self.queue_identifiers = queue_identifiers
+        self.control_queue = control_queue
         self.channel_identifiers = channel_identifiers
         self.lock_identifier = lock_identifier
+        self.queue_backend = queue_backend
+        self.state_layout = state_layout
+        self.concurrency = concurrency
+        self.serializer = serializer
+        self.compressor = get_compressor(compression, compression_threshold)
+        self.blob_store = blob_store
+
+        # Copy of the state kept between batches with the hash layout, so
+        # only the fields that changed need to be fetched
+        self._cached_state: Optional[State] = None
+        self._cached_field_versions: Dict[str, int] = {}
 
         self.running = running
         self.daemon = True
@@ -72,8 +271,17 @@ class BaseUpdateTask:
             success_counter = f"motion_operation_success_count,component={self._component_name},instance={self._instance_id},flow={flow_key},op_type={op_type} value={1 if status_label == 'success' else 0} {timestamp}"  # noqa: E501
             failure_counter = f"motion_operation_failure_count,component={self._component_name},instance={self._instance_id},flow={flow_key},op_type={op_type} value={1 if status_label == 'failure' else 0} {timestamp}"  # noqa: E501
 
-            # Combine metrics into a single payload with newline character
-            payload = "\n".join([metric_data, success_counter, failure_counter])
+            # Combine metrics, and the compression stats gathered since the
+            # last call, into a single payload with newline character
+            metrics = [metric_data, success_counter, failure_counter]
+            metrics += compressionMetrics(
+                self.compressor,
+                self._component_name,
+                self._instance_id,
+                "update",
+                timestamp,
+            )
+            payload = "\n".join(metrics)
 
             try:
                 # Send HTTP POST request with the combined metric data
@@ -84,16 +292,142 @@ class BaseUpdateTask:
             except requests.RequestException as e:
                 logger.error(f"Failed to send metric to VictoriaMetrics: {e}")
 
+    def _publish(
+        self, redis_con: redis.Redis, queue_name: str, identifier: str, exception: str
+    ) -> None:
+        redis_con.publish(
+            self.channel_identifiers[queue_name],
+            str(
+                {
+                    "identifier": identifier,
+                    "exception": exception,
+                }
+            ),
+        )
+
+    def _batchDone(self, items: List[Dict[str, Any]], batch_size: int) -> bool:
+        """Batches are done once they're full or a flush was requested."""
+        return len(items) >= batch_size or any(
+            item["identifier"].startswith("NOOP_") for item in items
+        )
+
+    def _drainBatch(
+        self, redis_con: redis.Redis, queue_name: str, first_item: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        """Pops up to batch_size - 1 more items from the queue, waiting up to
+        max_wait_ms for them to arrive. Stops early if a flush is requested.
+        Update ops that coalesce their props take the whole queue."""
+        udf = self.routes[queue_name].udf
+        if get_merge(udf) is not None:
+            # Take everything queued in one go, so the update op runs once
+            # however many props piled up while it was busy
+            pipeline = redis_con.pipeline(transaction=True)
+            pipeline.lrange(queue_name, 0, -1)
+            pipeline.delete(queue_name)
+            raw_items, _ = pipeline.execute()
+            return [first_item] + [
+                cloudpickle.loads(raw_item) for raw_item in raw_items
+            ]
+
+        batch_size = get_batch_size(udf)
+        max_wait = getattr(udf, "_max_wait_ms", 0) / 1000
+
+        items = [first_item]
+        deadline = time.monotonic() + max_wait
+        while not self._batchDone(items, batch_size):
+            # Take what is already queued. Pop the items atomically so a
+            # producer trimming the queue can't interleave
+            num_items = batch_size - len(items)
+            pipeline = redis_con.pipeline(transaction=True)
+            pipeline.lrange(queue_name, 0, num_items - 1)
+            pipeline.ltrim(queue_name, num_items, -1)
+            raw_items, _ = pipeline.execute()
+            items.extend(cloudpickle.loads(raw_item) for raw_item in raw_items)
+            if self._batchDone(items, batch_size):
+                break
+
+            # Then block until the next item arrives or the deadline passes.
+            # Redis rounds timeouts to milliseconds, and a timeout of 0
+            # blocks forever
+            remaining = deadline - time.monotonic()
+            if remaining < 0.001 or not self.running.value:
+                break
+            popped = redis_con.blpop(
+                [queue_name],
+                timeout=min(remaining, get_block_timeout(self.redis_params)),
+            )
+            if popped is not None:
+                items.append(cloudpickle.loads(popped[1]))
+
+        return items
+
+    def process(
+        self, redis_con: redis.Redis, queue_name: str, item: Dict[str, Any]
+    ) -> None:
+        """Runs the update op for an item popped from `queue_name`, along
+        with any items batched with it, and notifies their waiters."""
+        runSteps(self._processSteps(redis_con, queue_name, item))
+
+    async def aprocess(
+        self, redis_con: redis.Redis, queue_name: str, item: Dict[str, Any]
+    ) -> None:
+        """Async version of `process`, which awaits async update ops on the
+        running loop rather than blocking a thread on them."""
+        await arunSteps(self._processSteps(redis_con, queue_name, item))
+
+    def _processSteps(
+        self, redis_con: redis.Redis, queue_name: str, item: Dict[str, Any]
+    ) -> Steps[None]:
+        yield from self._processItems(
+            redis_con, queue_name, self._drainBatch(redis_con, queue_name, item)
+        )
+
+    def _processItems(
+        self, redis_con: redis.Redis, queue_name: str, items: List[Dict[str, Any]]
+    ) -> Steps[None]:
+        # Set aside no ops and drop items whose expire_at has passed
+        batch: List[Dict[str, Any]] = []
+        noop_identifiers: List[str] = []
+        redis_time: Optional[int] = None
+        for item in items:
+            if item["identifier"].startswith("NOOP_"):
+                noop_identifiers.append(item["identifier"])
+                continue
+
+            expire_at = item.get("expire_at")
+            if expire_at is not None:
+                if redis_time is None:
+                    redis_time = redis_con.time()[0]
+                if expire_at < redis_time:
+                    self._publish(redis_con, queue_name, item["identifier"], "Expired")
+                    continue
+
+            batch.append(item)
+
+        if batch:
+            yield from self._runBatch(redis_con, queue_name, batch)
+
+        # Acknowledge no ops after the batch, so anyone flushing sees
+        # the updates that were queued before the no op
+        for identifier in noop_identifiers:
+            self._publish(redis_con, queue_name, identifier, "")
+
     def custom_run(self) -> None:
+        if self.queue_backend == "stream":
+            self._streamRun()
+            return
+
         try:
             redis_con = redis.Redis(**self.redis_params)
 
+            # The control queue goes last so that queued items are still
+            # picked up before a shutdown
+            block_timeout = get_block_timeout(self.redis_params)
+            blpop_keys = self.queue_identifiers + [self.control_queue]
+
             while self.running.value:
-                item: Dict[str, Any] = {}
-                queue_name = ""
                 try:
-                    # for _ in range(self.batch_size):
-                    full_item = redis_con.blpop(self.queue_identifiers, timeout=0.01)
+                    full_item = redis_con.blpop(blpop_keys, timeout=block_timeout)
                     if full_item is None:
                         if not self.running.value:
                             break  # no more items in the list
@@ -101,129 +435,456 @@ class BaseUpdateTask:
                             continue
 
                     queue_name = full_item[0].decode("utf-8")
-                    item = cloudpickle.loads(full_item[1])
-                    # self.batch.append(item)
-                    # if flush_update:
-                    #     break
+                    if queue_name == self.control_queue:
+                        # Woken up to shut down
+                        continue
+
+                    self.process(redis_con, queue_name, cloudpickle.loads(full_item[1]))
                 except redis.exceptions.ConnectionError:
                     logger.error("Connection to redis lost.", exc_info=True)
                     break
 
-                # Check if we should stop
-                if not self.running.value and not item:
-                    # self.cleanup()
-                    break
+        finally:
+            redis_con.close()
+
+    def _logLag(self, queue_name: str, lags: List[float]) -> None:
+        """Logs how long stream entries waited before being processed."""
+        if self.victoria_metrics_url and lags:
+            timestamp = int(time.time() * 1000000000)
+            flow_key = queue_name.split("/")[-2]
+            udf_name = queue_name.split("/")[-1]
+            payload = "\n".join(
+                [
+                    f"motion_update_queue_lag_seconds,component={self._component_name},instance={self._instance_id},flow={flow_key},udf={udf_name} value={lag} {timestamp}"  # noqa: E501
+                    for lag in lags
+                ]
+            )
+            try:
+                response = requests.post(
+                    self.victoria_metrics_url + "/write", data=payload
+                )
+                response.raise_for_status()
+            except requests.RequestException as e:
+                logger.error(f"Failed to send metric to VictoriaMetrics: {e}")
+
+    def _processStreamEntries(
+        self,
+        redis_con: redis.Redis,
+        stream: str,
+        consumer: str,
+        entries: List[Tuple[bytes, Optional[Dict[bytes, bytes]]]],
+        heartbeat: _StreamHeartbeat,
+    ) -> None:
+        """Runs the update op on stream entries read by this consumer, then
+        acknowledges and deletes them."""
+        udf = self.routes[stream].udf
+        batch_size = get_batch_size(udf)
+
+        def has_noop(entries: List[Any]) -> bool:
+            return any(fields and fields.get(b"noop") == b"1" for _, fields in entries)
+
+        # Wait up to max_wait_ms for the batch to fill up
+        max_wait = getattr(udf, "_max_wait_ms", 0) / 1000
+        deadline = time.monotonic() + max_wait
+        while len(entries) < batch_size and not has_noop(entries):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.running.value:
+                break
+            response = redis_con.xreadgroup(
+                STREAM_GROUP,
+                consumer,
+                {stream: ">"},
+                count=batch_size - len(entries),
+                block=max(int(remaining * 1000), 1),
+            )
+            if response:
+                entries = entries + response[0][1]
+
+        if get_merge(udf) is not None:
+            # Take everything queued in one go, so the update op runs once
+            # however many props piled up while it was busy
+            response = redis_con.xreadgroup(STREAM_GROUP, consumer, {stream: ">"})
+            if response:
+                entries = entries + response[0][1]
+            batch_size = max(len(entries), 1)
+
+        # Stream IDs start with the time (ms) Redis added the entry, so the
+        # SECONDS discard policy and the lag can be computed from them
+        seconds, microseconds = redis_con.time()
+        now_ms = seconds * 1000 + microseconds // 1000
+        discard_after = (
+            udf._discard_after  # type: ignore
+            if getattr(udf, "_discard_policy", None) == DiscardPolicy.SECONDS
+            else None
+        )
+
+        items: List[Dict[str, Any]] = []
+        lags: List[float] = []
+        for entry_id, fields in entries:
+            # Entries trimmed from the stream while pending have no fields
+            if not fields:
+                continue
+
+            item = cloudpickle.loads(fields[b"item"])
+            enqueued_ms = int(entry_id.split(b"-")[0])
+            lags.append(max(now_ms - enqueued_ms, 0) / 1000)
+            if discard_after is not None:
+                item["expire_at"] = enqueued_ms / 1000 + discard_after
+            items.append(item)
+
+        entry_ids = [entry_id for entry_id, _ in entries]
+        heartbeat.track(stream, entry_ids)
+        try:
+            for i in range(0, len(items), batch_size):
+                runSteps(
+                    self._processItems(redis_con, stream, items[i : i + batch_size])
+                )
+        finally:
+            heartbeat.untrack()
+
+        if entry_ids:
+            pipeline = redis_con.pipeline(transaction=True)
+            pipeline.xack(stream, STREAM_GROUP, *entry_ids)
+            pipeline.xdel(stream, *entry_ids)
+            pipeline.execute()
+
+        self._logLag(stream, lags)
 
-                # if not self.batch:
-                #     continue
-
-                exception_str = ""
-                # Check if it was a no op
-                if item["identifier"].startswith("NOOP_"):
-                    redis_con.publish(
-                        self.channel_identifiers[queue_name],
-                        str(
-                            {
-                                "identifier": item["identifier"],
-                                "exception": exception_str,
-                            }
-                        ),
+    def _claimStreamEntries(
+        self,
+        redis_con: redis.Redis,
+        consumer: str,
+        count: int,
+        heartbeat: _StreamHeartbeat,
+    ) -> None:
+        """Takes over entries that other consumers read but never
+        acknowledged, e.g., because they crashed, and processes them."""
+        for stream in self.queue_identifiers:
+            start_id: Any = "0-0"
+            while True:
+                start_id, entries, *_ = redis_con.xautoclaim(
+                    stream,
+                    STREAM_GROUP,
+                    consumer,
+                    STREAM_CLAIM_IDLE_MS,
+                    start_id=start_id,
+                    count=count,
+                )
+                if entries:
+                    logger.warning(
+                        f"Claimed {len(entries)} unacknowledged updates from {stream}."
                     )
-                    continue
+                    self._processStreamEntries(
+                        redis_con, stream, consumer, entries, heartbeat
+                    )
+                if start_id in (b"0-0", "0-0"):
+                    break
 
-                # Check if item.get("expire_at") has passed
-                expire_at = item.get("expire_at")
-                if expire_at is not None:
-                    if expire_at < redis_con.time()[0]:
-                        redis_con.publish(
-                            self.channel_identifiers[queue_name],
-                            str(
-                                {
-                                    "identifier": item["identifier"],
-                                    "exception": "Expired",
-                                }
-                            ),
-                        )
-                        continue
+    def _createStreamGroups(self, redis_con: redis.Redis, streams: List[str]) -> None:
+        """Creates the consumer group on the streams if they don't have it,
+        and sets the control stream to expire unless kept alive."""
+        for stream in streams:
+            try:
+                redis_con.xgroup_create(stream, STREAM_GROUP, id="0", mkstream=True)
+            except redis.exceptions.ResponseError as e:
+                # The group already exists
+                if "BUSYGROUP" not in str(e):
+                    raise
+        redis_con.expire(self.control_queue, CONTROL_STREAM_TTL)
+
+    def _streamRun(self) -> None:
+        heartbeat: Optional[_StreamHeartbeat] = None
+        try:
+            redis_con = redis.Redis(**self.redis_params)
 
-                # Run update op
+            consumer = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+            streams = self.queue_identifiers + [self.control_queue]
+            self._createStreamGroups(redis_con, streams)
+            heartbeat = _StreamHeartbeat(redis_con, consumer, self.control_queue)
+            heartbeat.start()
+
+            block_ms = int(get_block_timeout(self.redis_params) * 1000)
+            count = max(get_batch_size(route.udf) for route in self.routes.values())
+            last_claim = 0.0
+
+            while self.running.value:
                 try:
-                    start_time = time.time()
-                    with redis_con.lock(self.lock_identifier, timeout=120):
-                        old_state, version = loadState(
-                            redis_con,
-                            self.instance_name,
-                            self.load_state_func,
-                        )
-                        if old_state is None:
-                            # Create new state
-                            # If state does not exist, run setUp
-                            raise ValueError(
-                                f"State for {self.instance_name} not found."
+                    if time.monotonic() - last_claim > STREAM_CLAIM_INTERVAL:
+                        last_claim = time.monotonic()
+                        self._claimStreamEntries(redis_con, consumer, count, heartbeat)
+
+                    response = redis_con.xreadgroup(
+                        STREAM_GROUP,
+                        consumer,
+                        {stream: ">" for stream in streams},
+                        count=count,
+                        block=block_ms,
+                    )
+                    for stream_name, entries in response or []:
+                        stream = stream_name.decode("utf-8")
+                        if stream == self.control_queue:
+                            # Woken up to shut down
+                            redis_con.xack(
+                                stream, STREAM_GROUP, *[e[0] for e in entries]
                             )
+                            continue
 
-                        state_update = self.routes[queue_name].run(
-                            state=old_state,
-                            props=item["props"],
+                        self._processStreamEntries(
+                            redis_con, stream, consumer, entries, heartbeat
                         )
-                        # Await if state_update is a coroutine
-                        if asyncio.iscoroutine(state_update):
-                            state_update = asyncio.run(state_update)
-
-                        if not isinstance(state_update, dict):
-                            logger.error(
-                                "Update methods should return a dict of state updates.",
-                                exc_info=True,
-                            )
-                        else:
-                            old_state.update(state_update)
-                            saveState(
-                                old_state,
-                                version,
-                                redis_con,
-                                self.instance_name,
-                                self.save_state_func,
-                            )
 
-                except Exception:
-                    logger.error(traceback.format_exc())
-                    exception_str = str(traceback.format_exc())
+                except redis.exceptions.ConnectionError:
+                    logger.error("Connection to redis lost.", exc_info=True)
+                    break
+                except redis.exceptions.ResponseError as e:
+                    # A stream was deleted, e.g., the control stream expired
+                    # while the process was suspended
+                    if "NOGROUP" not in str(e):
+                        raise
+                    self._createStreamGroups(redis_con, streams)
 
-                duration = time.time() - start_time
+        finally:
+            if heartbeat is not None:
+                heartbeat.stop()
+            redis_con.close()
 
-                redis_con.publish(
-                    self.channel_identifiers[queue_name],
-                    str(
-                        {
-                            "identifier": item["identifier"],
-                            "exception": exception_str,
-                        }
-                    ),
+    def _stateLock(self, redis_con: redis.Redis, writes: Optional[List[str]]) -> Any:
+        """Locks the keys an update op writes, or the whole instance if it
+        didn't declare them. Nothing is locked with optimistic concurrency."""
+        stack = contextlib.ExitStack()
+        if self.concurrency == "optimistic":
+            return stack
+
+        # Async update ops may release the lock from another thread than
+        # the one that took it
+        if writes is None:
+            stack.enter_context(
+                redis_con.lock(self.lock_identifier, timeout=120, thread_local=False)
+            )
+        else:
+            # Take the locks in the same order everywhere to avoid deadlocks
+            for key in sorted(writes):
+                stack.enter_context(
+                    redis_con.lock(
+                        f"{self.lock_identifier}/{key}",
+                        timeout=120,
+                        thread_local=False,
+                    )
                 )
-
-                # Log to VictoriaMetrics
-                if self.victoria_metrics_url:
-                    try:
-                        flow_key = queue_name.split("/")[-2]
-                        udf_name = queue_name.split("/")[-1]
-                        self._logMessage(
-                            flow_key,
-                            "update",
-                            (
-                                FlowOpStatus.SUCCESS
-                                if not exception_str
-                                else FlowOpStatus.FAILURE
-                            ),
-                            duration,
-                            udf_name,
+        return stack
+
+    def _applyKeyedUpdate(
+        self, redis_con: redis.Redis, route: Route, props: Any
+    ) -> Steps[bool]:
+        """Runs an update op that declared the keys it reads and writes,
+        loading only those keys, and commits its update if none of them
+        changed since they were loaded.
+
+        Returns:
+            bool: Whether the state update was committed.
+        """
+        writes = get_writes(route.udf) or []
+        keys = list(dict.fromkeys(writes + get_reads(route.udf)))
+
+        # Other update ops of the instance may be running in parallel, so
+        # this doesn't use the cached state
+        state, _, field_versions = loadStateFields(
+            redis_con,
+            self.instance_name,
+            load_state_func=self.load_state_func,
+            lazy=True,
+            serializer=self.serializer,
+            compressor=self.compressor,
+            blob_store=self.blob_store,
+        )
+        if state is None:
+            raise ValueError(f"State for {self.instance_name} not found.")
+        state.load(keys)
+
+        state_update = route.run(state=state, props=props)
+        if asyncio.iscoroutine(state_update):
+            state_update = yield state_update
+
+        if not isinstance(state_update, dict):
+            logger.error(
+                "Update methods should return a dict of state updates.",
+                exc_info=True,
+            )
+            return True
+
+        check_writes(route.udf, state_update)
+
+        new_version = saveStateFields(
+            state_update,
+            0,
+            redis_con,
+            self.instance_name,
+            field_versions={key: field_versions.get(key, 0) for key in keys},
+            serializer=self.serializer,
+            compressor=self.compressor,
+            blob_store=self.blob_store,
+        )
+        return new_version != -1
+
+    def _applyUpdate(
+        self, redis_con: redis.Redis, route: Route, props: Any
+    ) -> Steps[bool]:
+        """Loads the state, runs the update op, and commits the state
+        update if no other writer committed since the state was loaded.
+
+        Returns:
+            bool: Whether the state update was committed.
+        """
+        old_state: Optional[State]
+        if self.state_layout == "hash":
+            (
+                old_state,
+                version,
+                self._cached_field_versions,
+            ) = loadStateFields(
+                redis_con,
+                self.instance_name,
+                self._cached_state,
+                self._cached_field_versions,
+                self.load_state_func,
+                serializer=self.serializer,
+                compressor=self.compressor,
+                blob_store=self.blob_store,
+            )
+            self._cached_state = old_state
+        else:
+            old_state, version = loadState(
+                redis_con,
+                self.instance_name,
+                self.load_state_func,
+                self.state_layout,
+                serializer=self.serializer,
+                compressor=self.compressor,
+                blob_store=self.blob_store,
+            )
+        if old_state is None:
+            # Create new state
+            # If state does not exist, run setUp
+            raise ValueError(f"State for {self.instance_name} not found.")
+
+        state_update = route.run(state=old_state, props=props)
+        # Await if state_update is a coroutine
+        if asyncio.iscoroutine(state_update):
+            state_update = yield state_update
+
+        if not isinstance(state_update, dict):
+            logger.error(
+                "Update methods should return a dict of state updates.",
+                exc_info=True,
+            )
+            return True
+
+        old_state.update(state_update)
+        if self.state_layout == "hash":
+            # Only write the keys the update op returned
+            new_version = saveStateFields(
+                state_update,
+                version,
+                redis_con,
+                self.instance_name,
+                serializer=self.serializer,
+                compressor=self.compressor,
+                blob_store=self.blob_store,
+            )
+            if new_version == -1:
+                self._cached_state = None
+                self._cached_field_versions = {}
+                return False
+
+            self._cached_field_versions.update(
+                {key: new_version for key in state_update}
+            )
+            # Rerun the load_state hook on the next load if the fields it
+            # transforms changed
+            hook_fields = getHookFields(self.load_state_func)
+            if any(key in hook_fields for key in state_update):
+                for key in hook_fields:
+                    self._cached_field_versions.pop(key, None)
+            return True
+
+        new_version = saveState(
+            old_state,
+            version,
+            redis_con,
+            self.instance_name,
+            self.save_state_func,
+            self.state_layout,
+            self.serializer,
+            self.compressor,
+            self.blob_store,
+        )
+        return new_version != -1
+
+    def _runBatch(
+        self, redis_con: redis.Redis, queue_name: str, batch: List[Dict[str, Any]]
+    ) -> Steps[None]:
+        """Runs the update op once for the batch, with one state load and
+        save, and notifies each item's waiters."""
+        route = self.routes[queue_name]
+
+        exception_str = ""
+        try:
+            start_time = time.time()
+            props = get_update_props(route.udf, [item["props"] for item in batch])
+            # Rerun the update op on the latest state until it commits.
+            # With locks, this only happens if a writer that doesn't take
+            # the same lock committed first.
+            writes = get_writes(route.udf)
+            for attempt in range(MAX_COMMIT_ATTEMPTS):
+                with self._stateLock(redis_con, writes):
+                    if writes is not None:
+                        committed = yield from self._applyKeyedUpdate(
+                            redis_con, route, props
                         )
-                    except Exception as e:
-                        logger.error(
-                            f"Error logging to VictoriaMetrics: {e}", exc_info=True
+                    else:
+                        committed = yield from self._applyUpdate(
+                            redis_con, route, props
                         )
+                if committed:
+                    break
+                waitAfterConflict(attempt)
+            else:
+                raise RuntimeError(
+                    f"Could not commit state for {self.instance_name} after "
+                    + f"{MAX_COMMIT_ATTEMPTS} attempts: other writers kept "
+                    + "committing first."
+                )
 
-        finally:
-            redis_con.close()
+        except Exception:
+            logger.error(traceback.format_exc())
+            exception_str = str(traceback.format_exc())
+            # The update op may have mutated the cached state
+            self._cached_state = None
+            self._cached_field_versions = {}
+
+        duration = time.time() - start_time
+
+        for item in batch:
+            self._publish(redis_con, queue_name, item["identifier"], exception_str)
+
+        # Log to VictoriaMetrics
+        if self.victoria_metrics_url:
+            try:
+                flow_key = queue_name.split("/")[-2]
+                udf_name = queue_name.split("/")[-1]
+                self._logMessage(
+                    flow_key,
+                    "update",
+                    (
+                        FlowOpStatus.SUCCESS
+                        if not exception_str
+                        else FlowOpStatus.FAILURE
+                    ),
+                    duration,
+                    udf_name,
+                )
+            except Exception as e:
+                logger.error(f"Error logging to VictoriaMetrics: {e}", exc_info=True)
 
 
 class UpdateProcess(Process):
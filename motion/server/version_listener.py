@@ -0,0 +1,97 @@
+import time
+from threading import Event, Thread
+from typing import Any, Dict, Optional
+
+import redis
+
+from motion.utils import logger
+
+
+class StateVersionListener(Thread):
+    """Subscribes to the channel that `saveState` publishes new state
+    versions to, so an executor can keep serving from its in-process
+    state until it hears about a newer version."""
+
+    def __init__(
+        self,
+        instance_name: str,
+        channel: str,
+        redis_params: Dict[str, Any],
+        max_staleness: float,
+    ) -> None:
+        super().__init__()
+        self.name = f"StateVersionListener-{instance_name}"
+        self.daemon = True
+
+        self.channel = channel
+        self.redis_params = redis_params
+        self.max_staleness = max_staleness
+
+        self.latest_version: Optional[int] = None
+        # Monotonic time at which the current subscription became active.
+        # None while we are not subscribed.
+        self.subscribed_at: Optional[float] = None
+        self.stop_event = Event()
+
+    def is_current(self, version: Optional[int], last_checked: float) -> bool:
+        """Whether a state at `version`, last checked against Redis at
+        `last_checked` (monotonic time), can be used without another
+        version lookup."""
+        subscribed_at = self.subscribed_at
+        if version is None or subscribed_at is None:
+            return False
+
+        # Anything published before the subscription was active could
+        # have been missed, so the last check must come after it
+        if last_checked < subscribed_at:
+            return False
+
+        if time.monotonic() - last_checked > self.max_staleness:
+            return False
+
+        latest_version = self.latest_version
+        return latest_version is None or latest_version <= version
+
+    def run(self) -> None:
+        backoff = 0.1
+        while not self.stop_event.is_set():
+            redis_con = redis.Redis(**self.redis_params)
+            pubsub = redis_con.pubsub()
+            try:
+                pubsub.subscribe(self.channel)
+                # Wait for Redis to confirm the subscription before trusting
+                # the cached state
+                while not self.stop_event.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None and message["type"] == "subscribe":
+                        break
+                self.subscribed_at = time.monotonic()
+                backoff = 0.1
+
+                while not self.stop_event.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None or message["type"] != "message":
+                        continue
+
+                    version = int(message["data"])
+                    if self.latest_version is None or version > self.latest_version:
+                        self.latest_version = version
+
+            except redis.exceptions.ConnectionError:
+                logger.warning(
+                    f"Lost subscription to {self.channel}. Falling back to "
+                    + "version lookups until it is restored.",
+                    exc_info=True,
+                )
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, 5.0)
+
+            finally:
+                self.subscribed_at = None
+                pubsub.close()
+                redis_con.close()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,236 @@
+import multiprocessing
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List
+
+import redis
+
+from motion.redis_scripts import FORGET_IDLE_INSTANCE, get_script
+from motion.route import Route
+from motion.server.update_pool import UpdateWorkerPool
+from motion.server.update_task import BaseUpdateTask
+from motion.utils import get_env_prefix, get_redis_params, get_worker_keys, logger
+
+if TYPE_CHECKING:
+    from motion.component import Component
+
+
+class UpdateWorker:
+    """Runs the update ops of every instance of a component that has
+    pending updates, no matter which process enqueued them. Start as many
+    workers as you like, on as many machines as you like; instances are
+    locked while their update ops run, just like with the update tasks that
+    instances start themselves.
+
+    Instances whose updates run on workers should be created with
+    `update_task_type="external"`. They add themselves to a set of
+    instances with updates and announce themselves on a pubsub channel
+    whenever they queue updates, so workers start running new instances'
+    updates right away and find instances that queued updates while no
+    worker was running.
+
+    Usage:
+    ```python
+    from motion.server.worker import UpdateWorker
+    from main import MyComponent
+
+    UpdateWorker(MyComponent, concurrency=4).run()
+    ```
+    """
+
+    def __init__(
+        self,
+        component: "Component",
+        concurrency: int = 4,
+        rescan_interval: float = 5.0,
+        idle_timeout: float = 300.0,
+    ) -> None:
+        """Creates a worker.
+
+        Args:
+            component (Component): Component to run update ops for.
+            concurrency (int, optional): Number of update ops to run at
+                once, across instances. Defaults to 4.
+            rescan_interval (float, optional): How often to check the
+                set of instances with updates, in case an announcement was
+                missed (seconds). Defaults to 5.
+            idle_timeout (float, optional): How long to keep watching an
+                instance's queues after they last had updates (seconds).
+                Defaults to 300.
+        """
+        self.component = component
+        self.rescan_interval = rescan_interval
+        self.idle_timeout = idle_timeout
+
+        env_prefix = get_env_prefix()
+        self._queue_prefix = f"MOTION_QUEUE:{env_prefix}"
+        self._channel_prefix = f"MOTION_CHANNEL:{env_prefix}"
+        self._lock_prefix = f"MOTION_LOCK:{env_prefix}"
+        self._instances_key, self._announce_channel = get_worker_keys(component.name)
+
+        self._redis_params = {
+            k: v for k, v in get_redis_params().dict().items() if v is not None
+        }
+        self._pool = UpdateWorkerPool(self._redis_params, concurrency)
+        self._redis_con = redis.Redis(**self._redis_params)
+
+        self._routes: Dict[str, Route] = {
+            f"{key}/{route.udf.__name__}": route
+            for key, routes in component._update_routes.items()
+            for route in routes
+        }
+        self._last_seen: Dict[str, float] = {}
+        # Tasks registered with the pool, by instance name
+        self._tasks: Dict[str, BaseUpdateTask] = {}
+        # Guards the watched instances, which the listener also updates
+        self._lock = threading.Lock()
+        self._running: Any = multiprocessing.Value("b", True)
+        self._stop_event = threading.Event()
+        # Set once the listener is subscribed to announcements
+        self._subscribed = threading.Event()
+
+    @property
+    def instances(self) -> Dict[str, float]:
+        """Names of the instances being watched, with the time their
+        queues were last seen."""
+        with self._lock:
+            return dict(self._last_seen)
+
+    def _queues(self, instance_name: str) -> List[str]:
+        return [f"{self._queue_prefix}{instance_name}/{name}" for name in self._routes]
+
+    def _makeTask(self, instance_name: str) -> BaseUpdateTask:
+        queue_prefix = f"{self._queue_prefix}{instance_name}"
+        channel_prefix = f"{self._channel_prefix}{instance_name}"
+        return BaseUpdateTask(
+            task_type="worker",
+            instance_name=instance_name,
+            routes={f"{queue_prefix}/{name}": r for name, r in self._routes.items()},
+            save_state_func=self.component._save_state_func,
+            load_state_func=self.component._load_state_func,
+            queue_identifiers=self._queues(instance_name),
+            channel_identifiers={
+                f"{queue_prefix}/{name}": f"{channel_prefix}/{name}"
+                for name in self._routes
+            },
+            lock_identifier=f"{self._lock_prefix}{instance_name}",
+            redis_params=self._redis_params,
+            running=self._running,
+            control_queue="",
+            victoria_metrics_url=os.getenv("MOTION_VICTORIAMETRICS_URL"),
+            state_layout=self.component._state_layout,
+            concurrency=self.component._concurrency,
+            serializer=self.component._serializer,
+            compression=self.component._compression,
+            compression_threshold=self.component._compression_threshold,
+            blob_store=self.component._blob_store,
+        )
+
+    def _watch(self, instance_name: str, now: float) -> None:
+        with self._lock:
+            if instance_name not in self._last_seen:
+                logger.info(f"Watching update queues of {instance_name}.")
+                self._tasks[instance_name] = self._makeTask(instance_name)
+                self._pool.register(self._tasks[instance_name])
+            self._last_seen[instance_name] = now
+
+    def scan(self) -> None:
+        """Starts watching the queues of instances with pending updates and
+        stops watching instances that have been idle for too long."""
+        now = time.monotonic()
+        instance_names = sorted(
+            name.decode("utf-8")
+            for name in self._redis_con.smembers(self._instances_key)
+        )
+
+        pipeline = self._redis_con.pipeline(transaction=False)
+        for instance_name in instance_names:
+            for queue in self._queues(instance_name):
+                pipeline.llen(queue)
+        lengths = pipeline.execute()
+
+        forget = get_script(self._redis_con, FORGET_IDLE_INSTANCE)
+        for i, instance_name in enumerate(instance_names):
+            queued = lengths[i * len(self._routes) : (i + 1) * len(self._routes)]
+            if any(queued):
+                self._watch(instance_name, now)
+                continue
+
+            with self._lock:
+                last_seen = self._last_seen.get(instance_name)
+            if last_seen is not None and now - last_seen <= self.idle_timeout:
+                continue
+
+            # Instances leave the set once their queues are empty, unless
+            # they queue updates in the meantime
+            forgotten = forget(
+                keys=[self._instances_key] + self._queues(instance_name),
+                args=[instance_name],
+            )
+            if not forgotten:
+                self._watch(instance_name, now)
+
+        # Instances other workers removed from the set
+        idle: List[BaseUpdateTask] = []
+        with self._lock:
+            for instance_name, last_seen in list(self._last_seen.items()):
+                if now - last_seen > self.idle_timeout:
+                    logger.info(f"Done watching update queues of {instance_name}.")
+                    idle.append(self._tasks.pop(instance_name))
+                    del self._last_seen[instance_name]
+
+        # Deregistering waits for the instances' in-flight update ops, so
+        # it's done without the lock to keep picking up announcements
+        for task in idle:
+            self._pool.deregister(task)
+
+    def _listen(self) -> None:
+        """Watches instances as they announce that they queued updates."""
+        backoff = 0.1
+        while not self._stop_event.is_set():
+            pubsub = self._redis_con.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self._announce_channel)
+                self._subscribed.set()
+                backoff = 0.1
+                while not self._stop_event.is_set():
+                    message = pubsub.get_message(timeout=0.5)
+                    if message is not None:
+                        self._watch(message["data"].decode("utf-8"), time.monotonic())
+            except redis.RedisError:
+                logger.error("Error listening for update announcements.", exc_info=True)
+                self._subscribed.clear()
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.rescan_interval)
+            finally:
+                pubsub.close()
+
+    def run(self) -> None:
+        """Runs update ops until `stop` is called."""
+        if not self._routes:
+            raise ValueError(f"Component {self.component.name} has no update ops.")
+
+        listener = threading.Thread(target=self._listen, daemon=True)
+        listener.start()
+
+        while not self._stop_event.is_set():
+            try:
+                self.scan()
+            except Exception:
+                logger.error("Error scanning for update queues.", exc_info=True)
+            self._stop_event.wait(self.rescan_interval)
+
+        listener.join()
+
+        # Let in-flight update ops finish
+        with self._lock:
+            tasks = list(self._tasks.values())
+            self._tasks.clear()
+            self._last_seen.clear()
+        for task in tasks:
+            self._pool.deregister(task)
+
+    def stop(self) -> None:
+        """Stops the worker after its in-flight update ops finish."""
+        self._stop_event.set()
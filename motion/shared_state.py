@@ -0,0 +1,178 @@
+"""
+This file contains the host-local cache that lets processes on the same
+host share one copy of an instance's state.
+"""
+
+import logging
+import mmap
+import os
+import shutil
+import uuid
+from typing import Any, Dict, List, Optional
+
+import redis
+
+from motion.serializers import Pickle5Serializer
+
+logger = logging.getLogger(__name__)
+
+# /dev/shm is backed by memory on Linux, so files there never hit the disk
+DEFAULT_SHARED_STATE_DIR = (
+    os.path.join("/dev/shm", "motion")
+    if os.path.isdir("/dev/shm")
+    else os.path.join(os.path.expanduser("~"), ".motion", "shm")
+)
+
+
+def _epoch_key(instance_name: str) -> str:
+    # motion.utils imports this module, so import from it here
+    from motion.utils import get_env_prefix
+
+    return f"MOTION_SHARED_STATE_EPOCH:{get_env_prefix()}{instance_name}"
+
+
+def _shared_state_dir(directory: Optional[str] = None) -> str:
+    if directory is None:
+        directory = os.getenv("MOTION_SHARED_STATE_DIR", DEFAULT_SHARED_STATE_DIR)
+    return directory
+
+
+def _is_private(path: str) -> bool:
+    """Whether a file or directory belongs to this user, and only this user
+    can write to it, so no one else could have written a pickle there."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if not hasattr(os, "getuid"):
+        return True
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+class SharedStateCache:
+    """Shares loaded state between the processes on a host, e.g., the
+    workers of an `Application` served by uvicorn or gunicorn.
+
+    The first process to load a state version writes it to a memory-mapped
+    file, pickled with protocol 5 so that array buffers are stored raw.
+    Other processes map the file instead of fetching and unpickling the
+    state, and their numpy, pandas, and Arrow values are read-only views
+    into the shared pages rather than copies.
+
+    Files are named by instance and version. When a newer version is
+    written, the files of older versions are unlinked. Processes that
+    still map an older version keep reading it, and the operating system
+    frees its pages once the last of them drops it, so the kernel does the
+    reference counting. Files are also scoped to an epoch stored in Redis,
+    which `clear_instance` deletes, so a cleared instance whose versions
+    start over never maps files left by its previous incarnation.
+
+    Directories are created readable only by the user running the
+    processes, and files are only mapped if that user owns them and their
+    directory, since mapping a file unpickles it.
+    """
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        self.directory = _shared_state_dir(directory)
+        self._serializer = Pickle5Serializer(readonly=True)
+
+    def _instanceDir(self, instance_name: str) -> str:
+        from motion.utils import get_env_prefix
+
+        return os.path.join(self.directory, get_env_prefix().rstrip(":"), instance_name)
+
+    def attach(
+        self, redis_con: redis.Redis, instance_name: str, version: int
+    ) -> Optional[Dict[str, Any]]:
+        """Maps a state version another process on the host loaded.
+
+        Returns:
+            Optional[Dict[str, Any]]: The state as stored (before any
+            load_state hook), or None if no process has shared it.
+        """
+        epoch = redis_con.get(_epoch_key(instance_name))
+        if epoch is None:
+            return None
+
+        epoch_dir = os.path.join(
+            self._instanceDir(instance_name), epoch.decode("utf-8")
+        )
+        path = os.path.join(epoch_dir, str(version))
+        if not _is_private(epoch_dir) or not _is_private(path):
+            # Not shared yet, or written by another user
+            return None
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # Not shared yet, or unlinked after a newer version was shared
+            return None
+
+        return self._serializer.loads(buffer)  # type: ignore
+
+    def publish(
+        self,
+        redis_con: redis.Redis,
+        instance_name: str,
+        version: int,
+        state: Dict[str, Any],
+    ) -> None:
+        """Shares a state version with the other processes on the host, and
+        unlinks the files of older versions."""
+        redis_con.set(_epoch_key(instance_name), uuid.uuid4().hex, nx=True)
+        epoch = redis_con.get(_epoch_key(instance_name))
+        if epoch is None:
+            return
+        instance_dir = self._instanceDir(instance_name)
+        epoch_dir = os.path.join(instance_dir, epoch.decode("utf-8"))
+        os.makedirs(instance_dir, mode=0o700, exist_ok=True)
+        os.makedirs(epoch_dir, mode=0o700, exist_ok=True)
+        if not _is_private(epoch_dir):
+            logger.warning(
+                f"Not sharing the state of {instance_name}, since {epoch_dir} "
+                + "belongs to or can be written by another user."
+            )
+            return
+
+        try:
+            data = self._serializer.dumps(dict(state))
+        except Exception:
+            logger.debug(
+                f"Could not share the state of {instance_name}.", exc_info=True
+            )
+            return
+
+        path = os.path.join(epoch_dir, str(version))
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        # Processes mapping older versions keep their pages until they
+        # drop them
+        for name in os.listdir(epoch_dir):
+            if name.isdigit() and int(name) < version:
+                try:
+                    os.remove(os.path.join(epoch_dir, name))
+                except FileNotFoundError:
+                    pass
+        # Files of previous incarnations of the instance are never mapped
+        # again
+        for name in os.listdir(instance_dir):
+            if name != epoch.decode("utf-8"):
+                shutil.rmtree(os.path.join(instance_dir, name), ignore_errors=True)
+
+
+def clear_shared_state(
+    redis_con: redis.Redis, instance_names: List[str], directory: Optional[str] = None
+) -> None:
+    """Deletes the files instances shared on this host, and the epochs that
+    scope them, so that no process maps them again."""
+    directory = _shared_state_dir(directory)
+    for instance_name in instance_names:
+        for prefix in ["", "DEV:"]:
+            redis_con.delete(f"MOTION_SHARED_STATE_EPOCH:{prefix}{instance_name}")
+            shutil.rmtree(
+                os.path.join(directory, prefix.rstrip(":"), instance_name),
+                ignore_errors=True,
+            )
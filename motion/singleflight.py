@@ -0,0 +1,231 @@
+"""
+This file contains request coalescing for serve ops: concurrent calls of a
+serve op on the same props in a process wait for one execution of it,
+rather than each running it.
+"""
+
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+# How long calls wait between checks for a serve result another process
+# holds the lease on, doubling up to the maximum
+LEASE_POLL_INTERVAL = 0.005
+MAX_LEASE_POLL_INTERVAL = 0.1
+
+
+class FlightAbandoned(RuntimeError):
+    """Raised when the call running a serve op stopped before it finished,
+    with no other calls waiting on it."""
+
+
+class Flight:
+    """One execution of a serve op that other calls with the same props
+    wait on. Items yielded by generator serve ops are published as they
+    come, so waiting calls stream them too.
+
+    Waiting calls may run in other threads or on other event loops than
+    the call running the serve op.
+    """
+
+    def __init__(self, group: "SingleFlight", key: str) -> None:
+        self.key = key
+        # Number of calls waiting on the flight, besides the one running it
+        self.followers = 0
+        self._group = group
+        self._cond = threading.Condition()
+        self._items: List[Any] = []
+        self._done = False
+        self._result: Optional[Tuple[Any, Dict[str, Any]]] = None
+        self._error: Optional[BaseException] = None
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def _notify(self) -> None:
+        # Must hold self._cond
+        self._cond.notify_all()
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiter's loop was closed
+                pass
+        self._waiters.clear()
+
+    def publish(self, item: Any) -> None:
+        """Hands an item yielded by a generator serve op to waiting calls."""
+        with self._cond:
+            self._items.append(item)
+            self._notify()
+
+    def finish(self, serve_result: Any, props_update: Dict[str, Any]) -> None:
+        """Hands the serve result, and the props the serve op set, to
+        waiting calls."""
+        with self._cond:
+            if self._done:
+                return
+            self._done = True
+            self._result = (serve_result, props_update)
+            self._notify()
+
+    def fail(self, error: BaseException) -> None:
+        """Raises the serve op's error in waiting calls."""
+        with self._cond:
+            if self._done:
+                return
+            self._done = True
+            self._error = error
+            self._notify()
+
+    def release(self) -> None:
+        """Stops new calls from joining the flight."""
+        self._group._release(self)
+
+    def follow(self) -> None:
+        """Counts the caller as waiting on the flight."""
+        self._group._follow(self)
+
+    def leave(self) -> None:
+        """Called when a waiting call stops waiting on the flight."""
+        self._group._leave(self)
+
+    def abandon(self) -> bool:
+        """Called when the caller running the serve op stops iterating it.
+
+        Returns:
+            bool: Whether calls are waiting on the flight, in which case
+            the serve op must still be run to completion for them.
+        """
+        return self._group._abandon(self)
+
+    def _outcome(self) -> Tuple[Any, Dict[str, Any]]:
+        if self._error is not None:
+            raise self._error
+        return self._result  # type: ignore
+
+    def result(self) -> Tuple[Any, Dict[str, Any]]:
+        """Waits for the serve result and the props the serve op set."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._done)
+            return self._outcome()
+
+    def stream(self) -> Iterator[Any]:
+        """Yields the items of a generator serve op as they are published."""
+        num_seen = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._items) > num_seen or self._done)
+                items = self._items[num_seen:]
+                done = self._done
+            yield from items
+            num_seen += len(items)
+            if done:
+                if self._error is not None:
+                    raise self._error
+                return
+
+    async def _changed(self, num_seen: int) -> None:
+        """Waits until an item is published after the first `num_seen`, or
+        the flight is done."""
+        with self._cond:
+            if len(self._items) > num_seen or self._done:
+                return
+            event = asyncio.Event()
+            self._waiters.append((asyncio.get_running_loop(), event))
+        await event.wait()
+
+    async def aresult(self) -> Tuple[Any, Dict[str, Any]]:
+        """Async version of `result`."""
+        while True:
+            with self._cond:
+                if self._done:
+                    return self._outcome()
+                num_seen = len(self._items)
+            await self._changed(num_seen)
+
+    async def astream(self) -> AsyncIterator[Any]:
+        """Async version of `stream`."""
+        num_seen = 0
+        while True:
+            await self._changed(num_seen)
+            with self._cond:
+                items = self._items[num_seen:]
+                done = self._done
+            for item in items:
+                yield item
+            num_seen += len(items)
+            if done:
+                if self._error is not None:
+                    raise self._error
+                return
+
+
+class SingleFlight:
+    """Serve ops in flight in a process, keyed by their cached result key
+    (the instance, flow key, and props hash).
+
+    Usage:
+    ```python
+    flight, leading = flights.join(cache_result_key)
+    if leading:
+        try:
+            serve_result = ...  # Run the serve op
+        except BaseException as e:
+            flight.fail(e)
+            flight.release()
+            raise
+        flight.finish(serve_result, props_update)
+        flight.release()
+    else:
+        try:
+            serve_result, props_update = flight.result()
+        finally:
+            flight.leave()
+    ```
+    """
+
+    def __init__(self) -> None:
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """Joins the flight of a key, starting one if none is in flight.
+
+        Returns:
+            Tuple[Flight, bool]: The flight, and whether the caller started
+            it and must run the serve op.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+
+            flight = Flight(self, key)
+            self._flights[key] = flight
+            return flight, True
+
+    def _follow(self, flight: Flight) -> None:
+        with self._lock:
+            flight.followers += 1
+
+    def _leave(self, flight: Flight) -> None:
+        with self._lock:
+            flight.followers -= 1
+
+    def _release(self, flight: Flight) -> None:
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def _abandon(self, flight: Flight) -> bool:
+        with self._lock:
+            if flight.followers:
+                return True
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+        flight.fail(FlightAbandoned(f"Serve op for {flight.key} was abandoned."))
+        return False
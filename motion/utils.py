@@ -1,22 +1,38 @@
-import hashlib
+import asyncio
+import copy
 import logging
 import os
 import random
+import time
 from enum import Enum
 from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional, Tuple
 
-import cloudpickle
 import colorlog
 import redis
+import redis.asyncio as aioredis
 import yaml
 from pydantic import BaseModel
 
-from motion.dicts import State
+from motion.blobs import BlobStore, clear_blobs, is_blob_ref, load_blob
+from motion.compression import Compressor, decompress
+from motion.dicts import LazyState, State
+from motion.hashing import canonical_hash
+from motion.redis_scripts import (
+    LOAD_STATE_FIELDS,
+    SAVE_STATE,
+    SAVE_STATE_FIELDS,
+    get_script,
+)
+from motion.serializers import Serializer, get_serializer
+from motion.shared_state import clear_shared_state
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_KEY_TTL = 60 * 60 * 24  # 1 day
+# Times an update op is run before giving up when other writers keep
+# committing first, with optimistic concurrency
+MAX_COMMIT_ATTEMPTS = 10
 
 
 def import_config(config_path: str = ".motionrc.yml") -> None:
@@ -35,16 +51,8 @@ def import_config(config_path: str = ".motionrc.yml") -> None:
 
 
 def hash_object(obj: Any) -> str:
-    # Convert the object to a string representation
-    obj_str = str(obj).encode("utf-8")
-
-    # Calculate the SHA256 hash
-    sha256_hash = hashlib.sha256(obj_str)
-
-    # Get the hexadecimal representation of the hash
-    hex_digest = sha256_hash.hexdigest()
-
-    return hex_digest
+    # Hash the contents of the object, independent of dict ordering
+    return canonical_hash(obj)
 
 
 class RedisParams(BaseModel, extra="allow"):
@@ -110,9 +118,17 @@ def clear_dev_instances() -> int:
         num_keys_deleted += 1
 
     # Delete all states too
-    prefix = "MOTION_STATE:DEV:*"
-    for key in redis_con.scan_iter(prefix):
-        pipeline.delete(key)
+    for prefix in [
+        "MOTION_STATE:DEV:*",
+        "MOTION_STATE_FIELDS:DEV:*",
+        "MOTION_STATE_FIELD_VERSIONS:DEV:*",
+        "MOTION_BLOB:DEV:*",
+        "MOTION_BLOB_REFS:DEV:*",
+        "MOTION_BLOB_ORPHANS:DEV:*",
+        "MOTION_SHARED_STATE_EPOCH:DEV:*",
+    ]:
+        for key in redis_con.scan_iter(prefix):
+            pipeline.delete(key)
 
     results_to_delete = redis_con.keys("MOTION_RESULT:DEV:*")
     queues_to_delete = redis_con.keys("MOTION_QUEUE:DEV:*")
@@ -175,11 +191,20 @@ def clear_instance(instance_name: str) -> bool:
     redis_con.delete(f"MOTION_VERSION:{instance_name}")
     redis_con.delete(f"MOTION_LOCK:{instance_name}")
     redis_con.delete(f"MOTION_LOCK:DEV:{instance_name}")
+    redis_con.delete(*_getStateFieldKeys(instance_name)[1::3])
+    redis_con.delete(*_getStateFieldKeys(instance_name)[2::3])
+    clear_blobs(redis_con, [instance_name])
+    clear_shared_state(redis_con, [instance_name])
 
     for env in [":DEV", ""]:
         results_to_delete = redis_con.keys(f"MOTION_RESULT{env}:{instance_name}/*")
         queues_to_delete = redis_con.keys(f"MOTION_QUEUE{env}:{instance_name}/*")
         channels_to_delete = redis_con.keys(f"MOTION_CHANNEL{env}:{instance_name}/*")
+        streams_to_delete = redis_con.keys(f"MOTION_STREAM{env}:{instance_name}/*")
+        # Control streams of update tasks that crashed
+        streams_to_delete += redis_con.keys(
+            f"MOTION_STREAM{env}:{instance_name}::control/*"
+        )
 
         pipeline = redis_con.pipeline()
         for result in results_to_delete:
@@ -188,8 +213,10 @@ def clear_instance(instance_name: str) -> bool:
             pipeline.delete(queue)
         for channel in channels_to_delete:
             pipeline.delete(channel)
+        for stream in streams_to_delete:
+            pipeline.delete(stream)
 
-    pipeline.execute()
+        pipeline.execute()
 
     redis_con.close()
 
@@ -300,34 +327,81 @@ def loadState(
     redis_con: redis.Redis,
     instance_name: str,
     load_state_func: Optional[Callable],
+    state_layout: Optional[str] = None,
+    serializer: Optional[Serializer] = None,
+    compressor: Optional[Compressor] = None,
+    blob_store: Optional[BlobStore] = None,
 ) -> Tuple[Optional[State], int]:
+    if state_layout is None:
+        state_layout = getStateLayout(redis_con, instance_name)
+
+    if state_layout == "hash":
+        if load_state_func is not None and getattr(load_state_func, "_fields", None):
+            hash_state, hash_version, _ = loadStateFields(
+                redis_con,
+                instance_name,
+                load_state_func=load_state_func,
+                serializer=serializer,
+                compressor=compressor,
+                blob_store=blob_store,
+            )
+            return hash_state, hash_version
+
+        hash_state, hash_version, _ = loadStateFields(
+            redis_con,
+            instance_name,
+            serializer=serializer,
+            compressor=compressor,
+            blob_store=blob_store,
+        )
+        if hash_state is not None and load_state_func is not None:
+            loaded = load_state_func(dict(hash_state))
+            hash_state.clear()
+            hash_state.update(loaded)
+        return hash_state, hash_version
+
     # Get state from redis
     state = State(instance_name.split("__")[0], instance_name.split("__")[1], {})
 
-    # If dev mode, load with diff prefix
-    loaded_state = None
-    version = None
+    # Read the state and its version in one transaction, so a save between
+    # the two reads can't pair a state with a newer version. If dev mode,
+    # load with diff prefix, falling back to the prod state
+    prefixes = [""]
     if os.getenv("MOTION_ENV", "prod") == "dev":
-        loaded_state = redis_con.get(f"MOTION_STATE:DEV:{instance_name}")
-        if loaded_state:
-            v_identifier = f"MOTION_VERSION:DEV:{instance_name}"
-            version = int(redis_con.get(v_identifier))  # type: ignore
-        else:
-            loaded_state = redis_con.get(f"MOTION_STATE:{instance_name}")
+        prefixes = ["DEV:", ""]
 
-    else:
-        loaded_state = redis_con.get(f"MOTION_STATE:{instance_name}")
+    pipeline = redis_con.pipeline(transaction=True)
+    for prefix in prefixes:
+        pipeline.get(f"MOTION_STATE:{prefix}{instance_name}")
+        pipeline.get(f"MOTION_VERSION:{prefix}{instance_name}")
+    results = pipeline.execute()
+
+    loaded_state = None
+    version = 0
+    for i in range(0, len(results), 2):
+        if results[i]:
+            loaded_state, version = results[i], int(results[i + 1])
+            break
 
     if not loaded_state:
         # This is an error
         logger.warning(f"Could not find state for {instance_name}. Creating new state.")
         return None, 0
 
-    if not version:
-        version = int(redis_con.get(f"MOTION_VERSION:{instance_name}"))  # type: ignore
-
     # Unpickle state
-    loaded_state = cloudpickle.loads(loaded_state)
+    serializer = get_serializer(serializer)
+    decompress_func = compressor.decompress if compressor else decompress
+    loaded_state = serializer.loads(decompress_func(loaded_state))
+
+    # Fetch the values that were written to the blob store
+    blob_refs = []
+    if isinstance(loaded_state, dict):
+        blob_refs = [k for k, v in loaded_state.items() if is_blob_ref(v)]
+    if blob_refs:
+        cache = blob_store.cache if blob_store is not None else None
+        for k in blob_refs:
+            blob = load_blob(redis_con, loaded_state[k], cache)
+            loaded_state[k] = serializer.loads(decompress_func(blob))
 
     if load_state_func is not None:
         state.update(load_state_func(loaded_state))
@@ -343,35 +417,383 @@ def saveState(
     redis_con: redis.Redis,
     instance_name: str,
     save_state_func: Optional[Callable],
+    state_layout: Optional[str] = None,
+    serializer: Optional[Serializer] = None,
+    compressor: Optional[Compressor] = None,
+    blob_store: Optional[BlobStore] = None,
 ) -> int:
-    # If the version in redis is greater than this version, drop the save
-    redis_v = None
-    if os.getenv("MOTION_ENV", "prod") == "dev":
-        redis_con.get(f"MOTION_VERSION:DEV:{instance_name}")
-
-    if not redis_v:
-        redis_v = redis_con.get(f"MOTION_VERSION:{instance_name}")
-
-    if redis_v and int(redis_v) > version:
-        # This means that another process has already saved the state
-        # Return a sentinel value that indicates that the state was not saved
-        return -1
+    if state_layout is None:
+        state_layout = getStateLayout(redis_con, instance_name)
+
+    if state_layout == "hash":
+        if save_state_func is not None:
+            state_to_save = save_state_func(state_to_save)
+        return saveStateFields(
+            state_to_save,
+            version,
+            redis_con,
+            instance_name,
+            serializer=serializer,
+            compressor=compressor,
+            blob_store=blob_store,
+        )
 
     # Save state to redis
     if save_state_func is not None:
         state_to_save = save_state_func(state_to_save)
 
-    state_pickled = cloudpickle.dumps(state_to_save)
+    serializer = get_serializer(serializer)
+    blob_shas: Dict[str, Optional[str]] = {}
+    if blob_store is not None and isinstance(state_to_save, dict):
+        # Write large values to the blob store and keep references to them
+        refs, blob_shas = blob_store.offload(
+            redis_con,
+            instance_name,
+            {
+                k: _dumpValue(v, serializer, compressor)
+                for k, v in state_to_save.items()
+                if isinstance(k, str)
+            },
+        )
+        if refs:
+            state_to_save = copy.copy(state_to_save)
+            state_to_save.update(refs)
+
+    state_pickled = serializer.dumps(state_to_save)
+    if compressor is not None:
+        state_pickled = compressor.compress(state_pickled)
+
+    # Write the state and version together if the version in redis isn't
+    # greater than this version, and let any executors listening for pushed
+    # state updates know there is a new version. Returns -1 if another
+    # process has already saved a newer state.
+    if os.getenv("MOTION_ENV", "prod") == "dev":
+        keys = [
+            f"MOTION_STATE:DEV:{instance_name}",
+            f"MOTION_VERSION:DEV:{instance_name}",
+            f"MOTION_VERSION:{instance_name}",
+        ]
+    else:
+        keys = [f"MOTION_STATE:{instance_name}", f"MOTION_VERSION:{instance_name}"]
+
+    new_version = int(
+        get_script(redis_con, SAVE_STATE)(
+            keys=keys,
+            args=[version, state_pickled, get_version_channel(instance_name)],
+        )
+    )
+    if blob_store is not None and new_version != -1:
+        blob_store.commit(
+            redis_con, instance_name, new_version, blob_shas, replace_all=True
+        )
+    return new_version
 
+
+def _dumpValue(
+    value: Any, serializer: Serializer, compressor: Optional[Compressor]
+) -> bytes:
+    """Serializes a state value, compressing it if enabled."""
+    data = serializer.dumps(value)
+    if compressor is not None:
+        data = compressor.compress(data)
+    return data
+
+
+def conflictBackoff(attempt: int) -> float:
+    """Returns a random, exponentially growing time (seconds) to wait before
+    rerunning an update op whose commit conflicted, so conflicting writers
+    spread out."""
+    return random.uniform(0, min(0.005 * 2**attempt, 0.5))
+
+
+def waitAfterConflict(attempt: int) -> None:
+    """Sleeps before rerunning an update op whose commit conflicted."""
+    time.sleep(conflictBackoff(attempt))
+
+
+def _getStateFieldKeys(instance_name: str) -> List[str]:
+    """Gets the version key, field versions key, and fields key of a state
+    stored with the hash layout. In dev mode, these are followed by the prod
+    keys to fall back to."""
+    keys = [
+        f"MOTION_VERSION:{instance_name}",
+        f"MOTION_STATE_FIELD_VERSIONS:{instance_name}",
+        f"MOTION_STATE_FIELDS:{instance_name}",
+    ]
     if os.getenv("MOTION_ENV", "prod") == "dev":
-        redis_con.set(f"MOTION_STATE:DEV:{instance_name}", state_pickled)
-        redis_con.set(f"MOTION_VERSION:DEV:{instance_name}", version + 1)
+        keys = [
+            f"MOTION_VERSION:DEV:{instance_name}",
+            f"MOTION_STATE_FIELD_VERSIONS:DEV:{instance_name}",
+            f"MOTION_STATE_FIELDS:DEV:{instance_name}",
+        ] + keys
 
-    else:
-        redis_con.set(f"MOTION_STATE:{instance_name}", state_pickled)
-        redis_con.set(f"MOTION_VERSION:{instance_name}", version + 1)
+    return keys
+
+
+def getStateLayout(redis_con: redis.Redis, instance_name: str) -> str:
+    """Gets the layout an instance's state is stored with: "hash" if each
+    top-level key is stored as a separate field, "blob" otherwise."""
+    field_keys = _getStateFieldKeys(instance_name)[2::3]
+    return "hash" if redis_con.exists(*field_keys) else "blob"
+
+
+def getHookFields(load_state_func: Optional[Callable]) -> List[str]:
+    """Gets the state fields a load_state hook declared it transforms."""
+    return list(getattr(load_state_func, "_fields", None) or [])
 
-    return version + 1
+
+def _isLoaded(state: State, key: str) -> bool:
+    return key in state and (not isinstance(state, LazyState) or state.is_loaded(key))
+
+
+def loadStateFields(
+    redis_con: redis.Redis,
+    instance_name: str,
+    cached_state: Optional[State] = None,
+    cached_field_versions: Optional[Dict[str, int]] = None,
+    load_state_func: Optional[Callable] = None,
+    lazy: bool = False,
+    serializer: Optional[Serializer] = None,
+    compressor: Optional[Compressor] = None,
+    blob_store: Optional[BlobStore] = None,
+) -> Tuple[Optional[LazyState], int, Dict[str, int]]:
+    """Loads a state stored with the hash layout. Only the fields that
+    changed since `cached_field_versions` are fetched; the rest are taken
+    from `cached_state`.
+
+    Args:
+        redis_con (redis.Redis): Connection to fetch fields with, now and,
+            if `lazy`, when they are first accessed.
+        instance_name (str): Instance to load the state of.
+        cached_state (Optional[State], optional): Copy of the state from a
+            previous load. Defaults to None.
+        cached_field_versions (Optional[Dict[str, int]], optional): Field
+            versions returned by the previous load. Defaults to None.
+        load_state_func (Optional[Callable], optional): load_state hook,
+            run on the fields it declares whenever any of them changes.
+            Defaults to None.
+        lazy (bool, optional): Fetch fields the first time they are
+            accessed instead of right away. Defaults to False.
+        serializer (Optional[Serializer], optional): Serializer the fields
+            were written with. Defaults to None, which uses cloudpickle.
+        compressor (Optional[Compressor], optional): Compressor to record
+            decompression stats with. Compressed fields are decompressed
+            either way. Defaults to None.
+        blob_store (Optional[BlobStore], optional): Blob store whose cache
+            to fetch blobs through. Fields written to a blob store are
+            fetched either way. Defaults to None.
+
+    Returns:
+        Tuple[Optional[LazyState], int, Dict[str, int]]: The state (None if
+        it doesn't exist), its version, and the version of each field. A
+        field fetched after it changed in Redis is at a newer version than
+        the state, and its entry in the field versions is updated when it
+        is fetched.
+    """
+    cached_state = cached_state if cached_state is not None else State("", "")
+    serializer = get_serializer(serializer)
+    decompress_func = compressor.decompress if compressor else decompress
+    blob_cache = blob_store.cache if blob_store is not None else None
+    cached_field_versions = cached_field_versions or {}
+
+    args: List[Any] = ["0" if lazy else "1"]
+    for field, field_version in cached_field_versions.items():
+        if _isLoaded(cached_state, field):
+            args += [field, field_version]
+
+    response = get_script(redis_con, LOAD_STATE_FIELDS)(
+        keys=_getStateFieldKeys(instance_name), args=args
+    )
+    if not response:
+        logger.warning(f"Could not find state for {instance_name}. Creating new state.")
+        return None, 0, {}
+
+    version, flat_field_versions, changed, values, versions_key, fields_key = response
+    field_versions = {
+        flat_field_versions[i].decode("utf-8"): int(flat_field_versions[i + 1])
+        for i in range(0, len(flat_field_versions), 2)
+    }
+    # Pickled values of changed fields, used before fetching from Redis
+    prefetched = {field.decode("utf-8"): value for field, value in zip(changed, values)}
+
+    # Fields the load_state hook transforms are loaded and reused together
+    hook_fields = getHookFields(load_state_func)
+
+    def fetch(fields: List[str]) -> Dict[str, Any]:
+        if any(field in hook_fields for field in fields):
+            fields = list(dict.fromkeys(fields + hook_fields))
+        stored = [field for field in fields if field in field_versions]
+
+        missing = [field for field in stored if field not in prefetched]
+        if missing:
+            # Fetch the versions of the fields in the same transaction, since
+            # they may have changed since the state was loaded
+            pipeline = redis_con.pipeline(transaction=True)
+            pipeline.hmget(fields_key, missing)
+            pipeline.hmget(versions_key, missing)
+            missing_values, missing_versions = pipeline.execute()
+            prefetched.update(zip(missing, missing_values))
+            for field, field_version in zip(missing, missing_versions):
+                if field_version is not None:
+                    field_versions[field] = int(field_version)
+        loaded = {}
+        for field in stored:
+            data = prefetched.pop(field, None)
+            if data is None:
+                continue
+            data = decompress_func(data)
+            if is_blob_ref(data):
+                data = decompress_func(load_blob(redis_con, data, blob_cache))
+            loaded[field] = serializer.loads(data)
+
+        if any(field in hook_fields for field in fields):
+            hook_input = {f: loaded.pop(f) for f in hook_fields if f in loaded}
+            loaded.update(load_state_func(hook_input))  # type: ignore
+        return loaded
+
+    def reusable(field: str) -> bool:
+        return (
+            field in field_versions
+            and cached_field_versions.get(field) == field_versions[field]  # type: ignore # noqa: E501
+            and _isLoaded(cached_state, field)  # type: ignore
+        )
+
+    reuse_hook_fields = all(
+        reusable(field) or (field not in field_versions and field in cached_state)
+        for field in hook_fields
+    ) and any(field in cached_state for field in hook_fields)
+
+    state = LazyState(instance_name.split("__")[0], instance_name.split("__")[1], fetch)
+    for field in list(field_versions) + hook_fields:
+        if field in hook_fields:
+            if reuse_hook_fields:
+                if field in cached_state:
+                    state[field] = cached_state[field]
+            else:
+                state.defer(field)
+        elif reusable(field):
+            state[field] = cached_state[field]
+        else:
+            state.defer(field)
+
+    if not lazy:
+        state.load_all()
+
+    return state, int(version), field_versions
+
+
+def saveStateFields(
+    state_update: Dict[str, Any],
+    version: int,
+    redis_con: redis.Redis,
+    instance_name: str,
+    field_versions: Optional[Dict[str, int]] = None,
+    serializer: Optional[Serializer] = None,
+    compressor: Optional[Compressor] = None,
+    blob_store: Optional[BlobStore] = None,
+) -> int:
+    """Writes the keys in `state_update` to a state stored with the hash
+    layout, leaving the other keys untouched, and bumps the version in the
+    same atomic step.
+
+    Args:
+        state_update (Dict[str, Any]): Keys to write.
+        version (int): Version the caller's state is at.
+        redis_con (redis.Redis): Redis connection.
+        instance_name (str): Instance to save the state of.
+        field_versions (Optional[Dict[str, int]], optional): If given, only
+            these fields are checked against the versions the caller's
+            copies are at (0 if they didn't exist), instead of checking the
+            version of the whole state, so writers of other fields don't
+            conflict. Defaults to None.
+        serializer (Optional[Serializer], optional): Serializer to write
+            the fields with. Defaults to None, which uses cloudpickle.
+        compressor (Optional[Compressor], optional): Compressor to compress
+            large fields with. Defaults to None, which stores them as is.
+        blob_store (Optional[BlobStore], optional): Store to write fields
+            above its threshold to, keeping references to them in the
+            state. Defaults to None.
+
+    Returns:
+        int: The new version, or -1 if a newer state was already saved.
+    """
+    args: List[Any] = [
+        version if field_versions is None else "",
+        get_version_channel(instance_name),
+        len(field_versions or {}),
+    ]
+    for field, field_version in (field_versions or {}).items():
+        args += [field, field_version]
+    serializer = get_serializer(serializer)
+    values: Dict[str, bytes] = {}
+    for key, value in state_update.items():
+        if not isinstance(key, str):
+            raise TypeError(
+                f"State keys must be strings with the hash state layout, got {key!r}."
+            )
+        values[key] = _dumpValue(value, serializer, compressor)
+
+    blob_shas: Dict[str, Optional[str]] = {}
+    if blob_store is not None:
+        # Write large fields to the blob store and keep references to them
+        refs, blob_shas = blob_store.offload(redis_con, instance_name, values)
+        values.update(refs)
+    for key, value_pickled in values.items():
+        args += [key, value_pickled]
+
+    new_version = int(
+        get_script(redis_con, SAVE_STATE_FIELDS)(
+            keys=_getStateFieldKeys(instance_name), args=args
+        )
+    )
+    if blob_store is not None and new_version != -1:
+        blob_store.commit(
+            redis_con, instance_name, new_version, blob_shas, replace_all=False
+        )
+    return new_version
+
+
+def get_env_prefix() -> str:
+    """Gets the prefix that keys of dev copies of instances are named with,
+    after the key type, e.g., MOTION_STATE:DEV:<instance name>."""
+    return "DEV:" if os.getenv("MOTION_ENV", "prod") == "dev" else ""
+
+
+def get_version_channel(instance_name: str) -> str:
+    """Gets the pubsub channel that new state versions for an instance
+    are published to."""
+    return f"MOTION_VERSION_CHANNEL:{get_env_prefix()}{instance_name}"
+
+
+def get_worker_keys(component_name: str) -> Tuple[str, str]:
+    """Gets the set that instances of a component with external update
+    tasks add themselves to when they queue updates, and the pubsub channel
+    they announce themselves on, so `motion worker` processes find them."""
+    prefix = get_env_prefix()
+    return (
+        f"MOTION_WORKER_INSTANCES:{prefix}{component_name}",
+        f"MOTION_WORKER_CHANNEL:{prefix}{component_name}",
+    )
+
+
+def _isUpdateDone(message: Dict[str, Any], identifier: str) -> bool:
+    """Whether a message published by an update task says the update
+    operation for `identifier` finished. Raises if it failed."""
+    if message["type"] != "message":
+        return False
+
+    message_data_str = message["data"].decode("utf-8")
+    if message_data_str[0] == "{":
+        error_data = eval(message["data"])
+        if error_data["identifier"] != identifier:
+            return False
+
+        if error_data["exception"]:
+            raise RuntimeError(error_data["exception"])
+
+        return True
+
+    return bool(message_data_str == identifier)
 
 
 class UpdateEvent:
@@ -383,29 +805,67 @@ class UpdateEvent:
         self.identifier = identifier
         self.pubsub.subscribe(channel)
 
-    def wait(self) -> None:
-        for message in self.pubsub.listen():
-            if message["type"] != "message":
-                continue
-
-            message_data_str = message["data"].decode("utf-8")
-            if message_data_str[0] == "{":
-                error_data = eval(message["data"])
-                identifier = error_data["identifier"]
-                exception_str = error_data["exception"]
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Waits for the update operation to finish.
 
-                if identifier != self.identifier:
-                    continue
+        Args:
+            timeout (Optional[float], optional): Seconds to wait. Defaults
+                to None, which waits indefinitely.
 
-                if exception_str:
-                    raise RuntimeError(exception_str)
+        Raises:
+            TimeoutError: If it didn't finish within `timeout` seconds.
+        """
+        if timeout is None:
+            for message in self.pubsub.listen():
+                if _isUpdateDone(message, self.identifier):
+                    return
+            return
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"Update operation on {self.channel} didn't finish within "
+                    + f"{timeout} seconds."
+                )
+            message = self.pubsub.get_message(timeout=remaining)
+            if message is not None and _isUpdateDone(message, self.identifier):
+                return
+
+
+class AsyncUpdateEvent:
+    """Waits for a update operation to finish without blocking the event
+    loop. Call `subscribe` before queueing the update operation."""
+
+    def __init__(
+        self, redis_con: aioredis.Redis, channel: str, identifier: str
+    ) -> None:
+        self.channel = channel
+        self.pubsub = redis_con.pubsub()
+        self.identifier = identifier
 
+    async def subscribe(self) -> None:
+        await self.pubsub.subscribe(self.channel)
+
+    async def wait(self, timeout: Optional[float] = None) -> None:
+        """Async version of `UpdateEvent.wait`."""
+        try:
+            await asyncio.wait_for(self._listen(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                f"Update operation on {self.channel} didn't finish within "
+                + f"{timeout} seconds."
+            )
+        finally:
+            await self.pubsub.unsubscribe(self.channel)
+            await self.pubsub.reset()
+
+    async def _listen(self) -> None:
+        async for message in self.pubsub.listen():
+            if _isUpdateDone(message, self.identifier):
                 break
 
-            else:
-                if message_data_str == self.identifier:
-                    break
-
 
 class UpdateEventGroup:
     """Stores the events for update operations on a given key."""
@@ -417,9 +877,10 @@ class UpdateEventGroup:
     def add(self, udf_name: str, event: UpdateEvent) -> None:
         self.events[udf_name] = event
 
-    def wait(self) -> None:
+    def wait(self, timeout: Optional[float] = None) -> None:
         """Waits for all update operations for this flow key
-        to finish.
+        to finish, raising a TimeoutError if they didn't finish within
+        `timeout` seconds.
 
         Example usage:
         ```python
@@ -445,8 +906,11 @@ class UpdateEventGroup:
         # Now `state["state_val"] = 1` and `state["state_val2"] = 1`
         ```
         """
+        deadline = time.monotonic() + timeout if timeout is not None else None
         for event in self.events.values():
-            event.wait()
+            event.wait(
+                max(deadline - time.monotonic(), 0) if deadline is not None else None
+            )
 
     def __str__(self) -> str:
         return f"UpdateEventGroup(key={self.key}, events={self.events})"
@@ -455,6 +919,36 @@ class UpdateEventGroup:
         return self.__str__()
 
 
+def compressionMetrics(
+    compressor: Optional[Compressor],
+    component_name: str,
+    instance_id: str,
+    source: str,
+    timestamp: int,
+) -> List[str]:
+    """Formats the compression stats gathered since the last call as
+    metrics in InfluxDB line protocol, to send to VictoriaMetrics along
+    with other metrics. Returns no metrics if nothing was compressed."""
+    if compressor is None:
+        return []
+    stats = compressor.pop_stats()
+    if not any(stats.values()):
+        return []
+
+    labels = f"component={component_name},instance={instance_id},source={source}"
+    metrics = [
+        f"motion_compression_bytes,{labels},kind=uncompressed value={stats['bytes_in']} {timestamp}",  # noqa: E501
+        f"motion_compression_bytes,{labels},kind=stored value={stats['bytes_out']} {timestamp}",  # noqa: E501
+        f"motion_compression_cpu_seconds,{labels},op=compress value={stats['compress_seconds']} {timestamp}",  # noqa: E501
+        f"motion_compression_cpu_seconds,{labels},op=decompress value={stats['decompress_seconds']} {timestamp}",  # noqa: E501
+    ]
+    if "ratio" in stats:
+        metrics.append(
+            f"motion_compression_ratio,{labels} value={stats['ratio']} {timestamp}"
+        )
+    return metrics
+
+
 def random_passphrase(num_words: int = 3) -> str:
     """Generate random passphrase from eff wordlist."""
 
@@ -0,0 +1,85 @@
+from motion import Component
+from motion.dicts import Properties
+from motion.result_cache import load_result
+
+import cloudpickle
+import time
+
+C = Component("CachedResults")
+
+num_serves = []
+
+
+@C.serve("embed")
+def embed(state, props):
+    num_serves.append(1)
+    props["length"] = len(props["document"])
+    return props["document"][:10]
+
+
+def _cacheKey(c, props):
+    executor = c._executor
+    value_hash = executor._props_hasher(Properties(props))
+    return f"{executor._Executor__cache_result_prefix}/embed/{value_hash}"
+
+
+def _waitForEntry(c, key, magic=None):
+    for _ in range(100):
+        data = c._executor._redis_con.get(key)
+        if data is not None and (magic is None or data.startswith(magic)):
+            return data
+        time.sleep(0.05)
+    raise AssertionError(f"{key} was not cached")
+
+
+def test_cache_only_serve_result():
+    c = C("slim")
+    props = {"document": "x" * 100_000}
+    assert c.run("embed", props=props) == "x" * 10
+
+    # The large props aren't stored with the result
+    data = _waitForEntry(c, _cacheKey(c, props))
+    assert len(data) < 1000
+    cached = load_result(data)
+    assert cached.serve_result == "x" * 10
+    assert cached.props_update == {"length": 100_000}
+    assert cached.version == c._executor.version
+
+    # Hits set the props the serve op set on the caller's props
+    c.shutdown()
+    c = C("slim")
+    assert c.run("embed", props=props) == "x" * 10
+    props_with_result = Properties(props)
+    c._executor._try_cached_serve("embed", props_with_result, False, False)
+    assert props_with_result["length"] == 100_000
+    assert len(num_serves) == 1
+
+    c.shutdown()
+
+
+def test_legacy_entries_migrate():
+    c = C("legacy")
+    props = {"document": "y" * 5000}
+    key = _cacheKey(c, props)
+
+    # Entries written by older versions hold the whole props
+    legacy = Properties(props)
+    legacy["length"] = 5000
+    legacy._serve_result = "legacy"
+    c._executor._redis_con.set(key, cloudpickle.dumps(legacy), ex=60)
+
+    caller_props = Properties(props)
+    hit, serve_result, _, _, _ = c._executor._try_cached_serve(
+        "embed", caller_props, False, False
+    )
+    assert hit and serve_result == "legacy"
+    assert caller_props["length"] == 5000
+
+    # They are rewritten in the current format, keeping their expiry
+    data = _waitForEntry(c, key, magic=b"MOTION:R")
+    cached = load_result(data)
+    assert cached.serve_result == "legacy"
+    assert cached.props_update == {"length": 5000}
+    assert 0 < c._executor._redis_con.ttl(key) <= 60
+
+    c.shutdown()
@@ -44,3 +44,23 @@ def test_fit_error():
     # Should raise error bc update op won't work
     with pytest.raises(RuntimeError):
         c.run("number", props={"value": [1]}, flush_update=True)
+
+
+def test_serve_timings():
+    c = Counter()
+
+    c.run("number", props={"value": 1})
+    timings = c.get_serve_timings()
+    assert set(timings.keys()) == {
+        "cache_lookup",
+        "load_state",
+        "serve",
+        "enqueue_update",
+    }
+
+    # A cache hit shouldn't load the state or run the serve op
+    c.run("number", props={"value": 1})
+    timings = c.get_serve_timings()
+    assert set(timings.keys()) == {"cache_lookup", "enqueue_update"}
+
+    c.shutdown()
@@ -0,0 +1,96 @@
+from motion import Component
+from motion.result_cache import ResultCache
+
+import time
+
+cache = ResultCache(max_entries=2)
+C = Component("ResultCache", result_cache=cache)
+
+num_serves = []
+
+
+@C.serve("double")
+def double(state, props):
+    num_serves.append(1)
+    props["doubled"] = True
+    return props["value"] * 2
+
+
+@C.update("double")
+def record(state, props):
+    return {"doubled": props["doubled"]}
+
+
+@C.serve("tag")
+def tag(state, props):
+    props["tags"].append("seen")
+    return len(props["tags"])
+
+
+@C.update("tag")
+def recordTags(state, props):
+    return {"tags": list(props["tags"])}
+
+
+def test_in_process_hits(monkeypatch):
+    c = C("hits")
+    assert c.run("double", props={"value": 1, "payload": "x" * 1000}) == 2
+
+    # Hits don't go to Redis
+    def no_redis(*args, **kwargs):
+        raise AssertionError("Looked up the result in Redis")
+
+    monkeypatch.setattr(c._executor, "_lookupCachedResult", no_redis)
+    assert c.run("double", props={"value": 1, "payload": "x" * 1000}) == 2
+    assert len(num_serves) == 1
+    assert cache.stats()["hits"] == 1
+
+    # Hits set the props the serve op set, which update ops read
+    c.run("double", props={"value": 1, "payload": "x" * 1000}, flush_update=True)
+    assert c.read_state("doubled") is True
+    assert len(num_serves) == 1
+
+    # Results are bounded by count, least recently used first
+    monkeypatch.undo()
+    c.run("double", props={"value": 2})
+    c.run("double", props={"value": 3})
+    assert len(cache) == 2
+    assert cache.stats()["evictions"] == 1
+
+    c.shutdown()
+
+
+def test_props_modified_in_place_arent_cached():
+    c = C("in_place")
+    assert c.run("tag", props={"tags": ["a"]}, flush_update=True) == 2
+    assert c.read_state("tags") == ["a", "seen"]
+
+    # A hit returns the result, but the caller's props keep their values,
+    # since only props the serve op set are cached
+    assert c.run("tag", props={"tags": ["a"]}, flush_update=True) == 2
+    assert c.read_state("tags") == ["a"]
+
+    c.shutdown()
+
+
+def test_result_cache_bounds():
+    small = ResultCache(max_entries=10, max_bytes=10_000)
+    small.put("a", "x" * 4000, ttl=60)
+    small.put("b", "x" * 4000, ttl=60)
+    small.put("c", "x" * 4000, ttl=60)
+    assert small.get("a") == (False, None)
+    assert small.get("c")[0]
+
+    # Results too large for the cache aren't kept
+    small.put("d", "x" * 20_000, ttl=60)
+    assert not small.get("d")[0]
+
+    small.put("e", 1, ttl=0.05)
+    time.sleep(0.1)
+    assert not small.get("e")[0]
+    assert small.stats()["expirations"] == 1
+
+    versioned = ResultCache(versioned=True)
+    versioned.put("a", 1, ttl=60, version=3)
+    assert versioned.get("a", version=3) == (True, 1)
+    assert not versioned.get("a", version=4)[0]
@@ -0,0 +1,113 @@
+from motion import Component
+from motion.utils import get_redis_params
+
+import asyncio
+import pytest
+import redis
+import time
+
+C = Component("RunMany")
+
+batch_sizes = []
+
+
+@C.init_state
+def setUp():
+    return {"value": 0, "num_scored": 0}
+
+
+@C.serve("score")
+def score(state, props):
+    return state["value"] + props["x"]
+
+
+@C.update("score")
+def count(state, props):
+    return {"num_scored": state["num_scored"] + 1}
+
+
+@C.serve("vector_score", vectorized=True)
+def vector_score(state, props):
+    batch_sizes.append(len(props))
+    return [state["value"] + p["x"] for p in props]
+
+
+@C.serve("async_score")
+async def async_score(state, props):
+    await asyncio.sleep(0.01)
+    return props["x"] * 2
+
+
+@C.serve("stream")
+def stream(state, props):
+    yield props["x"]
+
+
+def wait_for_cached_results(pattern, num_results, timeout=5.0):
+    # Results are cached in the background
+    redis_con = redis.Redis(**get_redis_params().dict())
+    deadline = time.time() + timeout
+    while len(redis_con.keys(pattern)) < num_results and time.time() < deadline:
+        time.sleep(0.01)
+    redis_con.close()
+
+
+def test_run_many():
+    c = C("run_many")
+
+    results = c.run_many("score", [{"x": i} for i in range(5)], flush_update=True)
+    assert results == [0, 1, 2, 3, 4]
+    assert c.read_state("num_scored") == 5
+
+    # Cached results are reused and only the misses are served
+    results = c.run_many("score", [{"x": i} for i in range(3, 8)])
+    assert results == [3, 4, 5, 6, 7]
+    c.flush_update("score")
+    assert c.read_state("num_scored") == 10
+
+    # A single run hits the cache entries written by run_many
+    assert c.run("score", props={"x": 7}) == 7
+
+    assert c.run_many("score", []) == []
+
+    with pytest.raises(TypeError):
+        c.run_many("stream", [{"x": 1}])
+
+    with pytest.raises(TypeError):
+        c.run_many("async_score", [{"x": 1}])
+
+    with pytest.raises(KeyError):
+        c.run_many("missing", [{"x": 1}])
+
+    c.shutdown()
+
+
+def test_vectorized_serve():
+    c = C("vectorized")
+
+    # Misses are passed to the serve op in a single call
+    assert c.run_many("vector_score", [{"x": 1}, {"x": 2}]) == [1, 2]
+    wait_for_cached_results("MOTION_RESULT:RunMany__vectorized/*", 2)
+    assert c.run_many("vector_score", [{"x": 1}, {"x": 3}, {"x": 4}]) == [1, 3, 4]
+    assert batch_sizes == [2, 2]
+
+    # run passes a list of one props and unwraps the result
+    assert c.run("vector_score", props={"x": 5}) == 5
+
+    c.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_arun_many():
+    c = C("arun_many")
+
+    results = await c.arun_many("async_score", [{"x": i} for i in range(10)])
+    assert results == [i * 2 for i in range(10)]
+
+    results = await c.arun_many(
+        "score", [{"x": 1}, {"x": 2}], ignore_cache=True, flush_update=True
+    )
+    assert results == [1, 2]
+    assert c.read_state("num_scored") == 2
+
+    c.shutdown()
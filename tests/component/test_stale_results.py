@@ -0,0 +1,178 @@
+from motion import Component
+from motion.result_cache import ResultCache
+
+import asyncio
+import pytest
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+Stale = Component("StaleResults", stale_while_revalidate=True)
+Lagged = Component("LaggedResults", max_version_lag=1)
+lagged_cache = ResultCache()
+LaggedCached = Component(
+    "LaggedCachedResults", max_version_lag=1, result_cache=lagged_cache
+)
+
+num_serves = {"scale": 0, "async_scale": 0, "lagged": 0}
+
+
+@Stale.init_state
+def setUp():
+    return {"multiplier": 1}
+
+
+@Stale.serve("scale")
+def scale(state, props):
+    num_serves["scale"] += 1
+    return props["value"] * state["multiplier"]
+
+
+@Stale.serve("async_scale")
+async def async_scale(state, props):
+    num_serves["async_scale"] += 1
+    await asyncio.sleep(0.01)
+    return props["value"] * state["multiplier"]
+
+
+@Lagged.init_state
+def setUpLagged():
+    return {"multiplier": 1}
+
+
+@Lagged.serve("lagged")
+def lagged(state, props):
+    num_serves["lagged"] += 1
+    return props["value"] * state["multiplier"]
+
+
+@LaggedCached.init_state
+def setUpLaggedCached():
+    return {"multiplier": 1}
+
+
+@LaggedCached.serve("lagged")
+def lagged_cached(state, props):
+    return props["value"] * state["multiplier"]
+
+
+def test_stale_results_revalidate():
+    c = Stale("revalidate")
+    assert c.run("scale", props={"value": 3}) == 3
+    assert c.run("scale", props={"value": 3}) == 3
+    assert num_serves["scale"] == 1
+
+    # The stale result is served while it is recomputed
+    c.write_state({"multiplier": 2})
+    assert c.run("scale", props={"value": 3}) == 3
+
+    for _ in range(100):
+        if c.run("scale", props={"value": 3}) == 6:
+            break
+        time.sleep(0.05)
+    else:
+        raise AssertionError("Stale result was not recomputed")
+    assert num_serves["scale"] == 2
+
+    c.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_stale_results_revalidate_async():
+    c = Stale("async_revalidate")
+    assert await c.arun("async_scale", props={"value": 3}) == 3
+
+    c.write_state({"multiplier": 5})
+    assert await c.arun("async_scale", props={"value": 3}) == 3
+
+    for _ in range(100):
+        if await c.arun("async_scale", props={"value": 3}) == 15:
+            break
+        await asyncio.sleep(0.05)
+    else:
+        raise AssertionError("Stale result was not recomputed")
+    assert num_serves["async_scale"] == 2
+
+    c.shutdown()
+
+
+def test_in_process_hits_revalidate():
+    # A reader that only serves hits from its in-process cache never loads
+    # the state, so it checks them against the versions it hears of
+    writer = Stale("listening")
+    reader = Stale("listening", push_state_updates=True)
+    while reader._executor._version_listener.subscribed_at is None:
+        time.sleep(0.01)
+
+    assert reader.run("scale", props={"value": 2}) == 2
+    assert reader.run("scale", props={"value": 2}) == 2
+    version = reader._executor.version
+    serves = num_serves["scale"]
+
+    writer.write_state({"multiplier": 3})
+    for _ in range(100):
+        if reader.run("scale", props={"value": 2}) == 6:
+            break
+        time.sleep(0.05)
+    else:
+        raise AssertionError("Stale result was not recomputed")
+    assert num_serves["scale"] == serves + 1
+
+    # The result was recomputed on a state of its own
+    assert reader._executor.version == version
+    assert reader._executor._state["multiplier"] == 1
+
+    writer.shutdown()
+    reader.shutdown()
+
+
+def test_stale_results_during_shutdown():
+    c = Stale("shut_down")
+    assert c.run("scale", props={"value": 4}) == 4
+    serves = num_serves["scale"]
+
+    # Calls in flight while the instance shuts down still get the stale
+    # result, without recomputing it
+    c._executor._revalidation_tp = ThreadPoolExecutor()
+    c._executor._revalidation_tp.shutdown()
+    c.write_state({"multiplier": 2})
+    assert c.run("scale", props={"value": 4}) == 4
+    assert num_serves["scale"] == serves
+    assert not c._executor._revalidating
+
+    c.shutdown()
+
+
+def test_max_version_lag():
+    c = Lagged("lag")
+    assert c.run("lagged", props={"value": 3}) == 3
+
+    # Results one version behind are served, without being recomputed
+    c.write_state({"multiplier": 2})
+    assert c.run("lagged", props={"value": 3}) == 3
+    assert num_serves["lagged"] == 1
+
+    # Results further behind are recomputed on the request path
+    c.write_state({"multiplier": 4})
+    assert c.run("lagged", props={"value": 3}) == 12
+    assert num_serves["lagged"] == 2
+
+    c.shutdown()
+
+
+def test_lagged_in_process_results_are_misses():
+    c = LaggedCached("lag", push_state_updates=True)
+    while c._executor._version_listener.subscribed_at is None:
+        time.sleep(0.01)
+    assert c.run("lagged", props={"value": 3}) == 3
+    assert c.run("lagged", props={"value": 3}) == 3
+    assert lagged_cache.stats()["hits"] == 1
+
+    # Results too far behind count as misses, not hits
+    c.write_state({"multiplier": 2})
+    c.write_state({"multiplier": 4})
+    misses = lagged_cache.stats()["misses"]
+    assert c.run("lagged", props={"value": 3}) == 12
+    assert lagged_cache.stats()["hits"] == 1
+    assert lagged_cache.stats()["misses"] == misses + 1
+
+    c.shutdown()
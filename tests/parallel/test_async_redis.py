@@ -0,0 +1,121 @@
+from motion import Component
+
+import asyncio
+import pytest
+
+C = Component("AsyncRedis")
+Reader = Component("AsyncRedisReader")
+
+
+@C.init_state
+def setup():
+    return {"value": 1}
+
+
+@C.serve("multiply")
+async def multiply(state, props):
+    await asyncio.sleep(0.01)
+    return state["value"] * props["value"]
+
+
+@C.update("multiply")
+async def increment(state, props):
+    return {"value": state["value"] + 1}
+
+
+@Reader.init_state
+def setupReader():
+    return {"value": 1}
+
+
+@Reader.serve("multiply")
+async def read_multiply(state, props):
+    await asyncio.sleep(0.01)
+    return state["value"] * props["value"]
+
+
+def no_sync_redis(*args, **kwargs):
+    raise AssertionError("Used the sync Redis client in arun")
+
+
+@pytest.mark.asyncio
+async def test_arun_uses_async_redis(monkeypatch):
+    c = C("async")
+
+    # Cache lookups and enqueues use the async client
+    monkeypatch.setattr(c._executor, "_lookupCachedResult", no_sync_redis)
+    monkeypatch.setattr(c._executor, "_enqueue_updates", no_sync_redis)
+    results = await asyncio.gather(
+        *[c.arun("multiply", props={"value": i}) for i in range(20)]
+    )
+    assert results == list(range(20))
+
+    # Flushing waits on the async client too
+    await c.aflush_update("multiply")
+    assert c.read_state("value") == 21
+    assert await c.arun("multiply", props={"value": 2}, ignore_cache=True) == 42
+
+    c.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_arun_flush_update_async_lock():
+    c = C("async_flush", disable_update_task=True)
+
+    await asyncio.gather(
+        *[
+            c.arun("multiply", props={"value": i}, flush_update=True)
+            for i in range(10)
+        ]
+    )
+    # The update ops took turns holding the lock
+    assert c.read_state("value") == 11
+
+    c.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_state_loads_coalesce(monkeypatch):
+    c = Reader("async_loads")
+    assert await c.arun("multiply", props={"value": 1}) == 1
+
+    loads = []
+    load_state = c._executor._loadState
+
+    def counted_load_state(*args, **kwargs):
+        loads.append(1)
+        return load_state(*args, **kwargs)
+
+    monkeypatch.setattr(c._executor, "_loadState", counted_load_state)
+    c.write_state({"value": 3})
+    results = await asyncio.gather(
+        *[c.arun("multiply", props={"value": i}, ignore_cache=True) for i in range(10)]
+    )
+    assert results == [3 * i for i in range(10)]
+    assert len(loads) == 1
+
+    c.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_arun_many_uses_async_redis(monkeypatch):
+    c = C("async_many")
+
+    # Cache lookups, enqueues, and flushes use the async client
+    monkeypatch.setattr(c._executor, "_lookupCachedResults", no_sync_redis)
+    monkeypatch.setattr(c._executor, "_enqueue_updates", no_sync_redis)
+    monkeypatch.setattr(c._executor, "flush_update", no_sync_redis)
+    results = await c.arun_many("multiply", [{"value": i} for i in range(5)])
+    assert results == list(range(5))
+
+    # Refreshing flushes the queued updates first
+    results = await c.arun_many(
+        "multiply", [{"value": i} for i in range(5)], force_refresh=True
+    )
+    assert results == [6 * i for i in range(5)]
+
+    # Cached results are found with the async client too
+    await c.aflush_update("multiply")
+    assert await c.arun_many("multiply", [{"value": 1}, {"value": 2}]) == [6, 12]
+
+    c.shutdown()
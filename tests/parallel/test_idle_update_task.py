@@ -0,0 +1,40 @@
+from motion import Component
+
+import time
+
+C = Component("IdleUpdateTask")
+
+
+@C.init_state
+def setUp():
+    return {"value": 0}
+
+
+@C.update("add")
+def add(state, props):
+    return {"value": state["value"] + props["value"]}
+
+
+def num_blpop_calls(redis_con):
+    return redis_con.info("commandstats").get("cmdstat_blpop", {}).get("calls", 0)
+
+
+def test_idle_update_task_blocks():
+    c = C("idle")
+    redis_con = c._executor._redis_con
+
+    # Let the update task start blocking
+    time.sleep(0.1)
+    calls = num_blpop_calls(redis_con)
+    time.sleep(0.5)
+    assert num_blpop_calls(redis_con) - calls <= 1
+
+    # Blocking doesn't delay updates
+    c.run("add", props={"value": 1}, flush_update=False)
+    c.flush_update("add")
+    assert c.read_state("value") == 1
+
+    # Or shutdown
+    start = time.time()
+    c.shutdown()
+    assert time.time() - start < 5
@@ -0,0 +1,121 @@
+from motion import Component
+
+import pytest
+import threading
+import time
+
+C = Component("KeyScoped", state_layout="hash")
+Mixed = Component("MixedScopes", state_layout="hash")
+
+started = {"a": threading.Event(), "b": threading.Event()}
+overlapped = []
+order = []
+
+
+@C.init_state
+def setUp():
+    return {"a": 0, "b": 0, "scale": 10}
+
+
+@C.serve("flow")
+def read(state, props):
+    return state["a"] + state["b"]
+
+
+@C.update("flow", writes=["a"])
+def update_a(state, props):
+    started["a"].set()
+    overlapped.append(started["b"].wait(5))
+    return {"a": state["a"] + 1}
+
+
+@C.update("flow", writes=["b"], reads=["scale"])
+def update_b(state, props):
+    started["b"].set()
+    overlapped.append(started["a"].wait(5))
+    return {"b": state["b"] + state["scale"]}
+
+
+@C.update("undeclared", writes=["a"])
+def update_undeclared(state, props):
+    return {"a": 1, "b": 1}
+
+
+@Mixed.init_state
+def setUpMixed():
+    return {"a": 0, "b": 0, "total": 0}
+
+
+@Mixed.update("a", writes=["a"])
+def increment_a(state, props):
+    time.sleep(0.05)
+    order.append("late" if props.get("late") else "a")
+    return {"a": state["a"] + 1}
+
+
+@Mixed.update("b", writes=["b"])
+def increment_b(state, props):
+    time.sleep(0.05)
+    order.append("b")
+    return {"b": state["b"] + 1}
+
+
+@Mixed.update("total")
+def total(state, props):
+    order.append("total")
+    return {"total": state["a"] + state["b"]}
+
+
+def test_key_scoped_updates_run_in_parallel():
+    c = C("parallel", update_task_type="pool")
+
+    c.run("flow", ignore_cache=True)
+    c.flush_update("flow")
+
+    # update_a and update_b write different keys, so they don't wait on
+    # each other
+    assert overlapped == [True, True]
+    assert c.read_state("a") == 1
+    assert c.read_state("b") == 10
+
+    # Writes to other keys don't conflict with them
+    c.write_state({"scale": 1})
+    c.run("flow", ignore_cache=True, flush_update=True)
+    assert c.read_state("b") == 11
+
+    c.shutdown()
+
+
+def test_undeclared_writes_raise():
+    c = C("undeclared")
+
+    with pytest.raises(RuntimeError, match="aren't in its writes"):
+        c.run("undeclared", flush_update=True)
+    assert c.read_state("b") == 0
+
+    c.shutdown()
+
+
+def test_whole_instance_updates_arent_starved():
+    c = Mixed("starved", update_task_type="pool")
+
+    for _ in range(5):
+        c.run("a")
+        c.run("b")
+    c.run("total")
+    for _ in range(5):
+        c.run("a", props={"late": True})
+
+    for _ in range(200):
+        if len(order) == 16:
+            break
+        time.sleep(0.05)
+    else:
+        raise AssertionError("Update ops did not finish")
+
+    # Once the update op that locks the whole instance is waiting, no new
+    # key-scoped update ops start
+    assert order.index("total") < order.index("late")
+    assert c.read_state("a") == 10
+
+    c.shutdown()
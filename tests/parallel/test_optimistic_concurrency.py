@@ -0,0 +1,68 @@
+from motion import Component
+
+import threading
+import time
+
+C = Component("Optimistic", concurrency="optimistic")
+
+num_runs = []
+
+
+@C.init_state
+def setUp():
+    return {"value": 0, "notes": []}
+
+
+@C.serve("add")
+def read(state, props):
+    return state["value"]
+
+
+@C.update("add")
+def add(state, props):
+    num_runs.append(1)
+    time.sleep(props.get("sleep", 0))
+    return {"value": state["value"] + props["value"]}
+
+
+def test_concurrent_flushes():
+    instances = [C("concurrent", disable_update_task=True) for _ in range(4)]
+
+    def work(instance):
+        for _ in range(10):
+            instance.run("add", props={"value": 1}, ignore_cache=True, flush_update=True)
+
+    threads = [threading.Thread(target=work, args=(c,)) for c in instances]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Conflicting updates were rerun instead of lost
+    assert instances[0].read_state("value") == 40
+
+    for c in instances:
+        c.shutdown()
+
+
+def test_slow_update_does_not_block_writes():
+    num_runs.clear()
+    c = C("slow")
+    writer = C("slow", disable_update_task=True)
+
+    c.run("add", props={"value": 1, "sleep": 1}, ignore_cache=True)
+    time.sleep(0.2)
+
+    # The update op doesn't hold a lock while it runs
+    start = time.time()
+    writer.write_state({"notes": ["written"]})
+    assert time.time() - start < 0.5
+
+    # The slow update op conflicted with the write, so it was rerun
+    c.flush_update("add")
+    assert c.read_state("value") == 1
+    assert c.read_state("notes") == ["written"]
+    assert len(num_runs) == 2
+
+    writer.shutdown()
+    c.shutdown()
@@ -0,0 +1,186 @@
+from motion import Component
+
+import asyncio
+import pytest
+import threading
+import time
+
+C = Component("SingleFlight", singleflight="process")
+Leased = Component("LeasedSingleFlight", singleflight="redis")
+
+num_serves = {"slow": 0, "stream": 0, "broken": 0, "async_slow": 0, "leased": 0}
+
+
+@C.serve("slow")
+def slow(state, props):
+    num_serves["slow"] += 1
+    time.sleep(0.3)
+    props["length"] = len(props["document"])
+    return props["document"].upper()
+
+
+@C.serve("stream")
+def stream(state, props):
+    num_serves["stream"] += 1
+    for i in range(3):
+        yield i
+        time.sleep(0.1)
+
+
+@C.serve("broken")
+def broken(state, props):
+    num_serves["broken"] += 1
+    time.sleep(0.2)
+    raise ValueError("broken")
+
+
+@C.serve("async_slow")
+async def async_slow(state, props):
+    num_serves["async_slow"] += 1
+    await asyncio.sleep(0.2)
+    return props["value"] * 2
+
+
+@Leased.serve("leased")
+def leased(state, props):
+    num_serves["leased"] += 1
+    time.sleep(0.3)
+    return props["value"] * 2
+
+
+def _runConcurrently(func, num_calls):
+    results = [None] * num_calls
+
+    def call(i):
+        try:
+            results[i] = func()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(num_calls)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_runs_coalesce():
+    c = C("coalesce")
+    props = {"document": "hello"}
+
+    results = _runConcurrently(lambda: c.run("slow", props=props), 8)
+    assert num_serves["slow"] == 1
+    assert results == ["HELLO"] * 8
+
+    # Calls that ignore the cache run the serve op
+    c.run("slow", props=props, ignore_cache=True)
+    assert num_serves["slow"] == 2
+
+    c.shutdown()
+
+
+def test_generator_fan_out():
+    c = C("fan_out")
+
+    results = _runConcurrently(lambda: list(c.gen("stream", props={"k": 1})), 5)
+    assert num_serves["stream"] == 1
+    assert results == [[0, 1, 2]] * 5
+
+    # Waiting calls get every item if the call running the serve op stops
+    # iterating it
+    leader = c.gen("stream", props={"k": 2})
+    assert next(leader) == 0
+
+    follower_items = []
+    follower = threading.Thread(
+        target=lambda: follower_items.extend(c.gen("stream", props={"k": 2}))
+    )
+    follower.start()
+    while not any(f.followers for f in c._executor._flights._flights.values()):
+        time.sleep(0.01)
+
+    leader.close()
+    follower.join()
+    assert follower_items == [0, 1, 2]
+    assert num_serves["stream"] == 2
+
+    c.shutdown()
+
+
+def test_errors_raised_in_waiting_calls():
+    c = C("errors")
+
+    results = _runConcurrently(lambda: c.run("broken", props={"value": 1}), 4)
+    assert num_serves["broken"] == 1
+    assert all(isinstance(r, ValueError) for r in results)
+
+    # The next call runs the serve op again
+    with pytest.raises(ValueError):
+        c.run("broken", props={"value": 1})
+    assert num_serves["broken"] == 2
+
+    c.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_aruns_coalesce():
+    c = C("async_coalesce")
+
+    results = await asyncio.gather(
+        *[c.arun("async_slow", props={"value": 21}) for _ in range(10)]
+    )
+    assert num_serves["async_slow"] == 1
+    assert results == [42] * 10
+
+    c.shutdown()
+
+
+def test_lease_across_executors():
+    # Instances with the same id in different processes share the lease
+    c1 = Leased("shared")
+    c2 = Leased("shared")
+
+    def first():
+        return c1.run("leased", props={"value": 4})
+
+    def second():
+        time.sleep(0.05)
+        return c2.run("leased", props={"value": 4})
+
+    results = [None, None]
+    threads = [
+        threading.Thread(target=lambda: results.__setitem__(0, first())),
+        threading.Thread(target=lambda: results.__setitem__(1, second())),
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert num_serves["leased"] == 1
+    assert results == [8, 8]
+
+    c1.shutdown()
+    c2.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader():
+    c = C("cancelled")
+
+    leader = asyncio.create_task(c.arun("async_slow", props={"value": 5}))
+    await asyncio.sleep(0.05)
+    follower = asyncio.create_task(c.arun("async_slow", props={"value": 5}))
+    await asyncio.sleep(0.05)
+
+    # The waiting call runs the serve op itself
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert await follower == 10
+    assert len(c._executor._aflights) == 0
+
+    assert await c.arun("async_slow", props={"value": 5}) == 10
+
+    c.shutdown()
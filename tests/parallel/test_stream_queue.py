@@ -0,0 +1,127 @@
+from motion import Component, DiscardPolicy, clear_instance
+from motion.server import update_task
+
+import cloudpickle
+import redis
+import time
+
+C = Component("StreamQueue")
+
+
+@C.init_state
+def setUp():
+    return {"value": 0, "count": 0}
+
+
+@C.update("add")
+def add(state, props):
+    return {"value": state["value"] + props["value"], "count": state["count"] + 1}
+
+
+@C.update("add_batch", batch_size=5, max_wait_ms=200)
+def add_batch(state, props):
+    return {"value": state["value"] + sum(p["value"] for p in props)}
+
+
+@C.update("slow_add", discard_policy=DiscardPolicy.NUM_NEW_UPDATES, discard_after=2)
+def slow_add(state, props):
+    time.sleep(0.1)
+    return {"value": state["value"] + props["value"], "count": state["count"] + 1}
+
+
+@C.update("slow_count")
+def slow_count(state, props):
+    time.sleep(0.5)
+    return {"count": state["count"] + 1}
+
+
+def test_stream_queue():
+    c = C("stream", queue_backend="stream")
+
+    c.run("add", props={"value": 1})
+    c.run_many("add", [{"value": 2}, {"value": 3}])
+    c.flush_update("add")
+    assert c.read_state("value") == 6
+    assert c.read_state("count") == 3
+
+    c.run_many("add_batch", [{"value": 1}] * 10)
+    c.flush_update("add_batch")
+    assert c.read_state("value") == 16
+
+    # Processed entries are removed from the stream
+    stream = c._executor._get_queue_identifier("add", "add")
+    redis_con = redis.Redis(**c._executor._redis_params.dict())
+    c.shutdown()
+    assert redis_con.xlen(stream) == 0
+    redis_con.close()
+
+
+def test_stream_maxlen():
+    c = C("stream_maxlen", queue_backend="stream")
+
+    c.run_many("slow_add", [{"value": 1}] * 10)
+    c.flush_update("slow_add")
+
+    # Only the newest 2 updates are kept, plus any that were read already
+    assert c.read_state("count") <= 3
+
+    c.shutdown()
+
+
+def test_stream_claims_crashed_entries(monkeypatch):
+    monkeypatch.setattr(update_task, "STREAM_CLAIM_IDLE_MS", 0)
+
+    stream = "MOTION_STREAM:StreamQueue__stream_crash/add/add"
+    c = C("stream_crash", disable_update_task=True)
+    redis_con = redis.Redis(**c._executor._redis_params.dict())
+    c.shutdown()
+
+    # A consumer reads an update and crashes before acknowledging it
+    redis_con.delete(stream)
+    redis_con.xgroup_create(stream, update_task.STREAM_GROUP, id="0", mkstream=True)
+    redis_con.xadd(
+        stream,
+        {"item": cloudpickle.dumps({"props": {"value": 5}, "identifier": "crashed"})},
+    )
+    redis_con.xreadgroup(update_task.STREAM_GROUP, "crashed", {stream: ">"}, count=1)
+
+    c = C("stream_crash", queue_backend="stream")
+    c.flush_update("add")
+    assert c.read_state("value") == 5
+
+    # Entries are acknowledged right after their waiters are notified
+    c.shutdown()
+    assert redis_con.xpending(stream, update_task.STREAM_GROUP)["pending"] == 0
+    redis_con.close()
+
+
+def test_stream_heartbeat(monkeypatch):
+    monkeypatch.setattr(update_task, "STREAM_HEARTBEAT_INTERVAL", 0.05)
+
+    c = C("stream_heartbeat", queue_backend="stream")
+    stream = c._executor._get_queue_identifier("slow_count", "slow_count")
+    control_stream = c._executor._control_queue
+    redis_con = redis.Redis(**c._executor._redis_params.dict())
+
+    # The entry being processed stays fresh, so it isn't claimed while the
+    # update op runs
+    c.run("slow_count")
+    pending = []
+    while not pending:
+        pending = redis_con.xpending_range(stream, update_task.STREAM_GROUP, "-", "+", 1)
+    time.sleep(0.3)
+    pending = redis_con.xpending_range(stream, update_task.STREAM_GROUP, "-", "+", 1)
+    assert pending[0]["time_since_delivered"] < 300
+
+    # The control stream expires if the task crashes
+    assert 0 < redis_con.ttl(control_stream) <= update_task.CONTROL_STREAM_TTL
+
+    c.flush_update("slow_count")
+    assert c.read_state("count") == 1
+    c.shutdown()
+
+    # Clearing the instance deletes leftover control streams
+    redis_con.xadd(control_stream, {"stop": "1"})
+    clear_instance("StreamQueue__stream_heartbeat")
+    assert not redis_con.exists(control_stream)
+    redis_con.close()
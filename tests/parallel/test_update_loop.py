@@ -0,0 +1,89 @@
+from motion import Component
+from motion.server.update_loop import UpdateLoop
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+C = Component("AsyncUpdateLoop")
+Pooled = Component("AsyncUpdatePool")
+
+running = []
+max_running = []
+
+
+@C.init_state
+def setup():
+    return {"threads": []}
+
+
+@C.update("record")
+async def record(state, props):
+    await asyncio.sleep(0.01)
+    return {"threads": state["threads"] + [threading.current_thread().name]}
+
+
+@Pooled.init_state
+def setupPooled():
+    return {"count": 0}
+
+
+@Pooled.update("wait")
+async def wait(state, props):
+    running.append(1)
+    max_running.append(len(running))
+    await asyncio.sleep(0.3)
+    running.pop()
+    return {"count": state["count"] + 1}
+
+
+def test_async_updates_share_loop():
+    c = C("shared")
+    for _ in range(3):
+        c.run("record", props={})
+    c.flush_update("record")
+
+    # Every async update op ran on the long-lived loop
+    assert c.read_state("threads") == ["UpdateLoop"] * 3
+
+    c.shutdown()
+
+
+def test_update_loop_bounds_concurrency():
+    loop = UpdateLoop(max_concurrency=2)
+    running = []
+    max_running = []
+
+    async def work(i):
+        running.append(i)
+        max_running.append(len(running))
+        await asyncio.sleep(0.05)
+        running.remove(i)
+        return i
+
+    with ThreadPoolExecutor(max_workers=6) as tp:
+        results = list(tp.map(lambda i: loop.run(work(i)), range(6)))
+
+    assert results == list(range(6))
+    assert max(max_running) == 2
+
+    loop.stop()
+    assert loop.stopped
+    assert not loop._thread.is_alive()
+
+
+def test_pool_doesnt_hold_threads_for_async_updates():
+    instances = [Pooled(f"pooled_{i}", update_task_type="pool") for i in range(12)]
+    pool = instances[0]._executor._update_pool
+
+    for instance in instances:
+        instance.run("wait", props={})
+    for instance in instances:
+        instance.flush_update("wait")
+        assert instance.read_state("count") == 1
+
+    # More async update ops ran at once than the pool has threads
+    assert max(max_running) > pool.num_workers
+
+    for instance in instances:
+        instance.shutdown()
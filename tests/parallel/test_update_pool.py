@@ -0,0 +1,61 @@
+from motion import Component
+
+import threading
+
+C = Component("UpdatePool")
+
+
+@C.init_state
+def setUp():
+    return {"value": 0}
+
+
+@C.serve("add")
+def read(state, props):
+    return state["value"]
+
+
+@C.update("add")
+def add(state, props):
+    return {"value": state["value"] + props["value"]}
+
+
+def test_update_pool():
+    num_threads = threading.active_count()
+    instances = [C(f"pool_{i}", update_task_type="pool") for i in range(20)]
+
+    for i, instance in enumerate(instances):
+        instance.run("add", props={"value": i}, ignore_cache=True)
+        instance.run("add", props={"value": i}, ignore_cache=True)
+
+    for i, instance in enumerate(instances):
+        instance.flush_update("add")
+        assert instance.read_state("value") == 2 * i
+
+    # Instances share the pool's threads instead of starting their own
+    assert not any(
+        t.name.startswith("UpdateTask-UpdatePool") for t in threading.enumerate()
+    )
+    assert threading.active_count() - num_threads < 20
+
+    pool = instances[0]._executor._update_pool
+    for instance in instances:
+        instance.shutdown()
+
+    assert not pool._tasks
+
+
+def test_update_pool_shared_instance():
+    # Two executors of the same instance register with the pool
+    first = C("pool_shared", update_task_type="pool")
+    second = C("pool_shared", update_task_type="pool")
+
+    # The instance's update ops keep running until both shut down
+    first.shutdown()
+    second.run("add", props={"value": 3}, ignore_cache=True, flush_update=False)
+    second.flush_update("add")
+    assert second.read_state("value") == 3
+
+    pool = second._executor._update_pool
+    second.shutdown()
+    assert "UpdatePool__pool_shared" not in pool._tasks
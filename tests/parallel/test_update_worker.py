@@ -0,0 +1,85 @@
+from motion import Component
+from motion.server.worker import UpdateWorker
+
+import motion.instance
+import pytest
+import threading
+
+C = Component("ExternalUpdates")
+
+
+@C.init_state
+def setUp():
+    return {"value": 0}
+
+
+@C.serve("add")
+def read(state, props):
+    return state["value"]
+
+
+@C.update("add")
+def add(state, props):
+    return {"value": state["value"] + props["value"]}
+
+
+def test_update_worker():
+    # Serving instances only enqueue updates
+    instances = [C(f"external_{i}", update_task_type="external") for i in range(3)]
+    for instance in instances:
+        assert instance._executor.worker_task is None
+        instance.run("add", props={"value": 2}, ignore_cache=True)
+
+    worker = UpdateWorker(C, concurrency=2, rescan_interval=0.05)
+    worker_thread = threading.Thread(target=worker.run, daemon=True)
+    worker_thread.start()
+
+    for instance in instances:
+        instance.flush_update("add")
+        assert instance.read_state("value") == 2
+
+    assert set(worker.instances) == {i.instance_name for i in instances}
+
+    worker.stop()
+    worker_thread.join()
+    assert not worker.instances
+
+    for instance in instances:
+        instance.shutdown()
+
+
+def test_worker_finds_drained_instances():
+    # The worker only checks for instances once a minute, so it has to hear
+    # about new updates when they're queued
+    worker = UpdateWorker(C, rescan_interval=60)
+    worker_thread = threading.Thread(target=worker.run, daemon=True)
+    worker_thread.start()
+    assert worker._subscribed.wait(10)
+
+    instance = C("external_drained", update_task_type="external")
+    instance.run("add", props={"value": 2}, ignore_cache=True)
+    instance.flush_update("add", timeout=10)
+    assert instance.read_state("value") == 2
+
+    # Instances are still found after their queues are drained and deleted
+    instance.run("add", props={"value": 3}, ignore_cache=True)
+    instance.flush_update("add", timeout=10)
+    assert instance.read_state("value") == 5
+
+    worker.stop()
+    worker_thread.join()
+    instance.shutdown()
+
+
+def test_flush_without_workers(monkeypatch):
+    instance = C("external_unflushed", update_task_type="external")
+    instance.run("add", props={"value": 2}, ignore_cache=True)
+
+    with pytest.raises(TimeoutError):
+        instance.flush_update("add", timeout=0.2)
+
+    # Shutting down doesn't wait forever for a worker to flush the updates
+    monkeypatch.setattr(motion.instance, "EXTERNAL_FLUSH_TIMEOUT", 0.2)
+    instance.flush_on_exit = True
+    instance.shutdown()
+    assert not instance.running
@@ -0,0 +1,140 @@
+from motion import Component
+from motion.blobs import BlobCache, BlobStore
+from motion.redis_scripts import CLAIM_ORPHANS, FORGET_ORPHAN, get_script
+from motion.utils import get_redis_params, inspect_state
+
+import os
+import redis
+import tempfile
+
+cache_dir = tempfile.mkdtemp()
+blob_dir = tempfile.mkdtemp()
+
+C = Component("BlobStore", blob_store=BlobStore(threshold=10_000, cache_dir=cache_dir))
+H = Component(
+    "BlobStoreHash",
+    state_layout="hash",
+    blob_store=BlobStore(threshold=10_000, directory=blob_dir, cache_dir=None),
+)
+
+
+def setUp():
+    return {"model": list(range(10_000)), "count": 0}
+
+
+def read(state, props):
+    return state["count"]
+
+
+def increment(state, props):
+    return {"count": state["count"] + 1}
+
+
+for component in [C, H]:
+    component.init_state(setUp)
+    component.serve("count")(read)
+    component.update("count")(increment)
+
+
+def test_large_values_are_stored_once():
+    c = C("once")
+    rp = get_redis_params()
+    redis_con = redis.Redis(**rp.dict())
+
+    for _ in range(3):
+        c.run("count", ignore_cache=True, flush_update=True)
+
+    # The state only holds a reference to the model, which was written once
+    assert len(redis_con.get("MOTION_STATE:BlobStore__once")) < 1000
+    blobs = redis_con.keys("MOTION_BLOB:BlobStore__once/*")
+    assert len(blobs) == 1
+    assert c.read_state("model") == list(range(10_000))
+    assert inspect_state("BlobStore__once")["model"] == list(range(10_000))
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Replaced blobs are kept for readers of older versions
+    c.write_state({"model": list(range(20_000))})
+    assert c.read_state("model") == list(range(20_000))
+    assert len(redis_con.keys("MOTION_BLOB:BlobStore__once/*")) == 2
+    assert redis_con.zcard("MOTION_BLOB_ORPHANS:BlobStore__once") == 1
+
+    c.shutdown()
+
+
+def test_blobs_in_directory():
+    h = H("directory")
+    h.run("count", ignore_cache=True, flush_update=True)
+    assert h.read_state("count") == 1
+    assert len(os.listdir(os.path.join(blob_dir, "BlobStoreHash__directory"))) == 1
+
+    # Another instance reads the model from the directory
+    other = H("directory")
+    assert other.read_state("model") == list(range(10_000))
+
+    other.shutdown()
+    h.shutdown()
+
+
+def test_reused_blobs_are_kept():
+    c = C("reuse")
+    rp = get_redis_params()
+    redis_con = redis.Redis(**rp.dict())
+    orphans_key = "MOTION_BLOB_ORPHANS:BlobStore__reuse"
+
+    c.run("count", ignore_cache=True, flush_update=True)
+    c.write_state({"model": list(range(20_000))})
+    assert redis_con.zcard(orphans_key) == 1
+
+    # Going back to the first model takes its blob out of the orphans
+    c.write_state({"model": list(range(10_000))})
+    assert redis_con.zcard(orphans_key) == 1
+
+    # Expired orphans are swept on the next save, and the blob in use isn't
+    expired = redis_con.zrange(orphans_key, 0, -1)
+    redis_con.zadd(orphans_key, {sha: 0 for sha in expired})
+    c.write_state({"count": 5})
+    assert redis_con.zcard(orphans_key) == 0
+    assert len(redis_con.keys("MOTION_BLOB:BlobStore__reuse/*")) == 1
+    assert inspect_state("BlobStore__reuse")["model"] == list(range(10_000))
+
+    c.shutdown()
+
+
+def test_blob_cache_evicts_least_recently_used():
+    cache = BlobCache(tempfile.mkdtemp(), max_bytes=25)
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)
+    assert cache.get("a") == b"a" * 10
+
+    cache.put("c", b"c" * 10)
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a" * 10
+    assert cache.get("c") == b"c" * 10
+
+    # The size is tracked across caches on the same directory
+    assert BlobCache(cache.directory, max_bytes=25)._total == 20
+
+
+def test_blobs_reused_during_sweep_are_kept():
+    rp = get_redis_params()
+    redis_con = redis.Redis(**rp.dict())
+    orphans_key = "MOTION_BLOB_ORPHANS:BlobStore__sweep_race"
+    blob_key = "MOTION_BLOB:BlobStore__sweep_race/sha"
+    redis_con.delete(orphans_key)
+    redis_con.set(blob_key, b"blob")
+    redis_con.zadd(orphans_key, {"sha": 0})
+
+    # A writer takes the blob out of the orphans after the sweep claimed it
+    assert get_script(redis_con, CLAIM_ORPHANS)(keys=[orphans_key], args=[1]) == [
+        b"sha"
+    ]
+    redis_con.zrem(orphans_key, "sha")
+    forget = get_script(redis_con, FORGET_ORPHAN)
+    assert forget(keys=[orphans_key, blob_key], args=["sha"]) == 0
+    assert redis_con.exists(blob_key)
+
+    # Blobs still claimed are deleted with their orphan entries
+    redis_con.zadd(orphans_key, {"sha": -1})
+    assert forget(keys=[orphans_key, blob_key], args=["sha"]) == 1
+    assert not redis_con.exists(blob_key)
+    assert redis_con.zcard(orphans_key) == 0
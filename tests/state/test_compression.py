@@ -0,0 +1,100 @@
+from motion import Component
+from motion.compression import Compressor, decompress
+from motion.utils import compressionMetrics, get_redis_params
+
+import pytest
+import redis
+
+C = Component("Compressed", compression="zlib")
+Plain = Component("Compressed")
+
+
+@C.init_state
+def setUp():
+    return {"summary": "lorem ipsum " * 1000, "count": 0}
+
+
+@C.serve("summary")
+def summary(state, props):
+    return state["summary"] + props["suffix"]
+
+
+@C.update("summary")
+def count(state, props):
+    return {"count": state["count"] + 1}
+
+
+@Plain.init_state
+def plainSetUp():
+    return {"summary": "uncompressed " * 1000, "count": 0}
+
+
+@Plain.serve("summary")
+def plainSummary(state, props):
+    return state["summary"]
+
+
+def test_compressed_state_and_results():
+    c = C("state")
+    result = c.run("summary", props={"suffix": "!" * 2000}, flush_update=True)
+    assert result == "lorem ipsum " * 1000 + "!" * 2000
+
+    rp = get_redis_params()
+    redis_con = redis.Redis(**rp.dict())
+    stored = redis_con.get("MOTION_STATE:Compressed__state")
+    assert stored.startswith(b"MOTION:Z")
+    assert len(stored) < 1000
+
+    cached = [
+        redis_con.get(k) for k in redis_con.keys("MOTION_RESULT:Compressed__state/*")
+    ]
+    assert cached and all(value.startswith(b"MOTION:Z") for value in cached)
+
+    # Cache hits decompress the result
+    assert c.run("summary", props={"suffix": "!" * 2000}) == result
+    assert c.read_state("count") == 1
+
+    c.shutdown()
+
+
+def test_uncompressed_state_still_loads():
+    plain = Plain("existing")
+    plain.run("summary", props={"suffix": ""}, ignore_cache=True)
+    plain.shutdown()
+
+    c = C("existing")
+    assert c.read_state("summary") == "uncompressed " * 1000
+    c.write_state({"count": 5})
+    assert c.read_state("count") == 5
+    c.shutdown()
+
+
+def test_compressor():
+    compressor = Compressor("zlib", threshold=100)
+    assert compressor.compress(b"x" * 50) == b"x" * 50
+
+    data = b"abc" * 1000
+    compressed = compressor.compress(data)
+    assert len(compressed) < len(data)
+    assert decompress(compressed) == data
+    assert compressor.decompress(compressed) == data
+
+    stats = compressor.pop_stats()
+    assert stats["bytes_in"] == len(data)
+    assert stats["ratio"] > 10
+    assert compressor.pop_stats()["bytes_in"] == 0
+
+    with pytest.raises(ValueError):
+        Component("BadCodec", compression="brotli")
+
+
+def test_compression_metrics():
+    compressor = Compressor("zlib", threshold=100)
+    assert compressionMetrics(compressor, "C", "id", "executor", 0) == []
+
+    compressor.compress(b"abc" * 1000)
+    metrics = compressionMetrics(compressor, "C", "id", "executor", 0)
+    assert any(m.startswith("motion_compression_ratio,") for m in metrics)
+
+    # Stats are reset once they are reported
+    assert compressionMetrics(compressor, "C", "id", "executor", 0) == []
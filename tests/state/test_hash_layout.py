@@ -0,0 +1,61 @@
+from motion import Component
+from motion.redis_scripts import SAVE_STATE_FIELDS, get_script
+from motion.utils import get_redis_params, inspect_state
+
+import pytest
+import redis
+
+C = Component("HashLayout", state_layout="hash")
+
+
+@C.init_state
+def setUp():
+    return {"count": 0, "big": list(range(1000))}
+
+
+@C.serve("count")
+def read(state, props):
+    return state["count"]
+
+
+@C.update("count")
+def increment(state, props):
+    return {"count": state["count"] + props["by"]}
+
+
+def test_delta_saves():
+    c = C("delta")
+    instance_name = "HashLayout__delta"
+
+    for _ in range(3):
+        c.run("count", props={"by": 2}, ignore_cache=True, flush_update=True)
+    assert c.read_state("count") == 6
+
+    # Only the updated key was rewritten
+    rp = get_redis_params()
+    redis_con = redis.Redis(**rp.dict())
+    field_versions = redis_con.hgetall(f"MOTION_STATE_FIELD_VERSIONS:{instance_name}")
+    assert field_versions == {b"count": b"4", b"big": b"1"}
+    assert not redis_con.exists(f"MOTION_STATE:{instance_name}")
+
+    c.write_state({"extra": "x"})
+    c.shutdown()
+
+    # A new instance loads every key
+    c = C("delta")
+    assert c.read_state("big") == list(range(1000))
+    assert c.read_state("extra") == "x"
+    assert c.run("count", props={"by": 1}, ignore_cache=True, flush_update=True) == 6
+    c.shutdown()
+
+    assert inspect_state(instance_name)["count"] == 7
+
+    # Scripts are registered once per client
+    script = get_script(redis_con, SAVE_STATE_FIELDS)
+    assert get_script(redis_con, SAVE_STATE_FIELDS) is script
+    redis_con.close()
+
+
+def test_invalid_layout():
+    with pytest.raises(ValueError):
+        Component("BadLayout", state_layout="table")
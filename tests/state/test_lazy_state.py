@@ -0,0 +1,105 @@
+from motion import Component
+from motion.dicts import LazyState
+
+import pytest
+
+C = Component("LazyState", state_layout="hash", lazy_state=True)
+
+num_loads = []
+
+
+@C.init_state
+def setUp():
+    return {"summary": "empty", "rows": [], "path": "rows.db"}
+
+
+@C.load_state(fields=["path", "connection"])
+def load(state):
+    num_loads.append(1)
+    return {"path": state["path"], "connection": f"connected to {state['path']}"}
+
+
+@C.serve("summary")
+def summary(state, props):
+    return state["summary"]
+
+
+@C.serve("connection")
+def connection(state, props):
+    return state["connection"]
+
+
+@C.update("rows")
+def add_row(state, props):
+    rows = state["rows"] + [props["row"]]
+    return {"rows": rows, "summary": f"{len(rows)} rows"}
+
+
+@C.update("path")
+def set_path(state, props):
+    return {"path": props["path"]}
+
+
+def test_lazy_serve():
+    writer = C("lazy")
+    reader = C("lazy")
+
+    writer.run("rows", props={"row": "a"}, flush_update=True)
+    assert reader.run("summary", ignore_cache=True) == "1 rows"
+
+    # Keys the serve op didn't touch aren't fetched
+    state = reader._executor._state
+    assert isinstance(state, LazyState)
+    assert "rows" in state
+    assert not state.is_loaded("rows")
+    assert reader.read_state("rows") == ["a"]
+
+    # Keys that didn't change are reused after the version moves
+    writer.run("rows", props={"row": "b"}, flush_update=True)
+    assert reader.run("summary", ignore_cache=True) == "2 rows"
+    assert not reader._executor._state.is_loaded("path")
+
+    writer.shutdown()
+    reader.shutdown()
+
+
+def test_load_state_fields():
+    num_loads.clear()
+    c = C("hook")
+
+    # The hook only runs when the fields it declares change
+    c.run("path", props={"path": "other.db"}, flush_update=True)
+    assert c.run("connection", ignore_cache=True) == "connected to other.db"
+    loads_after_path = len(num_loads)
+    c.run("rows", props={"row": "a"}, flush_update=True)
+    assert c.run("connection", ignore_cache=True) == "connected to other.db"
+    assert len(num_loads) == loads_after_path
+
+    c.shutdown()
+
+
+def test_lazy_requires_hash_layout():
+    with pytest.raises(ValueError):
+        Component("LazyBlob", lazy_state=True)
+
+
+def test_fields_fetched_after_they_change():
+    writer = C("moved")
+    reader = C("moved")
+
+    writer.run("rows", props={"row": "a"}, flush_update=True)
+    assert reader.run("summary", ignore_cache=True) == "1 rows"
+    state = reader._executor._state
+    old_version = reader._executor._field_versions["rows"]
+
+    # The field is fetched at its latest version, which is recorded so the
+    # next load doesn't treat the copy as the older one
+    writer.run("rows", props={"row": "b"}, flush_update=True)
+    assert state["rows"] == ["a", "b"]
+    assert reader._executor._field_versions["rows"] > old_version
+
+    assert reader.run("summary", ignore_cache=True) == "2 rows"
+    assert reader._executor._state.is_loaded("rows")
+
+    writer.shutdown()
+    reader.shutdown()
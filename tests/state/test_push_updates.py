@@ -0,0 +1,85 @@
+from motion import Component
+
+import time
+
+C = Component("PushUpdates")
+
+
+@C.init_state
+def setUp():
+    return {"value": 0}
+
+
+@C.serve("read")
+def read(state, props):
+    return state["value"]
+
+
+@C.update("add")
+def add(state, props):
+    return {"value": state["value"] + props["value"]}
+
+
+def wait_for_subscription(instance):
+    listener = instance._executor._version_listener
+    for _ in range(100):
+        if listener.subscribed_at is not None:
+            return
+        time.sleep(0.01)
+    raise TimeoutError("Version listener never subscribed.")
+
+
+def test_serve_skips_version_lookup():
+    reader = C("push", push_state_updates=True)
+    wait_for_subscription(reader)
+
+    # The first serve op checks the version, since the last check
+    # happened before the subscription was active
+    assert reader.run("read", ignore_cache=True) == 0
+
+    num_lookups = 0
+    load_version = reader._executor._loadVersion
+
+    def counting_load_version():
+        nonlocal num_lookups
+        num_lookups += 1
+        return load_version()
+
+    reader._executor._loadVersion = counting_load_version
+
+    for _ in range(10):
+        assert reader.run("read", ignore_cache=True) == 0
+
+    assert num_lookups == 0
+
+    # A write from another instance should invalidate the cached state
+    writer = C("push")
+    writer.run("add", props={"value": 5}, flush_update=True)
+
+    for _ in range(100):
+        if reader.run("read", ignore_cache=True) == 5:
+            break
+        time.sleep(0.01)
+
+    assert reader.run("read", ignore_cache=True) == 5
+    assert num_lookups > 0
+
+    writer.shutdown()
+    reader.shutdown()
+    assert reader._executor._version_listener is None
+
+
+def test_max_staleness():
+    reader = C("push_stale", push_state_updates=True, max_state_staleness=0)
+    wait_for_subscription(reader)
+
+    version = reader.get_version()
+    reader._executor._version_listener.latest_version = version
+
+    # With no staleness allowed, every serve op looks up the version
+    assert not reader._executor._version_listener.is_current(
+        version, reader._executor._last_version_check - 1
+    )
+    assert reader.run("read", ignore_cache=True) == 0
+
+    reader.shutdown()
@@ -0,0 +1,64 @@
+from motion import Component
+from motion.serializers import CloudpickleSerializer, Pickle5Serializer, Serializer
+from motion.utils import inspect_state
+
+import numpy as np
+import pytest
+
+C = Component("Pickle5State", serializer="pickle5")
+
+
+@C.init_state
+def setUp():
+    return {"embeddings": np.zeros((100, 8), dtype=np.float32)}
+
+
+@C.serve("sum")
+def total(state, props):
+    return float(state["embeddings"].sum())
+
+
+@C.update("sum")
+def add(state, props):
+    embeddings = state["embeddings"]
+    embeddings[props["row"]] += 1
+    return {"embeddings": embeddings}
+
+
+def test_pickle5_state():
+    c = C("arrays")
+    c.run("sum", props={"row": 3}, flush_update=True)
+    assert c.read_state("embeddings").sum() == 8.0
+
+    # State written with pickle5 can be read without knowing the serializer
+    state = inspect_state("Pickle5State__arrays")
+    assert state["embeddings"].dtype == np.float32
+    assert state["embeddings"][3].tolist() == [1.0] * 8
+
+    c.shutdown()
+
+
+def test_serializers_read_each_other():
+    state = {"embeddings": np.arange(10), "name": "x"}
+    data = Pickle5Serializer().dumps(state)
+
+    loaded = CloudpickleSerializer().loads(data)
+    assert loaded["embeddings"].tolist() == list(range(10))
+    assert Pickle5Serializer(readonly=True).loads(data)["name"] == "x"
+    assert (
+        Pickle5Serializer().loads(CloudpickleSerializer().dumps(state))["name"] == "x"
+    )
+
+
+def test_custom_serializers_implement_both_methods():
+    class DumpsOnly(Serializer):
+        def dumps(self, obj):
+            return b""
+
+    with pytest.raises(TypeError):
+        DumpsOnly()
+
+
+def test_unknown_serializer():
+    with pytest.raises(ValueError):
+        Component("UnknownSerializer", serializer="yaml")
@@ -0,0 +1,109 @@
+from motion import Component, clear_instance
+
+import numpy as np
+import os
+import pytest
+
+C = Component("SharedState", shared_state=True)
+
+
+@C.init_state
+def setUp():
+    return {"embeddings": np.ones(100_000, dtype=np.float32), "count": 0}
+
+
+@C.serve("total")
+def total(state, props):
+    return float(state["embeddings"].sum()) + state["count"]
+
+
+@C.update("increment")
+def increment(state, props):
+    return {"count": state["count"] + 1}
+
+
+@C.update("scale")
+def scale(state, props):
+    state["embeddings"] *= 2
+    return {"embeddings": state["embeddings"]}
+
+
+def test_processes_share_state(tmp_path, monkeypatch):
+    monkeypatch.setenv("MOTION_SHARED_STATE_DIR", str(tmp_path))
+    writer = C("shared")
+    first = C("shared")
+    second = C("shared")
+
+    writer.run("increment", flush_update=True)
+    assert first.run("total", ignore_cache=True) == 100_001.0
+    assert second.run("total", ignore_cache=True) == 100_001.0
+
+    # Both readers map the same shared buffer instead of owning a copy
+    for reader in [first, second]:
+        embeddings = reader._executor._state["embeddings"]
+        assert not embeddings.flags.writeable
+        assert not embeddings.flags.owndata
+
+    (instance_dir,) = tmp_path.glob("SharedState__shared/*")
+    assert os.listdir(instance_dir) == [str(first._executor.version)]
+
+    # Files of older versions are unlinked once a newer one is shared
+    writer.run("increment", flush_update=True)
+    assert first.run("total", ignore_cache=True) == 100_002.0
+    assert os.listdir(instance_dir) == [str(first._executor.version)]
+
+    writer.shutdown()
+    first.shutdown()
+    second.shutdown()
+
+
+def test_flush_updates_modify_private_copy(tmp_path, monkeypatch):
+    monkeypatch.setenv("MOTION_SHARED_STATE_DIR", str(tmp_path))
+    writer = C("in_place")
+    reader = C("in_place")
+
+    writer.run("increment", flush_update=True)
+    assert reader.run("total", ignore_cache=True) == 100_001.0
+    assert not reader._executor._state["embeddings"].flags.writeable
+
+    # Update ops run on a writable copy of the shared state
+    reader.run("scale", flush_update=True)
+    assert reader.run("total", ignore_cache=True) == 200_001.0
+    assert writer.run("total", ignore_cache=True) == 200_001.0
+
+    writer.shutdown()
+    reader.shutdown()
+
+    # Cleared instances' files are deleted
+    assert list(tmp_path.glob("SharedState__in_place"))
+    clear_instance("SharedState__in_place")
+    assert not list(tmp_path.glob("SharedState__in_place"))
+
+
+def test_files_of_other_users_are_not_mapped(tmp_path, monkeypatch):
+    monkeypatch.setenv("MOTION_SHARED_STATE_DIR", str(tmp_path))
+    writer = C("other_users")
+    reader = C("other_users")
+
+    writer.run("increment", flush_update=True)
+    assert reader.run("total", ignore_cache=True) == 100_001.0
+    (epoch_dir,) = tmp_path.glob("SharedState__other_users/*")
+    assert oct(epoch_dir.stat().st_mode & 0o777) == oct(0o700)
+
+    # A directory others can write to isn't trusted
+    epoch_dir.chmod(0o777)
+    executor = reader._executor
+    assert (
+        executor._shared_state.attach(
+            executor._redis_con, "SharedState__other_users", executor.version
+        )
+        is None
+    )
+
+    writer.shutdown()
+    reader.shutdown()
+
+
+def test_shared_state_requires_blob_layout():
+    with pytest.raises(ValueError):
+        Component("SharedHash", shared_state=True, state_layout="hash")
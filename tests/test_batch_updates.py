@@ -0,0 +1,96 @@
+from motion import Component
+
+import time
+
+C = Component("BatchUpdates")
+
+waited_batches = []
+
+
+@C.init_state
+def setUp():
+    return {"value": 0, "batch_sizes": []}
+
+
+@C.serve("sum")
+def read(state, props):
+    return state["value"]
+
+
+@C.update("sum", batch_size=4, max_wait_ms=500)
+def add(state, props):
+    return {
+        "value": state["value"] + sum(p["value"] for p in props),
+        "batch_sizes": state["batch_sizes"] + [len(props)],
+    }
+
+
+@C.update("wait", batch_size=4, max_wait_ms=300)
+def record(state, props):
+    waited_batches.append((time.monotonic(), [p["value"] for p in props]))
+    return {}
+
+
+def waitForBatches(num_batches):
+    for _ in range(100):
+        if len(waited_batches) >= num_batches:
+            return
+        time.sleep(0.05)
+    raise AssertionError("Batches did not run")
+
+
+def test_batched_update():
+    c = C("batched")
+
+    # Items queued while the first one is being picked up are run together
+    c.run_many("sum", [{"value": i} for i in range(1, 11)], ignore_cache=True)
+    c.flush_update("sum")
+
+    assert c.read_state("value") == 55
+    batch_sizes = c.read_state("batch_sizes")
+    assert sum(batch_sizes) == 10
+    assert max(batch_sizes) <= 4
+    assert len(batch_sizes) < 10
+
+    # Flushing runs the update op on a batch of one
+    c.run("sum", props={"value": 5}, flush_update=True)
+    assert c.read_state("value") == 60
+    assert c.read_state("batch_sizes")[-1] == 1
+
+    c.shutdown()
+
+
+def test_partial_batch_runs_after_max_wait():
+    waited_batches.clear()
+    c = C("partial")
+
+    start = time.monotonic()
+    c.run_many("wait", [{"value": 1}, {"value": 2}])
+    waitForBatches(1)
+
+    finished, values = waited_batches[0]
+    assert values == [1, 2]
+    assert finished - start >= 0.25
+
+    c.shutdown()
+
+
+def test_items_arriving_during_wait_join_batch():
+    waited_batches.clear()
+    c = C("joined")
+
+    c.run("wait", props={"value": 1})
+    time.sleep(0.1)
+    c.run("wait", props={"value": 2})
+    waitForBatches(1)
+    assert waited_batches[0][1] == [1, 2]
+
+    # A full batch runs without waiting for the deadline
+    start = time.monotonic()
+    c.run_many("wait", [{"value": i} for i in range(4)])
+    waitForBatches(2)
+    finished, values = waited_batches[1]
+    assert values == [0, 1, 2, 3]
+    assert finished - start < 0.25
+
+    c.shutdown()
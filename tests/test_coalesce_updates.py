@@ -0,0 +1,49 @@
+from motion import Component, DiscardPolicy
+
+import pytest
+import time
+
+C = Component("CoalesceUpdates")
+
+
+@C.init_state
+def setUp():
+    return {"value": 0, "merged_sizes": []}
+
+
+def merge_values(props_list):
+    return {"values": [p["value"] for p in props_list]}
+
+
+@C.update("sum", discard_policy=DiscardPolicy.COALESCE, merge=merge_values)
+def add(state, props):
+    # Slow enough that props pile up while the update op runs
+    time.sleep(0.1)
+    return {
+        "value": state["value"] + sum(props["values"]),
+        "merged_sizes": state["merged_sizes"] + [len(props["values"])],
+    }
+
+
+@pytest.mark.parametrize("queue_backend", ["list", "stream"])
+def test_coalesced_update(queue_backend):
+    c = C(f"coalesced_{queue_backend}", queue_backend=queue_backend)
+
+    # Props queued while the update op is busy are merged into one run
+    for i in range(1, 21):
+        c.run("sum", props={"value": i})
+    c.flush_update("sum")
+
+    # Nothing is discarded
+    assert c.read_state("value") == 210
+    merged_sizes = c.read_state("merged_sizes")
+    assert sum(merged_sizes) == 20
+    assert len(merged_sizes) < 20
+
+    # Flushing runs the update op on the merged props of one flow
+    c.run("sum", props={"value": 5}, flush_update=True)
+    assert c.read_state("value") == 215
+    assert c.read_state("merged_sizes")[-1] == 1
+
+    c.shutdown()
+
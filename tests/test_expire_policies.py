@@ -102,3 +102,16 @@ async def test_async_num_new_updates():
     assert c.read_state("regular_value") == sum(range(50))
 
     c.shutdown()
+
+
+def test_num_new_updates_queue_is_bounded():
+    c = C()
+
+    queue_identifier = c._executor._get_queue_identifier("sum", "update_sum_num_new")
+    for i in range(50):
+        c.run("sum", props={"value": i})
+        # The queue is trimmed in the same transaction as the push
+        assert c._executor._redis_con.llen(queue_identifier) <= 10
+
+    c.flush_update("sum")
+    c.shutdown()
@@ -0,0 +1,85 @@
+"""
+This file tests the canonical hasher used to key cached serve results.
+"""
+
+from motion import Component
+from motion.dicts import Properties
+from motion.hashing import canonical_hash
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+
+def test_dict_order():
+    assert canonical_hash({"a": 1, "b": [1, 2]}) == canonical_hash(
+        {"b": [1, 2], "a": 1}
+    )
+    assert canonical_hash(Properties({"a": 1, "b": 2})) == canonical_hash(
+        Properties({"b": 2, "a": 1})
+    )
+    assert canonical_hash({1, 2, 3}) == canonical_hash({3, 2, 1})
+
+
+def test_types_dont_collide():
+    values = [1, 1.0, True, "1", b"1", [1], (1,), {1}, None, "None"]
+    assert len({canonical_hash(v) for v in values}) == len(values)
+    assert canonical_hash(["ab", "c"]) != canonical_hash(["a", "bc"])
+
+
+def test_numpy():
+    a = np.arange(10000, dtype=np.float64)
+    b = a.copy()
+    b[5000] = -1
+
+    # The reprs of these arrays are identical because they are truncated
+    assert str(a) == str(b)
+    assert canonical_hash(a) != canonical_hash(b)
+    assert canonical_hash(a) == canonical_hash(a.copy())
+
+    # dtype and shape are part of the hash
+    assert canonical_hash(a) != canonical_hash(a.astype(np.float32))
+    assert canonical_hash(a) != canonical_hash(a.reshape(100, 100))
+
+    # Non-contiguous views hash like their contents
+    c = np.arange(20).reshape(4, 5)
+    assert canonical_hash(c.T) == canonical_hash(np.ascontiguousarray(c.T))
+    assert canonical_hash(np.float32(1)) != canonical_hash(np.float64(1))
+
+
+def test_pandas_and_arrow():
+    df = pd.DataFrame({"a": range(1000), "b": [str(i) for i in range(1000)]})
+    df2 = df.copy()
+    df2.loc[500, "a"] = -1
+    assert canonical_hash(df) == canonical_hash(df.copy())
+    assert canonical_hash(df) != canonical_hash(df2)
+
+    arr = pa.array(range(1000))
+    assert canonical_hash(arr) == canonical_hash(pa.array(range(1000)))
+    assert canonical_hash(arr.slice(0, 10)) != canonical_hash(arr.slice(10, 10))
+    assert canonical_hash(arr.slice(10, 10)) == canonical_hash(pa.array(range(10, 20)))
+
+
+def test_unhashable():
+    with pytest.raises(TypeError):
+        canonical_hash({"gen": (i for i in range(3))})
+
+
+C = Component("HasherComponent", props_hasher=lambda props: str(props["id"]))
+
+
+@C.serve("identity")
+def identity(state, props):
+    return props["value"]
+
+
+def test_custom_hasher():
+    c = C()
+
+    assert c.run("identity", props={"id": 1, "value": 1}) == 1
+    # The custom hasher only looks at the id, so this is a cache hit
+    assert c.run("identity", props={"id": 1, "value": 2}) == 1
+    assert c.run("identity", props={"id": 2, "value": 2}) == 2
+
+    c.shutdown()